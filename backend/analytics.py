@@ -0,0 +1,114 @@
+import numpy as np
+
+CODE_BITS = 32
+
+
+class SpendBreakdown:
+    """
+    Order count, item count and spend per (group, code) for several
+    dimensions, accumulated one chunk of rows at a time with NumPy
+    instead of a Python loop per row.
+
+    A chunk is a set of equal-length integer arrays: the group of each
+    row (a user id, or all zeros for a single total), one code per
+    dimension (0 for none, below 2**32) and the row's quantity and spend
+    in cents. Sums go through float64, which is exact for totals below
+    2**53 cents.
+    """
+
+    def __init__(self, dimensions):
+        self.dimensions = tuple(dimensions)
+        self.rows = 0
+        self._totals = {dimension: {} for dimension in self.dimensions}  # key -> [orders, items, cents]
+
+    def add(self, groups, codes: dict, quantity, cents):
+        groups = np.asarray(groups, dtype=np.int64)
+        if not len(groups):
+            return
+        quantity = np.asarray(quantity, dtype=np.float64)
+        cents = np.asarray(cents, dtype=np.float64)
+        for dimension in self.dimensions:
+            keys = (groups << CODE_BITS) | np.asarray(codes[dimension], dtype=np.int64)
+            unique, inverse = np.unique(keys, return_inverse=True)
+            orders = np.bincount(inverse, minlength=len(unique))
+            items = np.bincount(inverse, weights=quantity, minlength=len(unique))
+            spent = np.bincount(inverse, weights=cents, minlength=len(unique))
+            totals = self._totals[dimension]
+            for key, key_orders, key_items, key_spent in zip(
+                unique.tolist(), orders.tolist(), items.tolist(), spent.tolist()
+            ):
+                entry = totals.get(key)
+                if entry is None:
+                    totals[key] = [key_orders, round(key_items), round(key_spent)]
+                else:
+                    entry[0] += key_orders
+                    entry[1] += round(key_items)
+                    entry[2] += round(key_spent)
+        self.rows += len(groups)
+
+    def totals(self, dimension: str):
+        """Yield (group, code, orders, items, cents) for one dimension."""
+        mask = (1 << CODE_BITS) - 1
+        for key, (orders, items, cents) in self._totals[dimension].items():
+            yield key >> CODE_BITS, key & mask, orders, items, cents
+
+
+def run_starts(*columns) -> np.ndarray:
+    """Indexes where a run of equal rows begins, for sorted parallel arrays."""
+    starts = np.ones(len(columns[0]), dtype=bool)
+    if len(starts) > 1:
+        starts[1:] = np.logical_or.reduce([column[1:] != column[:-1] for column in columns])
+    return np.flatnonzero(starts)
+
+
+def distinct(*columns) -> list:
+    """The distinct rows of parallel integer arrays, sorted by the first column, then the second, ..."""
+    columns = [np.asarray(column, dtype=np.int64) for column in columns]
+    order = np.lexsort(columns[::-1])
+    columns = [column[order] for column in columns]
+    starts = run_starts(*columns)
+    return [column[starts] for column in columns]
+
+
+def basket_pairs(baskets, items, max_basket_size: int) -> tuple:
+    """
+    For every ordered pair of different items bought together, the number
+    of baskets holding both. `baskets` and `items` are parallel integer
+    arrays (items below 2**32, repeats allowed); baskets with more than
+    max_basket_size distinct items are left out.
+
+    Returns (keys, counts) with key = (item << 32) | other_item. Pairs are
+    found by comparing each row with the one `offset` rows further on in
+    basket order, so the work is one vectorised pass per basket position
+    rather than a Python loop per basket.
+    """
+    baskets, items = distinct(baskets, items)
+    sizes = np.diff(np.append(run_starts(baskets), len(baskets)))
+    small = np.repeat(sizes <= max_basket_size, sizes)
+    baskets, items = baskets[small], items[small]
+
+    lefts, rights = [], []
+    for offset in range(1, max_basket_size):
+        same = baskets[:-offset] == baskets[offset:]
+        if not same.any():
+            break
+        lefts.append(items[:-offset][same])
+        rights.append(items[offset:][same])
+    if not lefts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    left = np.concatenate(lefts)
+    right = np.concatenate(rights)
+    keys = np.concatenate([(left << CODE_BITS) | right, (right << CODE_BITS) | left])
+    return np.unique(keys, return_counts=True)
+
+
+def purchase_spans(users, items, days) -> tuple:
+    """
+    Per (user, item): the number of distinct days it was bought on and
+    the first and last of them, as parallel arrays
+    (users, items, day_counts, first_days, last_days).
+    """
+    users, items, days = distinct(users, items, days)
+    starts = run_starts(users, items)
+    counts = np.diff(np.append(starts, len(users)))
+    return users[starts], items[starts], counts, days[starts], days[starts + counts - 1]
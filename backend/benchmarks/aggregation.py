@@ -0,0 +1,140 @@
+"""
+Spend aggregation benchmark.
+
+Loads --rows shopping history rows spread over --users users into a
+temporary SQLite database and times building per-user spend breakdowns
+(category, status, payment method, month) three ways:
+
+    row loop  fetch each row and add it up in Python (accumulate_rollups)
+    sql       one GROUP BY query per dimension
+    numpy     integer chunks aggregated with NumPy (load_spend_breakdown)
+
+for the whole table and for a single user's history. Reports rows/s:
+
+    python benchmarks/aggregation.py --rows 200000 --users 1000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def seed(main, database, rows: int, users: int) -> int:
+    """Returns the id of the user with the most rows."""
+    now = datetime.now()
+    rng = random.Random(42)
+    with database.engine.begin() as connection:
+        connection.execute(main.User.__table__.insert(), [
+            {"email": f"bench{i}@example.com", "is_active": True, "is_verified": True, "created_at": now}
+            for i in range(users)
+        ])
+        user_ids = connection.execute(main.select(main.User.id)).scalars().all()
+    # A skewed spread, so one user has a sizeable history
+    weights = [1 / (rank + 1) for rank in range(len(user_ids))]
+    batch = []
+    for i in range(rows):
+        quantity = rng.randint(1, 5)
+        price = round(rng.uniform(1, 200), 2)
+        batch.append({
+            "user_id": rng.choices(user_ids, weights)[0],
+            "token": f"bench-{i}",
+            "product_name": f"Product {rng.randint(1, 2000)}",
+            "category": rng.choice(["grocery", "electronics", "clothing", "home", "toys", None]),
+            "quantity": quantity,
+            "price_per_unit": price,
+            "total_price": round(price * quantity, 2),
+            "payment_method": rng.choice(["card", "upi", "cash"]),
+            "status": rng.choice(["completed", "completed", "pending", "processing", "cancelled"]),
+            "created_at": now - timedelta(minutes=rng.randint(0, 525600)),
+            "updated_at": now,
+        })
+        if len(batch) >= 5000 or i == rows - 1:
+            values = main.history_storage_rows(database, batch)
+            with database.engine.begin() as connection:
+                connection.execute(main.ShoppingHistory.__table__.insert(), values)
+            batch = []
+    return user_ids[0]
+
+
+def row_loop(main, connection, conditions) -> int:
+    history = main.ShoppingHistory
+    deltas = {}
+    rows = connection.execute(
+        main.select(*[getattr(history, field) for field in main.ROLLUP_FIELDS])
+        .where(*conditions)
+        .execution_options(yield_per=main.EXPORT_BATCH_SIZE)
+    ).mappings().all()
+    label_names = main.rollup_label_names(connection, rows)
+    for values in rows:
+        main.accumulate_rollups(deltas, values, label_names)
+    return len(rows)
+
+
+def sql_group_by(main, connection, conditions) -> int:
+    history = main.ShoppingHistory
+    rows = 0
+    for code in main.ANALYTICS_CODES.values():
+        result = connection.execute(
+            main.select(
+                history.user_id, code, main.func.count(), main.func.sum(history.quantity), main.func.sum(history.total_cents)
+            ).where(*conditions).group_by(history.user_id, code)
+        ).all()
+        rows += len(result)
+    return rows
+
+
+def numpy_breakdown(main, connection, conditions) -> int:
+    return main.load_spend_breakdown(connection, *conditions).rows
+
+
+def median_seconds(repeat: int, fn) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'aggregation.db')}"
+        os.environ.setdefault("EMAIL_DISPATCHER_ENABLED", "false")
+
+        import main
+        from config import get_settings
+
+        database = main.Database(get_settings())
+        main.create_schema(database)
+        user_id = seed(main, database, args.rows, args.users)
+
+        print(f"{'':<10} {'rows':>8} {'row loop':>12} {'sql':>12} {'numpy':>12}   rows/s")
+        for scope, conditions in (
+            ("all", []),
+            ("one user", [main.ShoppingHistory.user_id == user_id]),
+        ):
+            with database.engine.connect() as connection:
+                rows = connection.scalar(main.select(main.func.count()).select_from(main.ShoppingHistory).where(*conditions))
+                rates = [
+                    rows / median_seconds(args.repeat, lambda: fn(main, connection, conditions))
+                    for fn in (row_loop, sql_group_by, numpy_breakdown)
+                ]
+            print(f"{scope:<10} {rows:>8} " + " ".join(f"{rate:>12,.0f}" for rate in rates))
+        database.engine.dispose()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,352 @@
+"""
+Mixed-workload load test for the auth and shopping-history API.
+
+Starts the app under uvicorn against a fresh SQLite file (or the given
+--database-url), with SMTP pointed at a local sink that captures OTP
+emails. Seeds --users verified users and --history shopping-history
+rows, then drives a weighted mix of flows from --concurrency async
+clients for --duration seconds:
+
+    signup -> verify-signup, login, send-otp -> verify-otp,
+    profile, shopping-history
+
+Per-endpoint req/s and p50/p95/p99 latency are printed and written to
+--output as JSON, so runs can be compared across commits:
+
+    python benchmarks/load_test.py --users 500 --history 50000 --output before.json
+
+Requires the packages in benchmarks/requirements.txt.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import httpx
+from aiosmtpd.controller import Controller
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "bench-password"
+OTP_PATTERN = re.compile(r"code is: (\d+)")
+
+# Relative frequency of each flow in the mix
+WORKLOAD = {
+    "signup_flow": 1,
+    "login": 3,
+    "otp_flow": 1,
+    "profile": 10,
+    "shopping_history": 5,
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class OTPSink:
+    """SMTP handler that remembers the last code mailed to each address."""
+
+    def __init__(self):
+        self.codes = {}
+        self.received = 0
+        self._lock = threading.Lock()
+
+    async def handle_DATA(self, server, session, envelope):
+        match = OTP_PATTERN.search(envelope.content.decode("utf-8", "replace"))
+        with self._lock:
+            self.received += 1
+            if match:
+                for recipient in envelope.rcpt_tos:
+                    self.codes[recipient] = match.group(1)
+        return "250 OK"
+
+    def take(self, email: str):
+        with self._lock:
+            return self.codes.pop(email, None)
+
+    async def wait_for(self, email: str, timeout: float = 10.0):
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            code = self.take(email)
+            if code:
+                return code
+            await asyncio.sleep(0.02)
+        return None
+
+
+def seed(database_url: str, users: int, history: int, reset: bool):
+    # Imported here so DATABASE_URL is set before main builds its engines
+    os.environ["DATABASE_URL"] = database_url
+    sys.path.insert(0, BACKEND_DIR)
+    import main
+    from config import get_settings
+    from password_hashing import PasswordHasher
+
+    settings = get_settings()
+    database = main.Database(settings)
+    if reset:
+        main.Base.metadata.drop_all(bind=database.engine)
+    main.create_schema(database)
+
+    password_hash = PasswordHasher(rounds=settings.BCRYPT_ROUNDS, workers=0).hash(PASSWORD)
+    now = datetime.now()
+    rng = random.Random(42)
+    with database.engine.begin() as connection:
+        connection.execute(main.User.__table__.insert(), [
+            {
+                "email": f"bench{i}@example.com",
+                "password": password_hash,
+                "full_name": f"Bench User {i}",
+                "is_active": True,
+                "is_verified": True,
+                "created_at": now,
+            }
+            for i in range(users)
+        ])
+        user_ids = [row.id for row in connection.execute(
+            main.select(main.User.id).where(main.User.email.like("bench%@example.com"))
+        )]
+
+    def insert(batch):
+        # Labels are created on their own connection, outside this transaction
+        rows = main.history_storage_rows(database, batch)
+        with database.engine.begin() as connection:
+            connection.execute(main.ShoppingHistory.__table__.insert(), rows)
+
+    batch = []
+    for i in range(history):
+        quantity = rng.randint(1, 5)
+        price = round(rng.uniform(1, 200), 2)
+        batch.append({
+            "user_id": rng.choice(user_ids),
+            "token": f"bench-{i}",
+            "is_used": False,
+            "product_name": f"Product {rng.randint(1, 2000)}",
+            "category": rng.choice(["grocery", "electronics", "clothing", "home", "toys"]),
+            "quantity": quantity,
+            "price_per_unit": price,
+            "total_price": round(price * quantity, 2),
+            "payment_method": rng.choice(["card", "upi", "cash"]),
+            "status": rng.choice(["completed", "completed", "pending", "processing", "cancelled"]),
+            "created_at": now - timedelta(minutes=rng.randint(0, 525600)),
+            "updated_at": now,
+        })
+        if len(batch) >= 5000:
+            insert(batch)
+            batch = []
+    if batch:
+        insert(batch)
+    main.backfill_rollups(database)
+    database.engine.dispose()
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    async def call(self, client: httpx.AsyncClient, name: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            return None
+        self.latencies.setdefault(name, []).append((time.perf_counter() - started) * 1000)
+        if response.status_code >= 400:
+            self.errors[name] = self.errors.get(name, 0) + 1
+        return response
+
+
+async def client_loop(client_id: int, args, client: httpx.AsyncClient, sink: OTPSink, recorder: Recorder, deadline: float):
+    rng = random.Random(client_id)
+    # Disjoint users per client, so OTP flows don't overwrite each other's codes
+    own_users = [i for i in range(args.users) if i % args.concurrency == client_id] or [client_id % args.users]
+    flows = list(WORKLOAD)
+    weights = [WORKLOAD[flow] for flow in flows]
+
+    response = await client.post("/api/auth/login", json={"email": f"bench{own_users[0]}@example.com", "password": PASSWORD})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    signups = 0
+
+    while time.perf_counter() < deadline:
+        flow = rng.choices(flows, weights)[0]
+        email = f"bench{rng.choice(own_users)}@example.com"
+
+        if flow == "signup_flow":
+            signups += 1
+            new_email = f"new-{client_id}-{signups}-{os.getpid()}@example.com"
+            response = await recorder.call(client, "signup", "POST", "/api/auth/signup",
+                                           json={"email": new_email, "password": PASSWORD})
+            if response is not None and response.status_code == 200:
+                code = await sink.wait_for(new_email)
+                if code:
+                    await recorder.call(client, "verify-signup", "POST", "/api/auth/verify-signup",
+                                        json={"email": new_email, "otp": code})
+        elif flow == "login":
+            await recorder.call(client, "login", "POST", "/api/auth/login",
+                                json={"email": email, "password": PASSWORD})
+        elif flow == "otp_flow":
+            sink.take(email)
+            response = await recorder.call(client, "send-otp", "POST", "/api/auth/send-otp", json={"email": email})
+            if response is not None and response.status_code == 200:
+                code = await sink.wait_for(email)
+                if code:
+                    await recorder.call(client, "verify-otp", "POST", "/api/auth/verify-otp",
+                                        json={"email": email, "otp": code})
+        elif flow == "profile":
+            await recorder.call(client, "profile", "GET", "/api/user/profile", headers=headers)
+        else:
+            await recorder.call(client, "shopping-history", "GET", "/shopping-history", headers=headers)
+
+
+async def wait_until_up(client: httpx.AsyncClient):
+    for _ in range(200):
+        try:
+            await client.get("/")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+async def drive(args, base_url: str, sink: OTPSink) -> Recorder:
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        await wait_until_up(client)
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(*[
+            client_loop(client_id, args, client, sink, recorder, deadline)
+            for client_id in range(args.concurrency)
+        ])
+    return recorder
+
+
+def summarize(recorder: Recorder, duration: float) -> dict:
+    endpoints = {}
+    for name, samples in sorted(recorder.latencies.items()):
+        endpoints[name] = {
+            "requests": len(samples),
+            "errors": recorder.errors.get(name, 0),
+            "req_per_sec": round(len(samples) / duration, 1),
+            "mean_ms": round(sum(samples) / len(samples), 2),
+            "p50_ms": round(percentile(samples, 50), 2),
+            "p95_ms": round(percentile(samples, 95), 2),
+            "p99_ms": round(percentile(samples, 99), 2),
+        }
+    total = sum(len(samples) for samples in recorder.latencies.values())
+    return {"endpoints": endpoints, "total_requests": total, "total_req_per_sec": round(total / duration, 1)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args, database_url: str) -> dict:
+    sink = OTPSink()
+    smtp_port = free_port()
+    controller = Controller(sink, hostname="127.0.0.1", port=smtp_port)
+    controller.start()
+
+    if args.bcrypt_rounds:
+        os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+
+    print(f"Seeding {args.users} users and {args.history} history rows...")
+    seed_started = time.perf_counter()
+    seed(database_url, args.users, args.history, reset=args.reset or args.database_url is None)
+    seed_seconds = time.perf_counter() - seed_started
+
+    port = free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        SMTP_HOST="127.0.0.1",
+        SMTP_PORT=str(smtp_port),
+        SMTP_STARTTLS="false",
+        GMAIL_USER="bench@example.com",
+        GMAIL_APP_PASSWORD="",
+        RATE_LIMIT_ENABLED="false",  # all clients share one IP
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env
+    )
+    try:
+        recorder = asyncio.run(drive(args, f"http://127.0.0.1:{port}", sink))
+    finally:
+        server.terminate()
+        server.wait()
+        controller.stop()
+
+    result = summarize(recorder, args.duration)
+    result["meta"] = {
+        "commit": git_commit(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "database": database_url.split("://", 1)[0],
+        "users": args.users,
+        "history_rows": args.history,
+        "concurrency": args.concurrency,
+        "bcrypt_rounds": args.bcrypt_rounds,
+        "duration_seconds": args.duration,
+        "seed_seconds": round(seed_seconds, 2),
+        "emails_received": sink.received,
+    }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--history", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--bcrypt-rounds", type=int, help="override BCRYPT_ROUNDS for seeding and the server")
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    parser.add_argument("--reset", action="store_true", help="drop and recreate all tables before seeding")
+    parser.add_argument("--output", default="load-test-results.json")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = args.database_url or f"sqlite:///{os.path.join(tmp, 'load-test.db')}"
+        result = run(args, database_url)
+
+    print(f"\n{'endpoint':<18} {'req':>7} {'err':>5} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name, stats in result["endpoints"].items():
+        print(
+            f"{name:<18} {stats['requests']:>7} {stats['errors']:>5} {stats['req_per_sec']:>8.1f} "
+            f"{stats['p50_ms']:>7.1f}ms {stats['p95_ms']:>7.1f}ms {stats['p99_ms']:>7.1f}ms"
+        )
+    print(f"{'total':<18} {result['total_requests']:>7} {'':>5} {result['total_req_per_sec']:>8.1f}")
+
+    with open(args.output, "w") as output:
+        json.dump(result, output, indent=2)
+    print(f"\nWrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
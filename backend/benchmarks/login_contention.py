@@ -0,0 +1,145 @@
+"""
+Login contention benchmark.
+
+Starts the API under uvicorn against a throwaway SQLite database, then
+runs concurrent logins while polling /api/user/profile, and reports
+login throughput plus profile latency percentiles. Run it once per
+PASSWORD_HASH_WORKERS setting to compare inline vs pooled hashing:
+
+    python benchmarks/login_contention.py --hash-workers 0 1 4
+
+Requires httpx (pip install httpx).
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EMAIL = "bench@example.com"
+PASSWORD = "bench-password"
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def seed_user(database_url: str, rounds: int):
+    env = dict(os.environ, DATABASE_URL=database_url, PASSWORD_HASH_WORKERS="0", BCRYPT_ROUNDS=str(rounds))
+    script = (
+        "import main\n"
+        "from config import get_settings\n"
+        "services = main.Services(get_settings())\n"
+        "main.create_schema(services.database)\n"
+        "db = services.database.SessionLocal()\n"
+        f"db.add(main.User(email={EMAIL!r}, password=services.password_hasher.hash({PASSWORD!r}), "
+        "is_active=True, is_verified=True))\n"
+        "db.commit()\n"
+    )
+    subprocess.run([sys.executable, "-c", script], cwd=BACKEND_DIR, env=env, check=True)
+
+
+async def wait_until_up(client: httpx.AsyncClient):
+    for _ in range(100):
+        try:
+            await client.get("/")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+async def run_load(base_url: str, duration: float, login_clients: int, profile_clients: int):
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        await wait_until_up(client)
+        response = await client.post("/api/auth/login", json={"email": EMAIL, "password": PASSWORD})
+        token = response.json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        deadline = time.perf_counter() + duration
+        logins = []
+        rejected = []
+        profile_latencies = []
+
+        async def login_loop():
+            while time.perf_counter() < deadline:
+                r = await client.post("/api/auth/login", json={"email": EMAIL, "password": PASSWORD})
+                (logins if r.status_code == 200 else rejected).append(r.status_code)
+
+        async def profile_loop():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                await client.get("/api/user/profile", headers=headers)
+                profile_latencies.append((time.perf_counter() - start) * 1000)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(
+            *[login_loop() for _ in range(login_clients)],
+            *[profile_loop() for _ in range(profile_clients)]
+        )
+
+    return {
+        "logins_per_sec": len(logins) / duration,
+        "rejected": len(rejected),
+        "profile_requests": len(profile_latencies),
+        "profile_p50_ms": statistics.median(profile_latencies) if profile_latencies else 0.0,
+        "profile_p99_ms": percentile(profile_latencies, 99),
+    }
+
+
+def bench(hash_workers: int, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        seed_user(database_url, args.rounds)
+        env = dict(
+            os.environ,
+            DATABASE_URL=database_url,
+            PASSWORD_HASH_WORKERS=str(hash_workers),
+            BCRYPT_ROUNDS=str(args.rounds),
+            EMAIL_DISPATCHER_ENABLED="false",
+            RATE_LIMIT_ENABLED="false",  # every request comes from one IP and user
+        )
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env
+        )
+        try:
+            return asyncio.run(run_load(
+                f"http://127.0.0.1:{args.port}", args.duration, args.login_clients, args.profile_clients
+            ))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hash-workers", type=int, nargs="+", default=[0, 2])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--login-clients", type=int, default=16)
+    parser.add_argument("--profile-clients", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'logins/s':>10} {'rejected':>9} {'profile p50':>12} {'profile p99':>12}")
+    for hash_workers in args.hash_workers:
+        result = bench(hash_workers, args)
+        print(
+            f"{hash_workers:>8} {result['logins_per_sec']:>10.1f} {result['rejected']:>9} "
+            f"{result['profile_p50_ms']:>10.1f}ms {result['profile_p99_ms']:>10.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Shopping-history serialization benchmark.
+
+Loads --rows rows for one user into a temporary SQLite database and
+times the two halves of building a /shopping-history response body:
+
+    before  full ORM entities, jsonable_encoder and the stdlib JSONResponse
+    after   projected columns, the route's response model and ORJSONResponse
+
+Query and serialization times are reported separately, normalised to
+10k rows:
+
+    python benchmarks/serialization.py --rows 10000 --repeat 5
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def seed(main, database, rows: int) -> int:
+    now = datetime.now()
+    rng = random.Random(42)
+    with database.engine.begin() as connection:
+        user_id = connection.execute(main.User.__table__.insert().values(
+            email="bench@example.com", is_active=True, is_verified=True, created_at=now
+        )).inserted_primary_key[0]
+    batch = []
+    for i in range(rows):
+        quantity = rng.randint(1, 5)
+        price = round(rng.uniform(1, 200), 2)
+        batch.append({
+            "user_id": user_id,
+            "token": f"bench-{i}",
+            "is_used": False,
+            "product_name": f"Product {rng.randint(1, 2000)}",
+            "category": rng.choice(["grocery", "electronics", "clothing", "home", "toys"]),
+            "quantity": quantity,
+            "price_per_unit": price,
+            "total_price": round(price * quantity, 2),
+            "payment_method": rng.choice(["card", "upi", "cash"]),
+            "status": "completed",
+            "delivery_address": "1 Bench Street",
+            "created_at": now - timedelta(minutes=i),
+            "updated_at": now,
+        })
+    rows = main.history_storage_rows(database, batch)
+    with database.engine.begin() as connection:
+        connection.execute(main.ShoppingHistory.__table__.insert(), rows)
+    return user_id
+
+
+def median_of(repeat: int, fn):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples), result
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'serialization.db')}"
+        os.environ.setdefault("EMAIL_DISPATCHER_ENABLED", "false")
+
+        from fastapi.encoders import jsonable_encoder
+        from fastapi.responses import JSONResponse, ORJSONResponse
+        from fastapi.routing import serialize_response
+
+        import main
+        from config import get_settings
+
+        database = main.Database(get_settings())
+        main.create_schema(database)
+        user_id = seed(main, database, args.rows)
+        route = next(route for route in main.router.routes if getattr(route, "path", None) == "/shopping-history")
+        order = (main.ShoppingHistory.created_at.desc(), main.ShoppingHistory.id.desc())
+
+        def query_entities():
+            with database.SessionLocal() as db:
+                return db.scalars(
+                    main.select(main.ShoppingHistory).where(main.ShoppingHistory.user_id == user_id).order_by(*order)
+                ).all()
+
+        def query_columns():
+            with database.SessionLocal() as db:
+                return db.execute(
+                    main.select(*main.SHOPPING_HISTORY_COLUMNS).where(main.ShoppingHistory.user_id == user_id).order_by(*order)
+                ).all()
+
+        page = {"next_cursor": None, "has_more": False, "sync_cursor": ""}
+
+        def render_before(rows):
+            # Entities carry the binary token digest, which plain JSON can't
+            return JSONResponse(jsonable_encoder({"items": rows, **page}, custom_encoder={bytes: bytes.hex})).body
+
+        def render_after(rows):
+            content = asyncio.run(serialize_response(
+                field=route.response_field,
+                response_content={"items": [row._asdict() for row in rows], **page}
+            ))
+            return ORJSONResponse(content).body
+
+        query_before, entities = median_of(args.repeat, query_entities)
+        query_after, rows = median_of(args.repeat, query_columns)
+        render_before_seconds, body_before = median_of(args.repeat, lambda: render_before(entities))
+        render_after_seconds, body_after = median_of(args.repeat, lambda: render_after(rows))
+        database.engine.dispose()
+
+    scale = 10000 / args.rows * 1000
+    print(f"{args.rows} rows, median of {args.repeat} runs, ms per 10k rows")
+    print(f"{'':<8} {'query':>9} {'serialize':>10} {'total':>9} {'body':>10}")
+    for name, query_seconds, render_seconds, body in (
+        ("before", query_before, render_before_seconds, body_before),
+        ("after", query_after, render_after_seconds, body_after),
+    ):
+        print(
+            f"{name:<8} {query_seconds * scale:>9.1f} {render_seconds * scale:>10.1f} "
+            f"{(query_seconds + render_seconds) * scale:>9.1f} {len(body) / 1024:>8.0f}KB"
+        )
+    print(f"serialization speedup: {render_before_seconds / render_after_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,82 @@
+"""
+Cold-start benchmark.
+
+Starts the API under uvicorn --repeat times against a temporary SQLite
+database and measures how long each process takes to answer /readyz
+with 200, along with the startup time the app reports itself (import
+through lifespan). The first run migrates the empty database and is
+reported separately:
+
+    python benchmarks/startup.py --repeat 5
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+import orjson
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_to_ready(env: dict, timeout: float = 30) -> tuple:
+    """(seconds until /readyz returned 200, startup_seconds it reported)"""
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/readyz", timeout=1) as response:
+                    body = orjson.loads(response.read())
+                    return time.perf_counter() - started, body["startup_seconds"]
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.005)
+        raise RuntimeError("server did not become ready")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'startup.db')}",
+            DATABASE_REPLICA_URLS="",
+            EMAIL_DISPATCHER_ENABLED="false",
+            PURGE_ENABLED="false",
+        )
+        migrate_ready, migrate_startup = time_to_ready(dict(env, DB_MIGRATE="true"))
+        samples = [time_to_ready(dict(env, DB_MIGRATE="false")) for _ in range(args.repeat)]
+
+    print(f"{'':<16} {'to /readyz':>11} {'app startup':>12}")
+    print(f"{'first (migrate)':<16} {migrate_ready * 1000:>9.0f}ms {migrate_startup * 1000:>10.0f}ms")
+    print(
+        f"{f'median of {args.repeat}':<16} "
+        f"{statistics.median(ready for ready, _ in samples) * 1000:>9.0f}ms "
+        f"{statistics.median(startup for _, startup in samples) * 1000:>10.0f}ms"
+    )
+
+
+if __name__ == "__main__":
+    run()
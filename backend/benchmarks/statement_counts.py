@@ -0,0 +1,140 @@
+"""
+SQL statement budget check for the auth endpoints.
+
+Runs each auth flow once against a temporary SQLite database with the
+user cache disabled (the worst case) and counts the statements every
+request sends. Exits non-zero when an endpoint goes over its budget in
+STATEMENT_BUDGETS, so extra round trips are caught before they ship:
+
+    python benchmarks/statement_counts.py
+    python benchmarks/statement_counts.py --verbose   # print the SQL too
+
+tests/test_statement_counts.py runs the same check under pytest.
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Statements per request, COMMIT excluded
+STATEMENT_BUDGETS = {
+    "signup (new user)": 4,        # user lookup, insert user, insert OTP, queue email
+    "signup (unverified user)": 4, # user lookup, update user, upsert OTP, queue email
+    "resend-verification": 3,      # user lookup, upsert OTP, queue email
+    "verify-signup": 3,            # user lookup, consume OTP, activate user
+    "login": 2,                    # user lookup, update last_login
+    "send-otp": 3,                 # user lookup, upsert OTP, queue email
+    "send-otp (again)": 3,         # user lookup, upsert OTP, queue email
+    "verify-otp": 3,               # user lookup, consume OTP, update last_login
+    "profile": 1,
+    "logout": 1,                   # insert revocation
+    "forgot-password": 3,          # user lookup, insert reset token, queue email
+    "reset-password": 4,           # user + token lookup, consume token, update password, revoke sessions
+}
+
+
+def environment(database_path: str) -> dict:
+    """Environment variables measure() needs, for a database at database_path."""
+    return {
+        "DATABASE_URL": f"sqlite:///{database_path}",
+        "DB_MIGRATE": "true",
+        "DATABASE_REPLICA_URLS": "",
+        "USER_CACHE_SIZE": "0",
+        "OTP_STORE": "sql",
+        "EMAIL_DISPATCHER_ENABLED": "false",
+        "PURGE_ENABLED": "false",
+        "BCRYPT_ROUNDS": "4",
+        "PASSWORD_HASH_WORKERS": "0",
+        "RATE_LIMIT_ENABLED": "false",
+    }
+
+
+def measure() -> list:
+    """
+    Run each auth flow once against a fresh database, with environment()
+    already set by the caller. Returns (name, status_code, statements)
+    per request, in STATEMENT_BUDGETS order.
+    """
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+
+    import main
+    from config import Settings
+
+    app = main.create_app(Settings())
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(" ".join(statement.split()))
+
+    def last_emailed(pattern: str) -> str:
+        # The dispatcher is off, so codes are read from the outbox
+        with app.state.services.database.SessionLocal() as db:
+            body = db.scalars(
+                main.select(main.EmailOutbox.body).order_by(main.EmailOutbox.id.desc()).limit(1)
+            ).first()
+        return re.search(pattern, body).group(1)
+
+    email = "statements@example.com"
+    results = []
+    with TestClient(app) as client:
+        # The lifespan has built the app's engines (and schema) by now
+        event.listen(app.state.services.database.async_engine.sync_engine, "before_cursor_execute", record)
+
+        def check(name: str, method: str, url: str, **kwargs):
+            statements.clear()
+            response = client.request(method, url, **kwargs)
+            results.append((name, response.status_code, list(statements)))
+            return response
+
+        check("signup (new user)", "POST", "/api/auth/signup", json={"email": email, "password": "first"})
+        check("signup (unverified user)", "POST", "/api/auth/signup", json={"email": email, "password": "second"})
+        check("resend-verification", "POST", "/api/auth/resend-verification", json={"email": email})
+        response = check("verify-signup", "POST", "/api/auth/verify-signup",
+                         json={"email": email, "otp": last_emailed(r"code is: (\d+)")})
+        token = response.json().get("access_token")
+        check("login", "POST", "/api/auth/login", json={"email": email, "password": "second"})
+        check("send-otp", "POST", "/api/auth/send-otp", json={"email": email})
+        check("send-otp (again)", "POST", "/api/auth/send-otp", json={"email": email})
+        check("verify-otp", "POST", "/api/auth/verify-otp",
+              json={"email": email, "otp": last_emailed(r"code is: (\d+)")})
+        check("profile", "GET", "/api/user/profile", headers={"Authorization": f"Bearer {token}"})
+        check("logout", "POST", "/api/auth/logout", headers={"Authorization": f"Bearer {token}"})
+        check("forgot-password", "POST", "/api/auth/forgot-password", json={"email": email})
+        check("reset-password", "POST", "/api/auth/reset-password",
+              json={"email": email, "reset_token": last_emailed(r"token: (\S+)"), "new_password": "third"})
+    return results
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(environment(os.path.join(tmp, "statements.db")))
+        results = measure()
+
+    failures = []
+    for name, status_code, statements in results:
+        count, budget = len(statements), STATEMENT_BUDGETS[name]
+        ok = status_code == 200 and count <= budget
+        if not ok:
+            failures.append(name)
+        print(f"{'ok  ' if ok else 'FAIL'} {name:<26} {count:>2} / {budget:<2} (HTTP {status_code})")
+        if args.verbose or not ok:
+            for statement in statements:
+                print(f"       {statement[:140]}")
+
+    if failures:
+        print(f"\n{len(failures)} endpoint(s) over budget: {', '.join(failures)}")
+        sys.exit(1)
+    print("\nAll endpoints within budget")
+
+
+if __name__ == "__main__":
+    run()
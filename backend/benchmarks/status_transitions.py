@@ -0,0 +1,112 @@
+"""
+Bulk status-transition benchmark.
+
+Loads --rows pending orders into a temporary SQLite database, then moves
+them to 'processing' two ways:
+
+    orm     load and update each order through the ORM (one SELECT and
+            one UPDATE per order, rollups kept by the mapper events),
+            committing every --chunk-size orders; run on --orm-rows only
+    batch   apply_status_transitions (one SELECT and one set-based
+            UPDATE per chunk), as behind POST /shopping-history/status-transitions
+
+and reports transitions/s for each:
+
+    python benchmarks/status_transitions.py --rows 50000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def seed(main, database, rows: int):
+    now = datetime.now()
+    with database.engine.begin() as connection:
+        user_id = connection.execute(main.User.__table__.insert().values(
+            email="bench@example.com", is_active=True, is_verified=True, created_at=now
+        )).inserted_primary_key[0]
+    for start in range(0, rows, 5000):
+        values = main.history_storage_rows(database, [
+            {
+                "user_id": user_id,
+                "token": f"bench-{i}",
+                "product_name": f"Product {i}",
+                "category": "grocery",
+                "quantity": 1,
+                "price_per_unit": 9.99,
+                "total_price": 9.99,
+                "payment_method": "card",
+                "status": "pending",
+                "created_at": now,
+                "updated_at": now,
+            }
+            for i in range(start, min(rows, start + 5000))
+        ])
+        with database.engine.begin() as connection:
+            connection.execute(main.ShoppingHistory.__table__.insert(), values)
+
+
+async def orm_transitions(main, database, ids: list, chunk_size: int) -> int:
+    async with database.AsyncSessionLocal() as db:
+        for start in range(0, len(ids), chunk_size):
+            for row_id in ids[start:start + chunk_size]:
+                order = await db.get(main.ShoppingHistory, row_id)
+                if order.status_code == main.STATUS_CODES["pending"]:
+                    order.status_code = main.STATUS_CODES["processing"]
+                    await db.flush()
+            await db.commit()
+    return len(ids)
+
+
+async def batch_transitions(main, database, ids: list) -> dict:
+    transitions = [main.StatusTransition(id=row_id, status="processing") for row_id in ids]
+    async with database.AsyncSessionLocal() as db:
+        return await main.apply_status_transitions(db, transitions)
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--orm-rows", type=int, default=5000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'transitions.db')}"
+        os.environ.setdefault("EMAIL_DISPATCHER_ENABLED", "false")
+
+        import main
+        from config import get_settings
+
+        database = main.Database(get_settings())
+        main.create_schema(database)
+        main.STATUS_TRANSITION_CHUNK_SIZE = args.chunk_size
+        seed(main, database, args.rows + args.orm_rows)
+        ids = list(range(1, args.rows + args.orm_rows + 1))
+
+        started = time.perf_counter()
+        asyncio.run(orm_transitions(main, database, ids[:args.orm_rows], args.chunk_size))
+        orm_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        report = asyncio.run(batch_transitions(main, database, ids[args.orm_rows:]))
+        batch_seconds = time.perf_counter() - started
+        database.engine.dispose()
+
+    orm_rate = args.orm_rows / orm_seconds
+    batch_rate = args.rows / batch_seconds
+    print(f"{'':<6} {'orders':>8} {'seconds':>9} {'orders/s':>10}")
+    print(f"{'orm':<6} {args.orm_rows:>8} {orm_seconds:>9.2f} {orm_rate:>10,.0f}")
+    print(f"{'batch':<6} {args.rows:>8} {batch_seconds:>9.2f} {batch_rate:>10,.0f}")
+    print(f"updated {report['updated']}, rejected {report['rejected']}; speedup {batch_rate / orm_rate:.1f}x")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,154 @@
+"""
+Suggestion index benchmark.
+
+Grows a temporary SQLite database through each --sizes history size
+(baskets of 1-6 orders from --users users over a year, --products
+distinct products) and at each size reports:
+
+    rebuild   full rebuild of co_purchases and repeat_purchases
+              (rebuild_suggestions), in seconds and rows/s
+    refresh   folding in --new-rows more rows (refresh_suggestions)
+    lookup    the queries behind GET /shopping-history/suggestions
+    on demand the same related products computed with a self-join over
+              shopping_history, as a request would without the index
+
+    python benchmarks/suggestions.py --sizes 10000 50000 200000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+class Seeder:
+    def __init__(self, main, database, users: int, products: int):
+        self.main = main
+        self.database = database
+        self.rng = random.Random(42)
+        self.now = datetime.now()
+        self.count = 0  # tokens used
+        self.rows = 0
+        self.products = [f"Product {i}" for i in range(products)]
+        # A skewed spread, so some products and users dominate
+        self.product_weights = [1 / (rank + 1) for rank in range(products)]
+        with database.engine.begin() as connection:
+            connection.execute(main.User.__table__.insert(), [
+                {"email": f"bench{i}@example.com", "is_active": True, "is_verified": True, "created_at": self.now}
+                for i in range(users)
+            ])
+            self.user_ids = connection.execute(main.select(main.User.id)).scalars().all()
+        self.user_weights = [1 / (rank + 1) ** 0.5 for rank in range(len(self.user_ids))]
+
+    def add(self, rows: int):
+        rng = self.rng
+        batch = []
+        while len(batch) < rows:
+            user_id = rng.choices(self.user_ids, self.user_weights)[0]
+            day = self.now - timedelta(days=rng.randint(0, 364))
+            for product in rng.choices(self.products, self.product_weights, k=rng.randint(1, 6)):
+                self.count += 1
+                batch.append({
+                    "user_id": user_id,
+                    "token": f"bench-{self.count}",
+                    "product_name": product,
+                    "category": "grocery",
+                    "quantity": 1,
+                    "price_per_unit": 4.99,
+                    "total_price": 4.99,
+                    "payment_method": "card",
+                    "status": rng.choice(["completed", "completed", "completed", "cancelled"]),
+                    "created_at": day + timedelta(minutes=rng.randint(0, 600)),
+                    "updated_at": self.now,
+                })
+        batch = batch[:rows]
+        self.rows += len(batch)
+        for start in range(0, len(batch), 5000):
+            values = self.main.history_storage_rows(self.database, batch[start:start + 5000])
+            with self.database.engine.begin() as connection:
+                connection.execute(self.main.ShoppingHistory.__table__.insert(), values)
+
+
+def lookup(main, connection, user_id: int, product: str):
+    connection.execute(
+        main.select(main.RepeatPurchase.product, main.RepeatPurchase.next_due)
+        .where(main.RepeatPurchase.user_id == user_id, main.RepeatPurchase.next_due.isnot(None))
+        .order_by(main.RepeatPurchase.next_due, main.RepeatPurchase.product)
+        .limit(main.SUGGESTIONS_PAGE_SIZE)
+    ).all()
+    connection.execute(
+        main.select(main.CoPurchase.related_product, main.CoPurchase.basket_count)
+        .where(main.CoPurchase.product == product, main.CoPurchase.basket_count > 0)
+        .order_by(main.CoPurchase.basket_count.desc(), main.CoPurchase.related_product.desc())
+        .limit(main.SUGGESTIONS_PAGE_SIZE)
+    ).all()
+
+
+def on_demand(main, connection, product: str):
+    connection.exec_driver_sql(
+        "SELECT b.product_name, COUNT(DISTINCT a.user_id || ' ' || date(a.created_at)) AS baskets"
+        " FROM shopping_history a JOIN shopping_history b"
+        " ON b.user_id = a.user_id AND date(b.created_at) = date(a.created_at) AND b.product_name != a.product_name"
+        " WHERE a.product_name = ? AND a.status_code != ? AND b.status_code != ?"
+        " GROUP BY b.product_name ORDER BY baskets DESC LIMIT 10",
+        (product, main.STATUS_CODES["cancelled"], main.STATUS_CODES["cancelled"])
+    ).all()
+
+
+def median_ms(repeat: int, fn) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 200000])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--new-rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'suggestions.db')}"
+        os.environ.setdefault("EMAIL_DISPATCHER_ENABLED", "false")
+
+        import main
+        from config import get_settings
+
+        settings = get_settings()
+        database = main.Database(settings)
+        main.create_schema(database)
+        seeder = Seeder(main, database, args.users, args.products)
+        product = seeder.products[0]
+
+        print(f"{'rows':>8} {'rebuild':>9} {'rows/s':>9} {'pairs':>9} {'refresh':>9} {'lookup':>9} {'on demand':>10}")
+        for size in sorted(args.sizes):
+            seeder.add(size - seeder.rows)
+            report = main.rebuild_suggestions(database)
+            seeder.add(args.new_rows)
+            started = time.perf_counter()
+            main.refresh_suggestions(database, settings.SUGGESTIONS_REBUILD_HOURS)
+            refresh_seconds = time.perf_counter() - started
+            with database.engine.connect() as connection:
+                lookup_ms = median_ms(args.repeat, lambda: lookup(main, connection, seeder.user_ids[0], product))
+                on_demand_ms = median_ms(args.repeat, lambda: on_demand(main, connection, product))
+            print(
+                f"{report['rows']:>8} {report['seconds']:>8.2f}s {report['rows_per_sec']:>9,.0f} "
+                f"{report['co_purchases']:>9} {refresh_seconds:>8.2f}s {lookup_ms:>7.2f}ms {on_demand_ms:>8.1f}ms"
+            )
+        database.engine.dispose()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,170 @@
+"""
+Multi-process throughput benchmark.
+
+Starts serve.py with each --workers count against a throwaway SQLite
+database and drives /api/user/verify-token (JWT decode and JSON work,
+with the token cache off so every request pays for it) from --clients
+load-generator processes. Reports requests/s, latency percentiles and
+the speedup over the first worker count:
+
+    python benchmarks/workers.py --workers 1 2 4 8 --clients 4
+
+The load generators share the machine with the server, so leave them
+some cores (or compare counts well below the core count).
+
+Requires httpx (pip install httpx).
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EMAIL = "bench@example.com"
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def seed(database_url: str) -> str:
+    """Create the schema and one user; returns a token for them."""
+    env = dict(os.environ, DATABASE_URL=database_url)
+    script = (
+        "import main\n"
+        "from config import get_settings\n"
+        "services = main.Services(get_settings())\n"
+        "main.create_schema(services.database)\n"
+        "db = services.database.SessionLocal()\n"
+        f"user = main.User(email={EMAIL!r}, is_active=True, is_verified=True)\n"
+        "db.add(user)\n"
+        "db.commit()\n"
+        "print(main.create_access_token(services, {'user_id': user.id, 'email': user.email}))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=BACKEND_DIR, env=env, check=True, capture_output=True, text=True
+    )
+    return result.stdout.strip().splitlines()[-1]
+
+
+async def wait_until_ready(base_url: str):
+    async with httpx.AsyncClient(base_url=base_url, timeout=5) as client:
+        for _ in range(300):
+            try:
+                if (await client.get("/readyz")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError("server did not become ready")
+
+
+async def drive(base_url: str, token: str, duration: float, concurrency: int) -> tuple:
+    headers = {"Authorization": f"Bearer {token}"}
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=30, limits=limits) as client:
+        deadline = time.perf_counter() + duration
+
+        async def loop():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                response = await client.get("/api/user/verify-token", headers=headers)
+                if response.status_code == 200:
+                    latencies.append((time.perf_counter() - started) * 1000)
+                else:
+                    errors += 1
+
+        await asyncio.gather(*[loop() for _ in range(concurrency)])
+    return latencies, errors
+
+
+def client_process(base_url: str, token: str, duration: float, concurrency: int, results):
+    results.put(asyncio.run(drive(base_url, token, duration, concurrency)))
+
+
+def bench(workers: int, token: str, database_url: str, args) -> dict:
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        DATABASE_REPLICA_URLS="",
+        TOKEN_CACHE_SIZE="0",
+        EMAIL_DISPATCHER_ENABLED="false",
+        PURGE_ENABLED="false",
+        RATE_LIMIT_ENABLED="false",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--port", str(args.port)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        asyncio.run(wait_until_ready(base_url))
+        results = multiprocessing.Queue()
+        clients = [
+            multiprocessing.Process(
+                target=client_process, args=(base_url, token, args.duration, args.concurrency, results)
+            )
+            for _ in range(args.clients)
+        ]
+        for client in clients:
+            client.start()
+        latencies, errors = [], 0
+        for _ in clients:
+            client_latencies, client_errors = results.get()
+            latencies.extend(client_latencies)
+            errors += client_errors
+        for client in clients:
+            client.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        "requests_per_sec": len(latencies) / args.duration,
+        "errors": errors,
+        "p50_ms": statistics.median(latencies) if latencies else 0.0,
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=2, help="load-generator processes")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight per client process")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, {args.clients} client processes x {args.concurrency} in flight")
+    print(f"{'workers':>8} {'req/s':>9} {'speedup':>8} {'errors':>7} {'p50':>9} {'p99':>9}")
+    baseline = None
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{os.path.join(tmp, 'workers.db')}"
+        token = seed(database_url)
+        for workers in args.workers:
+            result = bench(workers, token, database_url, args)
+            baseline = baseline or result["requests_per_sec"]
+            print(
+                f"{workers:>8} {result['requests_per_sec']:>9.0f} "
+                f"{result['requests_per_sec'] / baseline if baseline else 0:>7.2f}x {result['errors']:>7} "
+                f"{result['p50_ms']:>7.1f}ms {result['p99_ms']:>7.1f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import os
+from functools import lru_cache
+from typing import Optional
+
+from pydantic import Field
+from pydantic_settings import BaseSettings
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Settings(BaseSettings):
+    # Database
+    DATABASE_URL: str
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_RECYCLE: int = 1800
+    DB_BACKGROUND_POOL_SIZE: int = 3  # sync engine, used by the background threads
+    # Connection budget for all workers started by serve.py, which
+    # shrinks each worker's pool to fit (PostgreSQL allows 100 by default)
+    DB_MAX_CONNECTIONS: int = 80
+    DB_POOL_PREWARM: int = 2  # connections opened at startup, before reporting ready
+    DB_MIGRATE: bool = False  # create missing tables and indexes at startup
+    DATABASE_REPLICA_URLS: str = ""  # comma-separated
+    REPLICA_RETRY_SECONDS: int = 30
+    REPLICA_READ_AFTER_WRITE_SECONDS: int = 10
+
+    # Serving (serve.py)
+    WEB_WORKERS: int = 0  # 0 starts one per CPU
+    # Outbox dispatcher, purge and suggestions threads; serve.py turns
+    # them off in all but one worker
+    BACKGROUND_JOBS_ENABLED: bool = True
+    GRACEFUL_TIMEOUT_SECONDS: int = 30
+
+    # Gmail SMTP
+    GMAIL_USER: Optional[str] = None
+    GMAIL_APP_PASSWORD: Optional[str] = None
+    SMTP_HOST: str = "smtp.gmail.com"
+    SMTP_PORT: int = 587
+    SMTP_STARTTLS: bool = True
+    SMTP_POOL_SIZE: int = 2
+    EMAIL_DISPATCHER_ENABLED: bool = True
+
+    # Password hashing
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = Field(default_factory=lambda: min(os.cpu_count() or 1, 4))
+    PASSWORD_HASH_MAX_PENDING: int = 64
+
+    # JWT
+    SECRET_KEY: str
+    ALGORITHM: str = "HS256"
+    ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    TOKEN_CACHE_SIZE: int = 10000  # 0 disables the cache
+    REVOCATION_REFRESH_SECONDS: int = 5
+    USER_CACHE_SIZE: int = 10000  # 0 disables the cache
+    USER_CACHE_TTL_SECONDS: int = 30
+
+    # OTP
+    OTP_EXPIRY_MINUTES: int = 5
+    OTP_LENGTH: int = 6
+    OTP_STORE: str = "sql"  # 'sql' or 'memory' (single worker only)
+    OTP_MEMORY_MAX_ENTRIES: int = 100000
+
+    # Rate limiting
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: str = "memory"
+    RATE_LIMIT_MAX_KEYS: int = 100000
+
+    # Maintenance
+    PURGE_ENABLED: bool = True
+    PURGE_INTERVAL_MINUTES: int = 60
+
+    # Reorder suggestions
+    SUGGESTIONS_ENABLED: bool = True
+    SUGGESTIONS_REFRESH_SECONDS: int = 300
+    SUGGESTIONS_REBUILD_HOURS: int = 24
+
+    # Observability
+    SERVER_TIMING_ENABLED: bool = False
+
+    # Bulk ingest (disabled when unset)
+    INGEST_API_KEY: Optional[str] = None
+
+    @property
+    def replica_urls(self) -> list:
+        return [url.strip() for url in self.DATABASE_REPLICA_URLS.split(",") if url.strip()]
+
+    class Config:
+        env_file = os.path.join(BACKEND_DIR, ".env")
+        case_sensitive = True
+        extra = "ignore"
+
+
+@lru_cache
+def get_settings() -> Settings:
+    """Settings from the environment and backend/.env, read once."""
+    return Settings()
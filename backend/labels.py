@@ -0,0 +1,68 @@
+import threading
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+
+class LabelCodes:
+    """
+    Small integer ids for open-ended strings (a row stores the id of its
+    category rather than the name). Each (kind, name) pair gets an id the
+    first time it is seen; ids are never changed or reused, so both
+    directions are cached in-process without expiry.
+
+    New labels are committed in their own transaction on `engine` before
+    any row can refer to them, so a cached id always exists in the table
+    even if the caller's transaction later rolls back.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._ids = {}    # (kind, name) -> id
+        self._names = {}  # id -> name
+        self._lock = threading.Lock()
+
+    def _remember(self, kind: str, rows):
+        with self._lock:
+            for label_id, name in rows:
+                self._ids[(kind, name)] = label_id
+                self._names[label_id] = name
+
+    def ids(self, engine, kind: str, names) -> dict:
+        """name -> id for every non-empty name, creating missing labels."""
+        missing = {name for name in names if name and (kind, name) not in self._ids}
+        if missing:
+            model = self.model
+            table = model.__table__
+            rows = [{"kind": kind, "name": name} for name in missing]
+            with engine.begin() as connection:
+                dialect = connection.dialect.name
+                if dialect in ("postgresql", "sqlite"):
+                    insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+                    connection.execute(insert(table).on_conflict_do_nothing(index_elements=["kind", "name"]), rows)
+                else:
+                    existing = set(connection.scalars(
+                        select(model.name).where(model.kind == kind, model.name.in_(missing))
+                    ).all())
+                    rows = [row for row in rows if row["name"] not in existing]
+                    if rows:
+                        connection.execute(table.insert(), rows)
+                self._remember(kind, connection.execute(
+                    select(model.id, model.name).where(model.kind == kind, model.name.in_(missing))
+                ).all())
+        return {name: self._ids[(kind, name)] for name in names if name}
+
+    def names(self, connection, ids) -> dict:
+        """id -> name for every non-empty id."""
+        missing = {label_id for label_id in ids if label_id and label_id not in self._names}
+        if missing:
+            model = self.model
+            for label_id, kind, name in connection.execute(
+                select(model.id, model.kind, model.name).where(model.id.in_(missing))
+            ):
+                self._remember(kind, [(label_id, name)])
+        return {label_id: self._names[label_id] for label_id in ids if label_id}
+
+    def __len__(self):
+        return len(self._names)
@@ -1,277 +1,3079 @@
-from dotenv import load_dotenv
-import os
-from fastapi import FastAPI, HTTPException, Depends
+import time
+BOOT_STARTED = time.perf_counter()  # for the cold-start time /readyz reports
+
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, FastAPI, HTTPException, Depends, Query, Header, Request, Response
+from fastapi.responses import StreamingResponse, PlainTextResponse, ORJSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel, EmailStr
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, ForeignKey, Text
+from pydantic import BaseModel, EmailStr, Field, ValidationError
+from sqlalchemy import create_engine, Column, Integer, SmallInteger, BigInteger, String, Boolean, Date, DateTime, ForeignKey, Text, LargeBinary, Index, MetaData, Table, and_, or_, case, cast, extract, literal, bindparam, select, tuple_, update, delete, event, func, literal_column, table, column, text
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
-from passlib.context import CryptContext
+from sqlalchemy.orm import sessionmaker, make_transient_to_detached
 from jose import jwt, JWTError
-from datetime import datetime, timedelta
-import smtplib
+from datetime import date, datetime, timedelta, timezone
 from email.mime.text import MIMEText
+from email.utils import format_datetime, parsedate_to_datetime
+import itertools
+import math
 import random
+import re
 import string
 import secrets
-from typing import Optional
+import base64
+import codecs
+import hashlib
+import csv
+import io
+import json
+import numpy as np
+import orjson
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Literal, Optional, Union
 from fastapi.middleware.cors import CORSMiddleware
+from config import Settings, get_settings
+from smtp_pool import SMTPConnectionPool
+from password_hashing import PasswordHasher, PasswordHasherBusy
+from otp_store import SQLOTPStore, MemoryOTPStore
+from token_cache import TokenCache
+from ttl_cache import TTLCache
+from replicas import ReplicaSet
+from rate_limit import Rate, MemoryRateLimiter
+from revocation import RevocationList
+from labels import LabelCodes
+from analytics import CODE_BITS, SpendBreakdown, basket_pairs, purchase_spans
+from metrics import Counter, MetricsMiddleware, instrument_engine, render_metrics, timed
 
-app = FastAPI(title="Authentication API", version="2.0.0")
+router = APIRouter(default_response_class=ORJSONResponse)
 
+origins = [
+    "http://localhost:3000",
+    "http://127.0.0.1:3000"
+]
 
-from fastapi.middleware.cors import CORSMiddleware
+# ============= CONFIGURATION =============
+# Settings (config.Settings, read from the environment and backend/.env)
+# are passed to create_app(); everything built from them lives on the
+# app's Services, so importing this module reads no configuration.
+# (per email, per client IP) budgets for the expensive auth endpoints
+RATE_LIMITS = {
+    "login": (Rate(10, 60), Rate(60, 60)),
+    "email": (Rate(5, 600), Rate(30, 600)),  # endpoints that send mail
+}
+RESET_TOKEN_EXPIRE_HOURS = 1
+SHOPPING_HISTORY_PAGE_SIZE = 50
+SHOPPING_HISTORY_MAX_PAGE_SIZE = 200
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+INGEST_CHUNK_SIZE = 1000
+INGEST_MAX_ERRORS = 1000
+# Largest price that fits the Integer cents columns
+MAX_PRICE = (2**31 - 1) / 100
+# Far below the Integer limit, so rollup item counts have room to grow
+INGEST_MAX_QUANTITY = 1000000
+STATUS_TRANSITION_CHUNK_SIZE = 1000
+STATUS_TRANSITION_MAX_BATCH = 20000
+EXPORT_BATCH_SIZE = 1000
+EMAIL_BATCH_SIZE = 50
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_BASE_SECONDS = 30
+EMAIL_SEND_LEASE_SECONDS = 120
+EMAIL_POLL_INTERVAL_SECONDS = 2
+EMAIL_OUTBOX_RETENTION_HOURS = 24
+TOMBSTONE_RETENTION_DAYS = 30
+SYNC_PAGE_SIZE = 500
+PURGE_BATCH_SIZE = 1000
+SUGGESTIONS_PAGE_SIZE = 10
+SUGGESTIONS_MAX_PAGE_SIZE = 50
+
+# ============= DATABASE SETUP =============
+# Drivers used for each backend, whichever form DATABASE_URL is given in
+SYNC_DRIVERS = {"postgresql": "postgresql+psycopg2", "sqlite": "sqlite+pysqlite"}
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+def database_url_for(url: str, drivers: dict):
+    url = make_url(url)
+    backend = url.get_backend_name()
+    return url.set(drivername=drivers[backend]) if backend in drivers else url
+
+def engine_options(url, settings: Settings, background: bool = False) -> dict:
+    options = {"pool_pre_ping": True}
+    # SQLite drivers pick their own pool class, which takes no sizing options
+    if url.get_backend_name() == "sqlite":
+        return options
+    if background:
+        # A fixed pool, so each worker's connection count has a known bound
+        options.update(pool_size=settings.DB_BACKGROUND_POOL_SIZE, max_overflow=0)
+    else:
+        options.update(pool_size=settings.DB_POOL_SIZE, max_overflow=settings.DB_MAX_OVERFLOW)
+    options["pool_recycle"] = settings.DB_POOL_RECYCLE
+    return options
+
+Base = declarative_base()
+
+# Label ids are assigned per database, so each Database keeps its own
+# LabelCodes; ORM event hooks, which only see a connection, find it by
+# the connection's engine.
+database_labels = weakref.WeakKeyDictionary()  # sync Engine -> LabelCodes
+
+def labels_for(connection) -> LabelCodes:
+    return database_labels[connection.engine]
+
+class Database:
+    """
+    The engines and session factories for one DATABASE_URL. Request
+    handlers use the async engine (or a replica's); the sync one serves
+    background threads, schema creation and the maintenance CLI. Nothing
+    connects until first use, so building one is cheap.
+    """
+
+    def __init__(self, settings: Settings):
+        sync_database_url = database_url_for(settings.DATABASE_URL, SYNC_DRIVERS)
+        async_database_url = database_url_for(settings.DATABASE_URL, ASYNC_DRIVERS)
+        self.engine = create_engine(sync_database_url, **engine_options(sync_database_url, settings, background=True))
+        self.async_engine = create_async_engine(async_database_url, **engine_options(async_database_url, settings))
+        self.SessionLocal = sessionmaker(bind=self.engine, autocommit=False, autoflush=False)
+        self.AsyncSessionLocal = async_sessionmaker(bind=self.async_engine, autoflush=False, expire_on_commit=False)
+        self.replica_set = ReplicaSet(
+            [
+                create_async_engine(url, **engine_options(url, settings))
+                for url in (database_url_for(url, ASYNC_DRIVERS) for url in settings.replica_urls)
+            ],
+            retry_after_seconds=settings.REPLICA_RETRY_SECONDS,
+            autoflush=False,
+            expire_on_commit=False
+        )
+        self.labels = LabelCodes(ShoppingLabel)
+        for sync_engine in [self.engine, self.async_engine.sync_engine,
+                            *(replica_engine.sync_engine for replica_engine in self.replica_set.engines)]:
+            # SQL statement counts and timings, per request and in /metrics
+            instrument_engine(sync_engine)
+            database_labels[sync_engine] = self.labels
+
+    async def prewarm(self, count: int):
+        """Open `count` connections at once and return them to the pool."""
+        if count <= 0:
+            return
+        connections = await asyncio.gather(*(self.async_engine.connect() for _ in range(count)))
+        for connection in connections:
+            await connection.close()
+
+    async def dispose(self):
+        await self.replica_set.dispose()
+        await self.async_engine.dispose()
+        self.engine.dispose()
+
+# Database Models
+class User(Base):
+    __tablename__ = "users"
+    id = Column(Integer, primary_key=True, index=True)
+    email = Column(String(255), unique=True, index=True, nullable=False)
+    password = Column(Text, nullable=True)
+    full_name = Column(String(255), nullable=True)
+    is_active = Column(Boolean, default=False)  
+    is_verified = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.now)
+    last_login = Column(DateTime, nullable=True)
+
+class OTP(Base):
+    __tablename__ = "otps"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    otp = Column(String(10), nullable=False)
+    expiry_time = Column(DateTime, nullable=False)
+    is_verified = Column(Boolean, default=False)
+    otp_type = Column(String(20), default="login")  # Added: 'signup', 'login', 'reset'
+    created_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        # One live code per user and type, overwritten in place (SQLOTPStore.put)
+        Index("uq_otps_user_type", "user_id", "otp_type", unique=True),
+    )
+
+class ResetToken(Base):
+    __tablename__ = "reset_tokens"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    token = Column(Text, nullable=False, unique=True)
+    expiry_time = Column(DateTime, nullable=False)
+    is_used = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+class RevokedToken(Base):
+    """
+    Revoked access tokens: one token by jti, or with jti NULL every
+    token the user was issued before revoked_at. A row can go once
+    expires_at has passed, as every token it covers has expired too.
+    """
+    __tablename__ = "revoked_tokens"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    jti = Column(String(64), nullable=True)
+    revoked_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        Index("ix_revoked_tokens_created_at", "created_at"),
+    )
+
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+    id = Column(Integer, primary_key=True, index=True)
+    recipient = Column(String(255), nullable=False)
+    subject = Column(String(255), nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(String(20), default="pending")  # 'pending', 'sending', 'sent', 'dead'
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.now)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_email_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+from sqlalchemy import (
+    Column, Integer, String, ForeignKey, Text, Boolean, DateTime, Float
+)
+from sqlalchemy.orm import relationship
+
+# Order statuses are a closed set, stored as their code
+ORDER_STATUSES = ("completed", "pending", "processing", "cancelled")
+STATUS_CODES = {name: code for code, name in enumerate(ORDER_STATUSES, start=1)}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+# Status changes fulfilment may make. Setting the current status again
+# is always allowed, e.g. to record a delivery date or retry a batch.
+STATUS_TRANSITIONS = {
+    "pending": ("processing", "completed", "cancelled"),
+    "processing": ("completed", "cancelled"),
+    "completed": (),
+    "cancelled": (),
+}
+
+class ShoppingLabel(Base):
+    """Ids for the open-ended shopping history strings; see labels.LabelCodes."""
+    __tablename__ = "shopping_labels"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(20), nullable=False)  # 'category' or 'payment_method'
+    name = Column(String(100), nullable=False)
+
+    __table_args__ = (
+        Index("uq_shopping_labels_kind_name", "kind", "name", unique=True),
+    )
+
+class ShoppingHistory(Base):
+    """
+    One order line. Stored compactly: money in integer cents, status as
+    a code from ORDER_STATUSES, category and payment method as label ids
+    and the ingest token as a 16-byte digest. API responses decode these
+    back to prices and names (SHOPPING_HISTORY_COLUMNS).
+    """
+    __tablename__ = "shopping_history"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    token_hash = Column(LargeBinary(16), nullable=False, unique=True)  # token_digest(token)
+    is_used = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+    product_name = Column(String(255), nullable=False)
+    category_id = Column(Integer, ForeignKey("shopping_labels.id"), nullable=True)
+    quantity = Column(Integer, default=1)
+    price_cents = Column(Integer, nullable=False)
+    total_cents = Column(Integer, nullable=False)
+    payment_method_id = Column(Integer, ForeignKey("shopping_labels.id"), nullable=True)
+    status_code = Column(SmallInteger, nullable=False, default=STATUS_CODES["completed"])
+    delivery_address = Column(Text, nullable=True)
+    delivery_date = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    # See ShoppingHistorySync; NULL on rows last written before it existed
+    sync_version = Column(BigInteger, nullable=True)
+
+    __table_args__ = (
+        # Keyset pagination: newest first within a user
+        Index("ix_shopping_history_user_created_id", "user_id", "created_at", "id"),
+        Index("ix_shopping_history_user_status", "user_id", "status_code"),
+        # Delta sync: rows changed since a cursor
+        Index("ix_shopping_history_user_sync_version", "user_id", "sync_version"),
+    )
+
+class ShoppingHistoryTombstone(Base):
+    """
+    Ids of deleted shopping history rows, so delta sync clients can drop
+    them. Written by a mapper event, so deletes must go through the ORM.
+    Ids are never reused, even after the newest tombstones are purged
+    (AUTOINCREMENT on SQLite).
+    """
+    __tablename__ = "shopping_history_tombstones"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    history_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, nullable=False, default=datetime.now)
+    sync_version = Column(BigInteger, nullable=True)  # see ShoppingHistorySync
+
+    __table_args__ = (
+        Index("ix_shopping_history_tombstones_user_sync_version", "user_id", "sync_version"),
+        {"sqlite_autoincrement": True},
+    )
+
+class ShoppingHistoryTombstonePurge(Base):
+    """
+    Per user, the sync version of the newest tombstone the purge has
+    removed. A sync cursor from before it may have missed deletes, so it
+    gets a reset.
+    """
+    __tablename__ = "shopping_history_tombstone_purges"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, unique=True)
+    sync_version = Column(BigInteger, nullable=False)
+
+class ShoppingHistorySync(Base):
+    """
+    Per user, the last sync version handed out. Each change to a user's
+    shopping history (a row written or deleted) takes the next version,
+    reserved in the writing transaction (reserve_sync_versions). That
+    keeps this row locked until commit, so a user's versions become
+    visible in order and a sync cursor, the highest version a client has
+    seen, never skips a change committed after it was issued.
+    """
+    __tablename__ = "shopping_history_sync"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True, autoincrement=False)
+    version = Column(BigInteger, nullable=False, default=0)
+    changed_at = Column(DateTime, nullable=True)  # of the last reservation, for Last-Modified
+
+class SpendingRollup(Base):
+    """Per-user spend totals, kept up to date as shopping history changes."""
+    __tablename__ = "spending_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    dimension = Column(String(20), nullable=False)  # 'category', 'status', 'payment_method', 'month'
+    bucket = Column(String(255), nullable=False)     # '' when the source value is empty
+    order_count = Column(Integer, nullable=False, default=0)
+    item_count = Column(Integer, nullable=False, default=0)
+    total_cents = Column(BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("uq_spending_rollups_user_dimension_bucket", "user_id", "dimension", "bucket", unique=True),
+    )
+
+class CoPurchase(Base):
+    """
+    How many baskets (one user's orders on one day) held both products.
+    Stored in both directions, so a product's most related products are
+    one index range scan. Built by the suggestions job.
+    """
+    __tablename__ = "co_purchases"
+
+    id = Column(Integer, primary_key=True, index=True)
+    product = Column(String(255), nullable=False)
+    related_product = Column(String(255), nullable=False)
+    basket_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("uq_co_purchases_product_related", "product", "related_product", unique=True),
+        # Top related products, read backwards
+        Index("ix_co_purchases_product_count", "product", "basket_count", "related_product"),
+    )
+
+class RepeatPurchase(Base):
+    """
+    A product a user has bought: on how many days, the first and last of
+    them, the average interval between purchases and when the next one
+    is due at that interval. Built by the suggestions job.
+    """
+    __tablename__ = "repeat_purchases"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    product = Column(String(255), nullable=False)
+    purchase_days = Column(Integer, nullable=False)
+    first_purchased = Column(Date, nullable=False)
+    last_purchased = Column(Date, nullable=False)
+    interval_days = Column(Float, nullable=True)  # NULL until bought on two different days
+    next_due = Column(Date, nullable=True)
+
+    __table_args__ = (
+        Index("uq_repeat_purchases_user_product", "user_id", "product", unique=True),
+        Index("ix_repeat_purchases_user_next_due", "user_id", "next_due", "product"),
+    )
+
+class SuggestionIndexState(Base):
+    """
+    Progress of the suggestion indexes (a single row): the last shopping
+    history id folded in and when they were last rebuilt. `version`
+    changes on every write, so when two workers refresh at once the
+    later commit finds it changed and rolls back.
+    """
+    __tablename__ = "suggestion_index_state"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    last_history_id = Column(Integer, nullable=False, default=0)
+    rebuilt_at = Column(DateTime, nullable=True)
+    refreshed_at = Column(DateTime, nullable=True)
+
+# ============= SHOPPING HISTORY STORAGE =============
+# Rows arrive (ingest, migration, seeding) in API terms: prices, status,
+# category and payment method names and a text token.
+LABEL_FIELDS = {"category": "category_id", "payment_method": "payment_method_id"}
+CONVERTED_FIELDS = {"token", "price_per_unit", "total_price", "status", *LABEL_FIELDS}
+
+def token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()[:16]
+
+def to_cents(amount: float) -> int:
+    return round(amount * 100)
+
+def history_label_ids(database: Database, rows: list) -> dict:
+    """kind -> {name: id} for the rows' categories and payment methods, creating new labels."""
+    return {
+        kind: database.labels.ids(database.engine, kind, {row.get(kind) for row in rows})
+        for kind in LABEL_FIELDS
+    }
+
+def history_storage_row(row: dict, label_ids: dict) -> dict:
+    """One row in API terms as shopping_history column values; other keys are passed through."""
+    values = {key: value for key, value in row.items() if key not in CONVERTED_FIELDS}
+    values["token_hash"] = token_digest(row["token"])
+    values["price_cents"] = to_cents(row["price_per_unit"])
+    values["total_cents"] = to_cents(row["total_price"])
+    values["status_code"] = STATUS_CODES[row.get("status") or "completed"]
+    for kind, field in LABEL_FIELDS.items():
+        values[field] = label_ids[kind].get(row.get(kind))
+    return values
+
+def history_storage_rows(database: Database, rows: list) -> list:
+    """
+    Convert rows in API terms to shopping_history column values, creating
+    labels for new category and payment method names.
+    """
+    label_ids = history_label_ids(database, rows)
+    return [history_storage_row(row, label_ids) for row in rows]
+
+# ============= SEARCH INDEX =============
+# Full-text index over product_name, category and delivery_address. On
+# SQLite it is an FTS5 table whose content is a view with the category
+# name joined in, kept current by triggers. On PostgreSQL it is a GIN
+# index over a tsvector column (not mapped in the model) that a trigger
+# fills from the same three fields, category name included, so one
+# index match and ts_rank cover them all. Label names never change, so
+# the trigger only needs to run when the row does.
+SEARCH_DOCUMENT_SQL = (
+    "to_tsvector('simple', coalesce({row}.product_name, '') || ' ' || "
+    "coalesce((SELECT name FROM shopping_labels WHERE shopping_labels.id = {row}.category_id), '') || ' ' || "
+    "coalesce({row}.delivery_address, ''))"
+)
+SEARCH_BACKFILL_CHUNK_SIZE = 5000
+shopping_history_fts = table("shopping_history_fts", column("rowid"), column("rank"))
+search_document = literal_column("shopping_history.search_document")
+POSTGRESQL_SEARCH_DDL = [
+    "DROP INDEX IF EXISTS ix_shopping_history_search",  # expression index from before the column
+    f"""CREATE OR REPLACE FUNCTION shopping_history_search_document() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_document := {SEARCH_DOCUMENT_SQL.format(row="NEW")};
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS shopping_history_search_document ON shopping_history",
+    """CREATE TRIGGER shopping_history_search_document
+    BEFORE INSERT OR UPDATE OF product_name, category_id, delivery_address ON shopping_history
+    FOR EACH ROW EXECUTE FUNCTION shopping_history_search_document()""",
+    "CREATE INDEX IF NOT EXISTS ix_shopping_history_search_document ON shopping_history USING GIN (search_document)",
+]
+
+SQLITE_SEARCH_TRIGGERS = ("shopping_history_fts_insert", "shopping_history_fts_delete", "shopping_history_fts_update")
+SQLITE_SEARCH_DDL = [
+    """CREATE VIEW IF NOT EXISTS shopping_history_search_source AS
+    SELECT shopping_history.id, shopping_history.product_name, shopping_labels.name AS category,
+        shopping_history.delivery_address
+    FROM shopping_history LEFT OUTER JOIN shopping_labels ON shopping_labels.id = shopping_history.category_id""",
+    """CREATE TRIGGER IF NOT EXISTS shopping_history_fts_insert AFTER INSERT ON shopping_history BEGIN
+        INSERT INTO shopping_history_fts (rowid, product_name, category, delivery_address)
+        VALUES (new.id, new.product_name, (SELECT name FROM shopping_labels WHERE id = new.category_id),
+            new.delivery_address);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS shopping_history_fts_delete AFTER DELETE ON shopping_history BEGIN
+        INSERT INTO shopping_history_fts (shopping_history_fts, rowid, product_name, category, delivery_address)
+        VALUES ('delete', old.id, old.product_name, (SELECT name FROM shopping_labels WHERE id = old.category_id),
+            old.delivery_address);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS shopping_history_fts_update
+    AFTER UPDATE OF product_name, category_id, delivery_address ON shopping_history BEGIN
+        INSERT INTO shopping_history_fts (shopping_history_fts, rowid, product_name, category, delivery_address)
+        VALUES ('delete', old.id, old.product_name, (SELECT name FROM shopping_labels WHERE id = old.category_id),
+            old.delivery_address);
+        INSERT INTO shopping_history_fts (rowid, product_name, category, delivery_address)
+        VALUES (new.id, new.product_name, (SELECT name FROM shopping_labels WHERE id = new.category_id),
+            new.delivery_address);
+    END""",
+]
+
+def ensure_search_index(database: Database):
+    """Create the dialect's search index if missing. Idempotent."""
+    engine = database.engine
+    added = False
+    with engine.begin() as connection:
+        if engine.dialect.name == "sqlite":
+            for statement in SQLITE_SEARCH_DDL:
+                connection.execute(text(statement))
+            exists = connection.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'shopping_history_fts'"
+            )).first()
+            if not exists:
+                connection.execute(text(
+                    "CREATE VIRTUAL TABLE shopping_history_fts USING fts5("
+                    "product_name, category, delivery_address, content='shopping_history_search_source', "
+                    "content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+                ))
+                # Index rows written before the table existed
+                connection.execute(text("INSERT INTO shopping_history_fts (shopping_history_fts) VALUES ('rebuild')"))
+        elif engine.dialect.name == "postgresql":
+            columns = {column["name"] for column in sa_inspect(connection).get_columns("shopping_history")}
+            added = "search_document" not in columns
+            if added:
+                connection.execute(text("ALTER TABLE shopping_history ADD COLUMN search_document tsvector"))
+            for statement in POSTGRESQL_SEARCH_DDL:
+                connection.execute(text(statement))
+    if added:
+        backfill_search_documents(database)
+
+def backfill_search_documents(database: Database, chunk_size: int = SEARCH_BACKFILL_CHUNK_SIZE):
+    """Fill search_document for rows written before the trigger existed, chunk_size rows per transaction."""
+    statement = text(
+        f"UPDATE shopping_history SET search_document = {SEARCH_DOCUMENT_SQL.format(row='shopping_history')} "
+        "WHERE id IN (SELECT id FROM shopping_history WHERE search_document IS NULL ORDER BY id LIMIT :chunk_size)"
+    )
+    while True:
+        with database.engine.begin() as connection:
+            if connection.execute(statement, {"chunk_size": chunk_size}).rowcount < chunk_size:
+                return
+
+# ============= SCHEMA MIGRATION =============
+# shopping_history used to keep prices as floats, status, category and
+# payment method as free text and the ingest token as text. A table in
+# that layout is renamed aside, converted into the new table in chunks
+# and dropped. The conversion resumes where it stopped if interrupted.
+LEGACY_HISTORY_TABLE = "shopping_history_legacy"
+HISTORY_CONVERSION_CHUNK_SIZE = 5000
+
+def legacy_status_code(status: Optional[str]) -> Optional[int]:
+    # Free-text statuses, matched ignoring case and spacing; rows without
+    # one get the column default
+    return STATUS_CODES.get((status or "completed").strip().lower())
+
+def prepare_history_conversion(database: Database) -> tuple:
+    """
+    Move a shopping_history table in the old layout aside, out of the
+    way of create_all, and drop spending rollups in the old layout
+    (float totals). Returns (legacy table to convert, rollups to rebuild).
+    """
+    engine = database.engine
+    inspector = sa_inspect(engine)
+    tables = inspector.get_table_names()
+    if "shopping_history" in tables and "price_per_unit" in {
+        column["name"] for column in inspector.get_columns("shopping_history")
+    }:
+        with engine.connect() as connection:
+            statuses = connection.execute(text("SELECT DISTINCT status FROM shopping_history")).scalars().all()
+        unknown = sorted(str(status) for status in statuses if legacy_status_code(status) is None)
+        if unknown:
+            raise RuntimeError(
+                f"shopping_history has statuses outside {', '.join(ORDER_STATUSES)}: {', '.join(unknown)}; "
+                "update those rows before migrating"
+            )
+        primary_key = inspector.get_pk_constraint("shopping_history")["name"]
+        
+        with engine.begin() as connection:
+            if engine.dialect.name == "sqlite":
+                for trigger in SQLITE_SEARCH_TRIGGERS:
+                    connection.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+                connection.execute(text("DROP TABLE IF EXISTS shopping_history_fts"))
+            connection.execute(text("DROP INDEX IF EXISTS ix_shopping_history_search"))
+            # Index names are per schema, so free them for the new table
+            for index in inspector.get_indexes("shopping_history"):
+                if index["name"] and not index.get("duplicates_constraint"):
+                    connection.execute(text(f"DROP INDEX IF EXISTS {index['name']}"))
+            connection.execute(text(f"ALTER TABLE shopping_history RENAME TO {LEGACY_HISTORY_TABLE}"))
+            if engine.dialect.name == "postgresql" and primary_key:
+                connection.execute(text(
+                    f"ALTER TABLE {LEGACY_HISTORY_TABLE} RENAME CONSTRAINT {primary_key} TO {LEGACY_HISTORY_TABLE}_pkey"
+                ))
+        tables.append(LEGACY_HISTORY_TABLE)
+    
+    legacy_rollups = "spending_rollups" in tables and "total_spent" in {
+        column["name"] for column in inspector.get_columns("spending_rollups")
+    }
+    if legacy_rollups:
+        SpendingRollup.__table__.drop(engine)
+    converting = LEGACY_HISTORY_TABLE in tables
+    return converting, converting or legacy_rollups
+
+def convert_legacy_history(database: Database, chunk_size: int = HISTORY_CONVERSION_CHUNK_SIZE) -> int:
+    """
+    Copy rows from the legacy table into shopping_history, keeping their
+    ids, and rebuild the rollups before dropping it. Run with writes
+    paused. Returns the number of rows copied.
+    """
+    engine = database.engine
+    legacy = Table(LEGACY_HISTORY_TABLE, MetaData(), autoload_with=engine)
+    with engine.connect() as connection:
+        last_id = connection.scalar(select(func.max(ShoppingHistory.id))) or 0
+    rows = 0
+    while True:
+        with engine.connect() as connection:
+            chunk = connection.execute(
+                select(legacy).where(legacy.c.id > last_id).order_by(legacy.c.id).limit(chunk_size)
+            ).mappings().all()
+        if not chunk:
+            break
+        values = []
+        for row in chunk:
+            row = dict(row)
+            row["status"] = STATUS_NAMES[legacy_status_code(row["status"])]
+            values.append(row)
+        values = history_storage_rows(database, values)
+        with engine.begin() as connection:
+            connection.execute(ShoppingHistory.__table__.insert(), values)
+        rows += len(values)
+        last_id = chunk[-1]["id"]
+        print(f"🔁 Converted shopping history up to id {last_id}")
+    
+    with engine.begin() as connection:
+        if engine.dialect.name == "postgresql":
+            connection.execute(text(
+                "SELECT setval(pg_get_serial_sequence('shopping_history', 'id'), "
+                "coalesce((SELECT max(id) FROM shopping_history), 0) + 1, false)"
+            ))
+    backfill_rollups(database)
+    legacy.drop(engine)
+    return rows
+
+def ensure_tombstone_autoincrement(database: Database):
+    """
+    Rebuild a SQLite shopping_history_tombstones table created without
+    AUTOINCREMENT, which would hand a purged id out again.
+    """
+    if database.engine.dialect.name != "sqlite":
+        return
+    with database.engine.begin() as connection:
+        sql = connection.execute(text(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'shopping_history_tombstones'"
+        )).scalar()
+        if sql is None or "AUTOINCREMENT" in sql.upper():
+            return
+        for index in sa_inspect(connection).get_indexes("shopping_history_tombstones"):
+            connection.execute(text(f"DROP INDEX IF EXISTS {index['name']}"))
+        connection.execute(text("ALTER TABLE shopping_history_tombstones RENAME TO shopping_history_tombstones_old"))
+        ShoppingHistoryTombstone.__table__.create(connection)
+        connection.execute(text(
+            "INSERT INTO shopping_history_tombstones (id, user_id, history_id, deleted_at) "
+            "SELECT id, user_id, history_id, deleted_at FROM shopping_history_tombstones_old"
+        ))
+        connection.execute(text("DROP TABLE shopping_history_tombstones_old"))
+
+def ensure_sync_versions(database: Database):
+    """
+    Add the sync_version columns to shopping history and tombstone tables
+    created before sync cursors used them, replacing the indexes on
+    updated_at and tombstone id. Existing rows keep NULL: sync cursors
+    from before then get a reset and reload the full history anyway.
+    Purge records holding tombstone ids are dropped for the same reason.
+    """
+    engine = database.engine
+    inspector = sa_inspect(engine)
+    with engine.begin() as connection:
+        for model, old_index in (
+            (ShoppingHistory, "ix_shopping_history_user_updated_id"),
+            (ShoppingHistoryTombstone, "ix_shopping_history_tombstones_user_id"),
+        ):
+            table = model.__table__
+            if "sync_version" in {column["name"] for column in inspector.get_columns(table.name)}:
+                continue
+            connection.execute(text(f"DROP INDEX IF EXISTS {old_index}"))
+            connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN sync_version BIGINT"))
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+        purges = ShoppingHistoryTombstonePurge.__table__
+        if "tombstone_id" in {column["name"] for column in inspector.get_columns(purges.name)}:
+            purges.drop(connection)
+            purges.create(connection)
+
+def ensure_unique_otps(database: Database):
+    """
+    Give an otps table created before codes were upserted its unique
+    (user_id, otp_type) index, first deleting all but the newest row of
+    each pair (older codes have been superseded).
+    """
+    engine = database.engine
+    if "uq_otps_user_type" in {index["name"] for index in sa_inspect(engine).get_indexes("otps")}:
+        return
+    with engine.begin() as connection:
+        connection.execute(text(
+            "DELETE FROM otps WHERE id NOT IN (SELECT max(id) FROM otps GROUP BY user_id, otp_type)"
+        ))
+        connection.execute(text("DROP INDEX IF EXISTS ix_otps_user_type_created"))
+        for index in OTP.__table__.indexes:
+            index.create(connection, checkfirst=True)
+
+def backfill_created_at(database: Database):
+    """
+    Give legacy shopping history rows with no created_at their updated_at
+    (or the current time), so every row has a place in keyset pages.
+    """
+    with database.engine.begin() as connection:
+        connection.execute(
+            update(ShoppingHistory)
+            .where(ShoppingHistory.created_at.is_(None))
+            .values(created_at=func.coalesce(ShoppingHistory.updated_at, datetime.now()))
+            .execution_options(synchronize_session=False)
+        )
+
+def widen_label_id_columns(database: Database):
+    """
+    Widen category_id and payment_method_id on a PostgreSQL
+    shopping_history created with them as SMALLINT, which overflows once
+    there are more than 32767 labels. SQLite doesn't enforce the size.
+    """
+    engine = database.engine
+    if engine.dialect.name != "postgresql":
+        return
+    columns = {column["name"]: column["type"] for column in sa_inspect(engine).get_columns("shopping_history")}
+    narrow = [field for field in LABEL_FIELDS.values() if isinstance(columns.get(field), SmallInteger)]
+    if narrow:
+        with engine.begin() as connection:
+            connection.execute(text(
+                "ALTER TABLE shopping_history " + ", ".join(f"ALTER COLUMN {field} TYPE INTEGER" for field in narrow)
+            ))
+
+def create_schema(database: Database):
+    """
+    Create missing tables and indexes, converting shopping history stored
+    in the old layout (DB_MIGRATE or `maintenance.py migrate`).
+    """
+    converting, rebuild_rollups = prepare_history_conversion(database)
+    Base.metadata.create_all(bind=database.engine)
+    ensure_tombstone_autoincrement(database)
+    ensure_sync_versions(database)
+    ensure_unique_otps(database)
+    widen_label_id_columns(database)
+    backfill_created_at(database)
+    if converting:
+        convert_legacy_history(database)
+    elif rebuild_rollups:
+        backfill_rollups(database)
+    ensure_search_index(database)
+
+# ============= UTILITIES =============
+security = HTTPBearer()
+rate_limit_rejections = Counter("rate_limit_rejections_total", "Requests rejected by the rate limiter.", ["action"])
+
+class Services:
+    """
+    Everything an app builds from its Settings: the database, caches and
+    stores, the password hasher and the mail pool. The lifespan keeps one
+    on app.state.services and request dependencies read it from there,
+    so apps built with different settings share none of it.
+    """
+
+    def __init__(self, settings: Settings, database: Optional[Database] = None):
+        self.settings = settings
+        self.database = database or Database(settings)
+        self.password_hasher = PasswordHasher(
+            rounds=settings.BCRYPT_ROUNDS,
+            workers=settings.PASSWORD_HASH_WORKERS,
+            max_pending=settings.PASSWORD_HASH_MAX_PENDING
+        )
+        self.token_cache = TokenCache(max_entries=settings.TOKEN_CACHE_SIZE)
+        self.revocation_list = RevocationList(RevokedToken)
+        self.user_cache = TTLCache(max_entries=settings.USER_CACHE_SIZE, ttl_seconds=settings.USER_CACHE_TTL_SECONDS)
+        if settings.OTP_STORE == "memory":
+            self.otp_store = MemoryOTPStore(max_entries=settings.OTP_MEMORY_MAX_ENTRIES)
+        else:
+            self.otp_store = SQLOTPStore(OTP, dialect_insert)
+        if settings.RATE_LIMIT_BACKEND == "memory":
+            self.rate_limiter = MemoryRateLimiter(max_keys=settings.RATE_LIMIT_MAX_KEYS)
+        else:
+            raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {settings.RATE_LIMIT_BACKEND}")
+        self.smtp_pool = SMTPConnectionPool(
+            settings.SMTP_HOST, settings.SMTP_PORT,
+            username=settings.GMAIL_USER,
+            password=settings.GMAIL_APP_PASSWORD,
+            starttls=settings.SMTP_STARTTLS,
+            size=settings.SMTP_POOL_SIZE
+        )
+        self.email_executor = ThreadPoolExecutor(max_workers=settings.SMTP_POOL_SIZE, thread_name_prefix="email")
+        self.outbox_wakeup = threading.Event()
+
+    async def close(self):
+        """Release pools and connections; background threads must be stopped first."""
+        self.password_hasher.shutdown()
+        self.email_executor.shutdown()
+        self.smtp_pool.close()
+        await self.database.dispose()
+
+def get_services(request: Request) -> Services:
+    return request.app.state.services
+
+async def get_db(services: Services = Depends(get_services)):
+    async with services.database.AsyncSessionLocal() as db:
+        yield db
+
+def enforce_rate_limit(services: Services, action: str, client: Request, email: str):
+    """Raise 429 if this email or client IP is over its budget for `action`."""
+    if not services.settings.RATE_LIMIT_ENABLED:
+        return
+    per_email, per_ip = RATE_LIMITS[action]
+    ip = client.client.host if client.client else "unknown"
+    wait = services.rate_limiter.hit([
+        ((action, "email", email.lower()), per_email),
+        ((action, "ip", ip), per_ip),
+    ])
+    if wait:
+        rate_limit_rejections.inc(action=action)
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests. Please try again later.",
+            headers={"Retry-After": str(math.ceil(wait))}
+        )
+
+async def hash_password(services: Services, password: str) -> str:
+    try:
+        with timed("bcrypt"):
+            return await services.password_hasher.hash_async(password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Server busy. Please try again.", headers={"Retry-After": "1"})
+
+async def verify_password(services: Services, plain_password: str, hashed_password: str) -> bool:
+    try:
+        with timed("bcrypt"):
+            return await services.password_hasher.verify_async(plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Server busy. Please try again.", headers={"Retry-After": "1"})
+
+# ============= USER CACHE =============
+# Users are cached as detached snapshots keyed by id and by email. Each
+# worker has its own cache, so a change made elsewhere shows up here
+# within USER_CACHE_TTL_SECONDS (plus replication lag, for snapshots
+# read from a replica); writers invalidate their own worker's entries
+# after committing.
+def cache_user(services: Services, user: User):
+    snapshot = User(**{column.key: getattr(user, column.key) for column in User.__table__.columns})
+    make_transient_to_detached(snapshot)
+    services.user_cache.set(("id", user.id), snapshot)
+    services.user_cache.set(("email", user.email), snapshot)
+
+def forget_user(services: Services, user: User):
+    services.user_cache.delete(("id", user.id), ("email", user.email))
+
+async def get_user_by_email(services: Services, db: AsyncSession, email: str, use_cache: bool = True) -> Optional[User]:
+    """
+    A cached snapshot may be up to USER_CACHE_TTL_SECONDS old; paths that
+    write the user, or decide from its state whether to, pass
+    use_cache=False to read the row fresh.
+    """
+    if use_cache:
+        cached = services.user_cache.get(("email", email))
+        if cached is not None:
+            # Attach a copy to this session without re-selecting the row
+            return await db.merge(cached, load=False)
+    user = await db.scalar(select(User).where(User.email == email))
+    if user is not None:
+        cache_user(services, user)
+    return user
+
+async def get_user_for_read(services: Services, current_user: dict) -> Optional[User]:
+    """
+    The token's user, for read-only requests. A read session (see
+    open_read_session) is only opened on a cache miss. The shared
+    snapshot is returned as-is and must not be modified.
+    """
+    user_id = current_user["user_id"]
+    cached = services.user_cache.get(("id", user_id))
+    if cached is not None:
+        return cached
+    db = await open_read_session(services, current_user)
+    try:
+        user = await db.get(User, user_id)
+        if user is not None:
+            cache_user(services, user)
+    finally:
+        await db.close()
+    return user
+
+def create_access_token(services: Services, data: dict) -> str:
+    settings = services.settings
+    to_encode = data.copy()
+    expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    # Sub-second iat, so a revoke-all doesn't catch a login made in the
+    # same second right after it
+    to_encode.update({"exp": expire, "iat": time.time(), "jti": secrets.token_urlsafe(16)})
+    with timed("jwt"):
+        return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+
+def verify_token(services: Services, token: str) -> Optional[dict]:
+    payload = services.token_cache.get(token)
+    if payload is None:
+        try:
+            with timed("jwt"):
+                payload = jwt.decode(token, services.settings.SECRET_KEY, algorithms=[services.settings.ALGORITHM])
+        except JWTError:
+            return None
+        services.token_cache.put(token, payload)
+    # In-memory check; the list is refreshed in the background
+    if services.revocation_list.is_revoked(payload):
+        return None
+    return payload
+
+def revoke_tokens(services: Services, db: AsyncSession, user_id: int, jti: Optional[str] = None,
+                  expires_at: Optional[datetime] = None) -> RevokedToken:
+    """
+    Stage a revocation of one token (jti, expiring at expires_at) or,
+    without a jti, of every token the user holds. Pass the row to
+    services.revocation_list.add_row() once committed.
+    """
+    now = datetime.now()
+    if jti is None:
+        expires_at = now + timedelta(minutes=services.settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    revoked = RevokedToken(user_id=user_id, jti=jti, revoked_at=now, expires_at=expires_at)
+    db.add(revoked)
+    return revoked
+
+def generate_otp(length: int) -> str:
+    return ''.join(random.choices(string.digits, k=length))
+
+def generate_reset_token() -> str:
+    return secrets.token_urlsafe(32)
+
+def send_email(services: Services, recipient: str, subject: str, body: str):
+    """Send one message; SMTP errors propagate so the outbox can record them."""
+    sender = services.settings.GMAIL_USER
+    message = MIMEText(body)
+    message["Subject"] = subject
+    message["From"] = sender
+    message["To"] = recipient
+    
+    with timed("smtp"):
+        services.smtp_pool.send(sender, recipient, message.as_string())
+
+def deliver_email(services: Services, recipient: str, subject: str, body: str) -> Optional[str]:
+    """Send one outbox message. Returns None once sent, else the error text."""
+    try:
+        send_email(services, recipient, subject, body)
+    except Exception as e:
+        print(f"❌ Email sending failed: {e}")
+        return f"{type(e).__name__}: {e}"
+    return None
+
+# ============= EMAIL OUTBOX =============
+def enqueue_email(services: Services, db: AsyncSession, recipient: str, subject: str, body: str):
+    """
+    Queue an email in the caller's transaction; it is delivered by the
+    outbox dispatcher once the transaction commits.
+    """
+    db.add(EmailOutbox(recipient=recipient, subject=subject, body=body))
+    event.listen(db.sync_session, "after_commit", lambda session: services.outbox_wakeup.set(), once=True)
+
+def dispatch_outbox_batch(services: Services) -> int:
+    """
+    Claim and send one batch of due messages. Returns how many were claimed.
+    """
+    db = services.database.SessionLocal()
+    try:
+        now = datetime.now()
+        # Claiming pushes next_attempt_at out by a lease, so messages left
+        # 'sending' by a crashed worker are picked up again later
+        messages = db.query(EmailOutbox).filter(
+            EmailOutbox.status.in_(("pending", "sending")),
+            EmailOutbox.next_attempt_at <= now
+        ).order_by(EmailOutbox.next_attempt_at).limit(EMAIL_BATCH_SIZE).with_for_update(skip_locked=True).all()
+        
+        if not messages:
+            return 0
+        
+        claimed = [(m.id, m.recipient, m.subject, m.body, m.attempts) for m in messages]
+        for message in messages:
+            message.status = "sending"
+            message.next_attempt_at = now + timedelta(seconds=EMAIL_SEND_LEASE_SECONDS)
+        db.commit()
+        
+        errors = list(services.email_executor.map(
+            lambda item: deliver_email(services, item[1], item[2], item[3]), claimed
+        ))
+        
+        sent_ids = [item[0] for item, error in zip(claimed, errors) if error is None]
+        if sent_ids:
+            db.query(EmailOutbox).filter(EmailOutbox.id.in_(sent_ids)).update(
+                {"status": "sent", "sent_at": datetime.now()}, synchronize_session=False
+            )
+        
+        for item, error in zip(claimed, errors):
+            if error is None:
+                continue
+            attempts = item[4] + 1
+            values = {"attempts": attempts, "last_error": error}
+            if attempts >= EMAIL_MAX_ATTEMPTS:
+                values["status"] = "dead"
+            else:
+                values["status"] = "pending"
+                backoff = EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+                values["next_attempt_at"] = datetime.now() + timedelta(seconds=backoff)
+            db.query(EmailOutbox).filter(EmailOutbox.id == item[0]).update(values, synchronize_session=False)
+        
+        db.commit()
+        return len(claimed)
+    finally:
+        db.close()
+
+def drain_outbox(services: Services):
+    while dispatch_outbox_batch(services):
+        pass
+
+def run_outbox_dispatcher(services: Services, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            processed = dispatch_outbox_batch(services)
+        except Exception as e:
+            print(f"❌ Email outbox dispatch failed: {e}")
+            processed = 0
+        if not processed:
+            services.outbox_wakeup.wait(EMAIL_POLL_INTERVAL_SECONDS)
+            services.outbox_wakeup.clear()
+
+def start_outbox_dispatcher(app: FastAPI):
+    app.state.outbox_stop = threading.Event()
+    app.state.outbox_thread = threading.Thread(
+        target=run_outbox_dispatcher, args=(app.state.services, app.state.outbox_stop),
+        name="email-outbox", daemon=True
+    )
+    app.state.outbox_thread.start()
+
+def stop_outbox_dispatcher(app: FastAPI):
+    thread = getattr(app.state, "outbox_thread", None)
+    if thread is not None:
+        app.state.outbox_stop.set()
+        app.state.services.outbox_wakeup.set()
+        thread.join(timeout=10)
+
+# ============= MAINTENANCE =============
+def purge_in_batches(db, model, condition) -> int:
+    # Small id-bounded deletes, each in its own transaction, so the
+    # purge never holds locks on a large range of rows
+    removed = 0
+    while True:
+        ids = db.scalars(select(model.id).where(condition).limit(PURGE_BATCH_SIZE)).all()
+        if not ids:
+            return removed
+        db.execute(delete(model).where(model.id.in_(ids)))
+        db.commit()
+        removed += len(ids)
+        if len(ids) < PURGE_BATCH_SIZE:
+            return removed
+
+def record_tombstone_purges(db, condition):
+    """Remember, per user, the newest sync version of tombstones matching `condition` before they are purged."""
+    rows = [
+        {"user_id": user_id, "sync_version": sync_version}
+        for user_id, sync_version in db.execute(
+            select(ShoppingHistoryTombstone.user_id, func.max(ShoppingHistoryTombstone.sync_version))
+            .where(condition)
+            .group_by(ShoppingHistoryTombstone.user_id)
+        )
+        if sync_version is not None
+    ]
+    if not rows:
+        return
+    
+    # Older tombstones are already gone, so the new maximum is never lower
+    table = ShoppingHistoryTombstonePurge.__table__
+    upsert = dialect_insert(db.get_bind().dialect.name)
+    if upsert is not None:
+        insert_stmt = upsert(table)
+        db.execute(
+            insert_stmt.on_conflict_do_update(
+                index_elements=["user_id"], set_={"sync_version": insert_stmt.excluded.sync_version}
+            ),
+            rows
+        )
+    else:
+        for row in rows:
+            result = db.execute(
+                table.update().where(table.c.user_id == row["user_id"]).values(sync_version=row["sync_version"])
+            )
+            if result.rowcount == 0:
+                db.execute(table.insert().values(**row))
+    db.commit()
+
+def purge_expired_rows(database: Database) -> dict:
+    """
+    Delete expired or consumed OTPs and reset tokens, revocations of
+    tokens that have expired, and delivered outbox emails and
+    tombstones past retention. Returns per-table
+    counts and duration.
+    """
+    started = time.perf_counter()
+    now = datetime.now()
+    expired_tombstones = ShoppingHistoryTombstone.deleted_at < now - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+    db = database.SessionLocal()
+    try:
+        # Before the tombstones go, so no cursor can miss their deletes
+        record_tombstone_purges(db, expired_tombstones)
+        report = {
+            "otps": purge_in_batches(db, OTP, or_(OTP.expiry_time < now, OTP.is_verified == True)),
+            "reset_tokens": purge_in_batches(db, ResetToken, or_(ResetToken.expiry_time < now, ResetToken.is_used == True)),
+            "email_outbox": purge_in_batches(db, EmailOutbox, and_(
+                EmailOutbox.status == "sent",
+                EmailOutbox.sent_at < now - timedelta(hours=EMAIL_OUTBOX_RETENTION_HOURS)
+            )),
+            "shopping_history_tombstones": purge_in_batches(db, ShoppingHistoryTombstone, expired_tombstones),
+            "revoked_tokens": purge_in_batches(db, RevokedToken, RevokedToken.expires_at < now),
+        }
+    finally:
+        db.close()
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+def purge_summary(report: dict) -> str:
+    """Every count in a purge_expired_rows() report, e.g. '3 otps, 0 reset_tokens, ... in 0.01s'."""
+    counts = ", ".join(f"{count} {table}" for table, count in report.items() if table != "seconds")
+    return f"{counts} in {report['seconds']}s"
+
+def run_maintenance(services: Services, stop: threading.Event):
+    while True:
+        try:
+            report = purge_expired_rows(services.database)
+            print(f"🧹 Purged {purge_summary(report)}")
+        except Exception as e:
+            print(f"❌ Maintenance failed: {e}")
+        if stop.wait(services.settings.PURGE_INTERVAL_MINUTES * 60):
+            return
+
+def start_maintenance(app: FastAPI):
+    app.state.maintenance_stop = threading.Event()
+    app.state.maintenance_thread = threading.Thread(
+        target=run_maintenance, args=(app.state.services, app.state.maintenance_stop),
+        name="maintenance", daemon=True
+    )
+    app.state.maintenance_thread.start()
+
+def stop_maintenance(app: FastAPI):
+    thread = getattr(app.state, "maintenance_thread", None)
+    if thread is not None:
+        app.state.maintenance_stop.set()
+        thread.join(timeout=10)
+
+# ============= TOKEN REVOCATION =============
+def refresh_revocations(services: Services) -> int:
+    with services.database.SessionLocal() as db:
+        return services.revocation_list.refresh(db)
+
+def run_revocation_refresh(services: Services, stop: threading.Event):
+    # REVOCATION_REFRESH_SECONDS bounds how late other workers' revocations apply here
+    while not stop.wait(services.settings.REVOCATION_REFRESH_SECONDS):
+        try:
+            refresh_revocations(services)
+        except Exception as e:
+            print(f"❌ Revocation refresh failed: {e}")
+
+def start_revocation_refresh(app: FastAPI):
+    # Load every live revocation before serving, then poll for new ones
+    refresh_revocations(app.state.services)
+    app.state.revocation_stop = threading.Event()
+    app.state.revocation_thread = threading.Thread(
+        target=run_revocation_refresh, args=(app.state.services, app.state.revocation_stop),
+        name="revocation-refresh", daemon=True
+    )
+    app.state.revocation_thread.start()
+
+def stop_revocation_refresh(app: FastAPI):
+    thread = getattr(app.state, "revocation_thread", None)
+    if thread is not None:
+        app.state.revocation_stop.set()
+        thread.join(timeout=10)
+
+# ============= SPENDING ROLLUPS =============
+ROLLUP_DIMENSIONS = ("category", "status", "payment_method", "month")
+ROLLUP_FIELDS = ("user_id", "category_id", "status_code", "payment_method_id", "created_at", "quantity", "total_cents")
+ROLLUP_BACKFILL_CHUNK_SIZE = 500
+
+def dialect_insert(dialect: str):
+    """Dialect-specific insert() supporting ON CONFLICT, or None."""
+    if dialect == "postgresql":
+        return postgresql_insert
+    if dialect == "sqlite":
+        return sqlite_insert
+    return None
+
+def rollup_label_names(connection, rows) -> dict:
+    """Label id -> name for the categories and payment methods in `rows`."""
+    return labels_for(connection).names(connection, {row[field] for row in rows for field in LABEL_FIELDS.values()})
+
+def accumulate_rollups(deltas: dict, values, label_names: dict, sign: int = 1):
+    """
+    Add (sign=1) or remove (sign=-1) one shopping history row's
+    contribution to each rollup bucket in `deltas`.
+    """
+    created_at = values["created_at"]
+    buckets = {
+        "category": label_names.get(values["category_id"]),
+        "status": STATUS_NAMES.get(values["status_code"]),
+        "payment_method": label_names.get(values["payment_method_id"]),
+        "month": created_at.strftime("%Y-%m") if created_at else None,
+    }
+    for dimension in ROLLUP_DIMENSIONS:
+        delta = deltas.setdefault((values["user_id"], dimension, buckets[dimension] or ""), [0, 0, 0])
+        delta[0] += sign
+        delta[1] += sign * (values["quantity"] or 0)
+        delta[2] += sign * (values["total_cents"] or 0)
+
+def apply_rollup_deltas(connection, deltas: dict):
+    rows = [
+        {
+            "user_id": user_id,
+            "dimension": dimension,
+            "bucket": bucket,
+            "order_count": orders,
+            "item_count": items,
+            "total_cents": cents,
+        }
+        for (user_id, dimension, bucket), (orders, items, cents) in deltas.items()
+        if orders or items or cents
+    ]
+    if not rows:
+        return
+    
+    table = SpendingRollup.__table__
+    upsert = dialect_insert(connection.dialect.name)
+    if upsert is not None:
+        insert_stmt = upsert(table)
+        stmt = insert_stmt.on_conflict_do_update(
+            index_elements=["user_id", "dimension", "bucket"],
+            set_={
+                column: table.c[column] + insert_stmt.excluded[column]
+                for column in ("order_count", "item_count", "total_cents")
+            }
+        )
+        connection.execute(stmt, rows)
+        return
+    
+    for row in rows:
+        result = connection.execute(
+            table.update()
+            .where(
+                table.c.user_id == row["user_id"],
+                table.c.dimension == row["dimension"],
+                table.c.bucket == row["bucket"]
+            )
+            .values(
+                order_count=table.c.order_count + row["order_count"],
+                item_count=table.c.item_count + row["item_count"],
+                total_cents=table.c.total_cents + row["total_cents"]
+            )
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(**row))
+
+# ORM writes keep the rollups current in the same transaction. Core bulk
+# statements bypass these hooks and call apply_rollup_deltas themselves.
+def keep_previous_value(target, value, oldvalue, initiator):
+    return value
+
+# Make SQLAlchemy load the old value when one of these is assigned on an
+# expired row, so after_update can subtract what was there before
+for field in ROLLUP_FIELDS:
+    event.listen(getattr(ShoppingHistory, field), "set", keep_previous_value, active_history=True)
+
+@event.listens_for(ShoppingHistory, "after_insert")
+def rollup_after_insert(mapper, connection, target):
+    values = {field: getattr(target, field) for field in ROLLUP_FIELDS}
+    deltas = {}
+    accumulate_rollups(deltas, values, rollup_label_names(connection, [values]))
+    apply_rollup_deltas(connection, deltas)
+
+@event.listens_for(ShoppingHistory, "after_update")
+def rollup_after_update(mapper, connection, target):
+    state = sa_inspect(target)
+    new_values = {field: getattr(target, field) for field in ROLLUP_FIELDS}
+    old_values = dict(new_values)
+    for field in ROLLUP_FIELDS:
+        history = state.attrs[field].history
+        if history.deleted:
+            old_values[field] = history.deleted[0]
+    if old_values == new_values:
+        return
+    label_names = rollup_label_names(connection, [old_values, new_values])
+    deltas = {}
+    accumulate_rollups(deltas, old_values, label_names, -1)
+    accumulate_rollups(deltas, new_values, label_names, 1)
+    apply_rollup_deltas(connection, deltas)
+
+@event.listens_for(ShoppingHistory, "after_delete")
+def rollup_after_delete(mapper, connection, target):
+    values = {field: getattr(target, field) for field in ROLLUP_FIELDS}
+    deltas = {}
+    accumulate_rollups(deltas, values, rollup_label_names(connection, [values]), -1)
+    apply_rollup_deltas(connection, deltas)
+
+@event.listens_for(ShoppingHistory, "after_delete")
+def record_tombstone(mapper, connection, target):
+    connection.execute(ShoppingHistoryTombstone.__table__.insert().values(
+        user_id=target.user_id, history_id=target.id, deleted_at=datetime.now(),
+        sync_version=reserve_sync_versions(connection, [target.user_id])[0]
+    ))
+
+def backfill_rollups(database: Database, chunk_size: int = ROLLUP_BACKFILL_CHUNK_SIZE) -> dict:
+    """
+    Rebuild rollups from shopping_history, chunk_size users per
+    transaction. Run while history writes are paused.
+    """
+    started = time.perf_counter()
+    db = database.SessionLocal()
+    users = 0
+    rows = 0
+    last_user_id = 0
+    try:
+        while True:
+            user_ids = db.scalars(
+                select(User.id).where(User.id > last_user_id).order_by(User.id).limit(chunk_size)
+            ).all()
+            if not user_ids:
+                break
+            
+            db.execute(delete(SpendingRollup).where(SpendingRollup.user_id.in_(user_ids)))
+            connection = db.connection()
+            breakdown = load_spend_breakdown(connection, ShoppingHistory.user_id.in_(user_ids))
+            deltas = {
+                (user_id, dimension, bucket): [orders, items, cents]
+                for dimension, user_id, bucket, orders, items, cents in breakdown_buckets(connection, breakdown)
+            }
+            apply_rollup_deltas(connection, deltas)
+            db.commit()
+            
+            users += len(user_ids)
+            rows += breakdown.rows
+            last_user_id = user_ids[-1]
+    finally:
+        db.close()
+    return {"users": users, "rows": rows, "seconds": round(time.perf_counter() - started, 3)}
+
+def build_summary(buckets) -> dict:
+    """A ShoppingSummary from (dimension, bucket, orders, items, cents) tuples."""
+    summary = {"order_count": 0, "item_count": 0, "total_spent": 0}
+    for dimension in ROLLUP_DIMENSIONS:
+        summary[f"by_{dimension}"] = []
+    
+    for dimension, bucket, orders, items, cents in buckets:
+        if not orders:
+            continue
+        summary[f"by_{dimension}"].append({
+            "key": bucket or None,
+            "order_count": orders,
+            "item_count": items,
+            "total_spent": cents / 100
+        })
+        # Every order lands in exactly one status bucket
+        if dimension == "status":
+            summary["order_count"] += orders
+            summary["item_count"] += items
+            summary["total_spent"] += cents
+    
+    summary["total_spent"] /= 100
+    for dimension in ("category", "status", "payment_method"):
+        summary[f"by_{dimension}"].sort(key=lambda entry: entry["total_spent"], reverse=True)
+    summary["by_month"].sort(key=lambda entry: entry["key"] or "")
+    return summary
+
+# ============= SPEND ANALYTICS =============
+# Spend breakdowns computed straight from shopping_history: rows are
+# fetched as plain integers in chunks and aggregated with NumPy (see
+# analytics.SpendBreakdown). Rollups are rebuilt this way, and
+# spend_report() serves ad hoc breakdowns for a user or the whole table.
+ANALYTICS_CHUNK_SIZE = 50000
+# Integer code per rollup dimension, 0 when empty
+ANALYTICS_CODES = {
+    "category": func.coalesce(ShoppingHistory.category_id, 0),
+    "status": ShoppingHistory.status_code,
+    "payment_method": func.coalesce(ShoppingHistory.payment_method_id, 0),
+    # Months since year 0
+    "month": func.coalesce(
+        cast(extract("year", ShoppingHistory.created_at), Integer) * 12
+        + cast(extract("month", ShoppingHistory.created_at), Integer) - 1,
+        0
+    ),
+}
+
+def load_spend_breakdown(connection, *conditions, per_user: bool = True,
+                         chunk_size: int = ANALYTICS_CHUNK_SIZE) -> SpendBreakdown:
+    """
+    Aggregate the shopping history rows matching `conditions`, grouped
+    by user or (per_user=False) into a single total.
+    """
+    breakdown = SpendBreakdown(ANALYTICS_CODES)
+    columns = [
+        ShoppingHistory.user_id,
+        *ANALYTICS_CODES.values(),
+        func.coalesce(ShoppingHistory.quantity, 0),
+        ShoppingHistory.total_cents,
+    ]
+    result = connection.execute(
+        select(*columns).where(*conditions).execution_options(yield_per=chunk_size)
+    )
+    for partition in result.partitions():
+        chunk = np.fromiter(
+            itertools.chain.from_iterable(partition), dtype=np.int64, count=len(partition) * len(columns)
+        ).reshape(-1, len(columns))
+        groups = chunk[:, 0] if per_user else np.zeros(len(chunk), dtype=np.int64)
+        codes = {dimension: chunk[:, index] for index, dimension in enumerate(ANALYTICS_CODES, start=1)}
+        breakdown.add(groups, codes, chunk[:, -2], chunk[:, -1])
+    return breakdown
+
+def breakdown_buckets(connection, breakdown: SpendBreakdown):
+    """Yield (dimension, group, bucket, orders, items, cents), with codes decoded to rollup buckets."""
+    label_names = labels_for(connection).names(connection, {
+        code for dimension in LABEL_FIELDS for _, code, _, _, _ in breakdown.totals(dimension)
+    })
+    for dimension in ROLLUP_DIMENSIONS:
+        for group, code, orders, items, cents in breakdown.totals(dimension):
+            if dimension == "status":
+                bucket = STATUS_NAMES.get(code)
+            elif dimension == "month":
+                bucket = f"{code // 12:04d}-{code % 12 + 1:02d}" if code else None
+            else:
+                bucket = label_names.get(code)
+            yield dimension, group, bucket or "", orders, items, cents
+
+def spend_report(database: Database, user_id: Optional[int] = None, chunk_size: int = ANALYTICS_CHUNK_SIZE) -> dict:
+    """
+    Spend breakdown for one user, or the whole table, aggregated from
+    shopping_history rather than read from the rollups. Also reports the
+    number of rows aggregated and the rate.
+    """
+    started = time.perf_counter()
+    conditions = [] if user_id is None else [ShoppingHistory.user_id == user_id]
+    with database.engine.connect() as connection:
+        breakdown = load_spend_breakdown(connection, *conditions, per_user=False, chunk_size=chunk_size)
+        report = build_summary(
+            (dimension, bucket, orders, items, cents)
+            for dimension, _, bucket, orders, items, cents in breakdown_buckets(connection, breakdown)
+        )
+    elapsed = time.perf_counter() - started
+    report["rows"] = breakdown.rows
+    report["seconds"] = round(elapsed, 3)
+    report["rows_per_sec"] = round(breakdown.rows / elapsed, 1) if elapsed else 0.0
+    return report
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, row_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def status_code(status: str) -> int:
+    # 0 is never stored, so an unknown status matches no rows
+    return STATUS_CODES.get(status, 0)
+
+def label_id(kind: str, name: str):
+    """Scalar subquery for the id of a label (NULL if it doesn't exist)."""
+    return select(ShoppingLabel.id).where(ShoppingLabel.kind == kind, ShoppingLabel.name == name).scalar_subquery()
+
+def label_name(field):
+    return select(ShoppingLabel.name).where(ShoppingLabel.id == field).scalar_subquery()
+
+def date_bound(value: Union[datetime, date], end: bool = False) -> datetime:
+    """A plain date as a datetime bound; an end date includes the whole day."""
+    if isinstance(value, datetime):
+        return value
+    return datetime.combine(value + timedelta(days=1) if end else value, datetime.min.time())
+
+def shopping_history_filters(user_id: int, status: Optional[str] = None, category: Optional[str] = None,
+                             start_date: Union[datetime, date, None] = None,
+                             end_date: Union[datetime, date, None] = None) -> list:
+    # Rows without created_at have no keyset position (backfill_created_at
+    # fills them in on migration), so they are never listed
+    conditions = [ShoppingHistory.user_id == user_id, ShoppingHistory.created_at.is_not(None)]
+    if status:
+        conditions.append(ShoppingHistory.status_code == status_code(status))
+    if category:
+        conditions.append(ShoppingHistory.category_id == label_id("category", category))
+    if start_date:
+        conditions.append(ShoppingHistory.created_at >= date_bound(start_date))
+    if end_date:
+        conditions.append(ShoppingHistory.created_at < date_bound(end_date, end=True))
+    return conditions
+
+# Columns returned to clients (the internal token is left out); the page
+# and export queries select just these instead of loading full entities.
+# Cents, status codes and label ids are decoded in SQL, so rows come
+# back in API terms.
+SHOPPING_HISTORY_COLUMNS = [
+    ShoppingHistory.id,
+    ShoppingHistory.created_at,
+    ShoppingHistory.product_name,
+    label_name(ShoppingHistory.category_id).label("category"),
+    ShoppingHistory.quantity,
+    (cast(ShoppingHistory.price_cents, Float) / 100).label("price_per_unit"),
+    (cast(ShoppingHistory.total_cents, Float) / 100).label("total_price"),
+    label_name(ShoppingHistory.payment_method_id).label("payment_method"),
+    case(STATUS_NAMES, value=ShoppingHistory.status_code).label("status"),
+    ShoppingHistory.delivery_address,
+    ShoppingHistory.delivery_date,
+    ShoppingHistory.updated_at,
+]
+SHOPPING_HISTORY_FIELDS = [column.key for column in SHOPPING_HISTORY_COLUMNS]
+
+async def iter_export_rows(stmt, db: AsyncSession):
+    # The stream owns and closes the session: the response body is
+    # produced after the request's dependencies may have been torn down
+    async with db:
+        result = await db.stream(stmt)
+        async for row in result:
+            yield row
+
+async def stream_ndjson(stmt, db: AsyncSession):
+    buffer = []
+    async for row in iter_export_rows(stmt, db):
+        # orjson writes datetimes as ISO 8601
+        buffer.append(orjson.dumps(dict(zip(SHOPPING_HISTORY_FIELDS, row))))
+        if len(buffer) >= EXPORT_BATCH_SIZE:
+            yield b"\n".join(buffer) + b"\n"
+            buffer = []
+    if buffer:
+        yield b"\n".join(buffer) + b"\n"
+
+async def stream_csv(stmt, db: AsyncSession):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(SHOPPING_HISTORY_FIELDS)
+    # Send the header right away, before the first batch is fetched
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    
+    pending = 0
+    async for row in iter_export_rows(stmt, db):
+        writer.writerow(row)
+        pending += 1
+        if pending >= EXPORT_BATCH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if pending:
+        yield buffer.getvalue()
+
+# ============= DELTA SYNC =============
+# Every change to a user's rows or tombstones carries a sync version
+# from ShoppingHistorySync. A sync cursor is the highest version a
+# client has seen; it also serves as the version of the user's history
+# for conditional GETs. Versions, unlike app-set timestamps or ids, are
+# visible in the order they were handed out.
+def reserve_sync_versions(connection, user_ids: list) -> list:
+    """
+    Reserve a sync version for each change in the caller's transaction,
+    given the user_id of each. Returns them in the same order. The
+    users' ShoppingHistorySync rows stay locked until commit.
+    """
+    counts = {}
+    for user_id in user_ids:
+        counts[user_id] = counts.get(user_id, 0) + 1
+    now = datetime.now()
+    # In user order, so transactions reserving for several users can't deadlock
+    rows = [
+        {"user_id": user_id, "version": count, "changed_at": now}
+        for user_id, count in sorted(counts.items())
+    ]
+    table = ShoppingHistorySync.__table__
+    upsert = dialect_insert(connection.dialect.name)
+    if upsert is not None:
+        insert_stmt = upsert(table)
+        last = dict(connection.execute(
+            insert_stmt.on_conflict_do_update(
+                index_elements=["user_id"],
+                set_={"version": table.c.version + insert_stmt.excluded.version, "changed_at": now}
+            ).returning(table.c.user_id, table.c.version),
+            rows
+        ).all())
+    else:
+        last = {}
+        for row in rows:
+            result = connection.execute(
+                table.update()
+                .where(table.c.user_id == row["user_id"])
+                .values(version=table.c.version + row["version"], changed_at=now)
+            )
+            if result.rowcount == 0:
+                connection.execute(table.insert().values(**row))
+            last[row["user_id"]] = connection.scalar(select(table.c.version).where(table.c.user_id == row["user_id"]))
+    
+    next_version = {user_id: last[user_id] - count + 1 for user_id, count in counts.items()}
+    versions = []
+    for user_id in user_ids:
+        versions.append(next_version[user_id])
+        next_version[user_id] += 1
+    return versions
+
+# ORM writes take their versions here; core bulk statements reserve
+# them and set sync_version themselves
+@event.listens_for(ShoppingHistory, "before_insert")
+def stamp_sync_version(mapper, connection, target):
+    target.sync_version = reserve_sync_versions(connection, [target.user_id])[0]
+
+@event.listens_for(ShoppingHistory, "before_update")
+def restamp_sync_version(mapper, connection, target):
+    # Also called for rows in the session without net changes
+    if sa_inspect(target).session.is_modified(target, include_collections=False):
+        stamp_sync_version(mapper, connection, target)
+
+def encode_sync_cursor(version: int) -> str:
+    return base64.urlsafe_b64encode(f"v{version}".encode()).decode()
+
+def decode_sync_cursor(cursor: str) -> Optional[int]:
+    """The cursor's version, or None for a cursor from before sync versions."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        if raw.count("|") == 3:
+            return None
+        if not raw.startswith("v"):
+            raise ValueError(raw)
+        return int(raw[1:])
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid sync cursor")
+
+async def get_sync_state(db: AsyncSession, user_id: int) -> tuple:
+    """(last sync version, when it was reserved) for the user's history."""
+    state = (await db.execute(
+        select(ShoppingHistorySync.version, ShoppingHistorySync.changed_at)
+        .where(ShoppingHistorySync.user_id == user_id)
+    )).first()
+    return (state.version, state.changed_at) if state else (0, None)
+
+async def get_purged_sync_version(db: AsyncSession, user_id: int) -> int:
+    return await db.scalar(
+        select(ShoppingHistoryTombstonePurge.sync_version).where(ShoppingHistoryTombstonePurge.user_id == user_id)
+    ) or 0
+
+def conditional_headers(etag: str, last_modified: Optional[datetime]) -> dict:
+    # private, no-cache: browsers keep the body but revalidate every time
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            return False
+        return last_modified.astimezone(timezone.utc).replace(microsecond=0) <= since
+    return False
+
+def get_current_user(services: Services = Depends(get_services),
+                     credentials: HTTPAuthorizationCredentials = Depends(security)):
+    payload = verify_token(services, credentials.credentials)
+    if not payload:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return payload
+
+# ============= READ REPLICAS =============
+def read_session_factories(services: Services, current_user: dict) -> list:
+    """
+    Session factories to try for a read-only request, in order. Tokens
+    issued within REPLICA_READ_AFTER_WRITE_SECONDS (signup, login, OTP
+    verification all just wrote the user) read from the primary so the
+    client sees its own writes despite replication lag.
+    """
+    database = services.database
+    issued_at = current_user.get("iat") or 0
+    if time.time() - issued_at < services.settings.REPLICA_READ_AFTER_WRITE_SECONDS:
+        return [database.AsyncSessionLocal]
+    return database.replica_set.candidates() + [database.AsyncSessionLocal]
+
+async def open_read_session(services: Services, current_user: dict) -> AsyncSession:
+    """
+    Session for a read-only request: a healthy replica, else the
+    primary. The caller closes it.
+    """
+    factories = read_session_factories(services, current_user)
+    for session_factory in factories[:-1]:
+        db = session_factory()
+        try:
+            # Check out a connection now so a dead replica falls through
+            await db.connection()
+        except DBAPIError:
+            await db.close()
+            continue
+        return db
+    return factories[-1]()
+
+async def get_read_db(services: Services = Depends(get_services), current_user: dict = Depends(get_current_user)):
+    db = await open_read_session(services, current_user)
+    try:
+        yield db
+    finally:
+        await db.close()
+
+# ============= PYDANTIC MODELS =============
+class SignupRequest(BaseModel):
+    email: EmailStr
+    password: str
+    full_name: Optional[str] = None
+
+class VerifySignupRequest(BaseModel):
+    email: EmailStr
+    otp: str
+
+class LoginRequest(BaseModel):
+    email: EmailStr
+    password: str
+
+class OTPRequest(BaseModel):
+    email: EmailStr
+
+class VerifyOTPRequest(BaseModel):
+    email: EmailStr
+    otp: str
+
+class ForgotPasswordRequest(BaseModel):
+    email: EmailStr
+
+class ResetPasswordRequest(BaseModel):
+    email: EmailStr
+    reset_token: str
+    new_password: str
+
+class ShoppingHistoryIngestRow(BaseModel):
+    user_id: int
+    token: str = Field(min_length=1)
+    product_name: str = Field(min_length=1, max_length=255)
+    category: Optional[str] = Field(None, max_length=100)
+    quantity: int = Field(1, ge=1, le=INGEST_MAX_QUANTITY)
+    price_per_unit: float = Field(ge=0, le=MAX_PRICE, allow_inf_nan=False)
+    total_price: Optional[float] = Field(None, ge=0, le=MAX_PRICE, allow_inf_nan=False)
+    payment_method: Optional[str] = Field(None, max_length=50)
+    status: Literal[ORDER_STATUSES] = "completed"
+    delivery_address: Optional[str] = None
+    delivery_date: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+
+class MessageResponse(BaseModel):
+    success: bool
+    message: str
+
+class SignupResponse(MessageResponse):
+    email: str
+    requires_verification: bool
+
+class AuthUser(BaseModel):
+    id: int
+    email: str
+    full_name: Optional[str] = None
+
+class VerifiedAuthUser(AuthUser):
+    is_verified: bool
+
+class AuthResponse(MessageResponse):
+    access_token: str
+    user: AuthUser
+
+class VerifySignupResponse(AuthResponse):
+    user: VerifiedAuthUser
+
+class ProfileResponse(BaseModel):
+    id: int
+    email: str
+    full_name: Optional[str] = None
+    is_active: bool
+    is_verified: bool
+    created_at: Optional[datetime] = None
+    last_login: Optional[datetime] = None
+
+class TokenInfoResponse(MessageResponse):
+    user_id: int
+    email: str
+
+class RootResponse(BaseModel):
+    message: str
+    docs: str
+
+class HealthResponse(BaseModel):
+    status: str
+
+class ReadinessResponse(BaseModel):
+    status: str
+    startup_seconds: Optional[float] = None
+
+class ShoppingHistoryItem(BaseModel):
+    id: int
+    created_at: Optional[datetime] = None
+    product_name: str
+    category: Optional[str] = None
+    quantity: Optional[int] = None
+    price_per_unit: float
+    total_price: float
+    payment_method: Optional[str] = None
+    status: Optional[str] = None
+    delivery_address: Optional[str] = None
+    delivery_date: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+class ShoppingHistoryPage(BaseModel):
+    items: List[ShoppingHistoryItem]
+    next_cursor: Optional[str] = None
+    has_more: bool
+    sync_cursor: str
+
+class ShoppingHistorySearchResults(BaseModel):
+    items: List[ShoppingHistoryItem]
+    next_offset: Optional[int] = None
+    has_more: bool
+
+class ShoppingHistoryChanges(BaseModel):
+    items: List[ShoppingHistoryItem]
+    deleted: List[int]
+    sync_cursor: Optional[str] = None
+    has_more: bool
+    reset: bool = False
+
+class SummaryBucket(BaseModel):
+    key: Optional[str] = None
+    order_count: int
+    item_count: int
+    total_spent: float
+
+class ShoppingSummary(BaseModel):
+    order_count: int
+    item_count: int
+    total_spent: float
+    by_category: List[SummaryBucket]
+    by_status: List[SummaryBucket]
+    by_payment_method: List[SummaryBucket]
+    by_month: List[SummaryBucket]
+
+class ReorderSuggestion(BaseModel):
+    product: str
+    purchase_days: int
+    interval_days: float
+    last_purchased: date
+    next_due: date
+    due: bool
+
+class RelatedProduct(BaseModel):
+    product: str
+    basket_count: int
+
+class ShoppingSuggestions(BaseModel):
+    reorder: List[ReorderSuggestion]
+    related: List[RelatedProduct]
+
+class IngestError(BaseModel):
+    line: int
+    error: str
+
+class IngestReport(BaseModel):
+    accepted: int
+    duplicates: int
+    rejected: int
+    errors: List[IngestError]
+    seconds: float
+    rows_per_sec: float
+
+class StatusTransition(BaseModel):
+    id: int
+    status: Literal[ORDER_STATUSES]
+    delivery_date: Optional[datetime] = None  # left unchanged when omitted
+
+class StatusTransitionBatch(BaseModel):
+    transitions: List[StatusTransition] = Field(min_length=1, max_length=STATUS_TRANSITION_MAX_BATCH)
+
+class StatusTransitionResult(BaseModel):
+    id: int
+    result: str  # 'updated', 'not_found', 'invalid_transition', 'conflict' or 'duplicate'
+    status: Optional[str] = None  # the order's status after the batch
+
+class StatusTransitionReport(BaseModel):
+    updated: int
+    rejected: int
+    results: List[StatusTransitionResult]
+    seconds: float
+    rows_per_sec: float
+
+# ============= BULK INGEST =============
+def require_ingest_key(services: Services = Depends(get_services), x_ingest_key: Optional[str] = Header(None)):
+    # Bulk ingest is disabled when INGEST_API_KEY is unset
+    ingest_key = services.settings.INGEST_API_KEY
+    if not ingest_key or not x_ingest_key or not secrets.compare_digest(x_ingest_key, ingest_key):
+        raise HTTPException(status_code=403, detail="Invalid ingest key")
+
+async def iter_text_lines(chunks):
+    """Split an async stream of byte chunks into numbered text lines."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    line_number = 0
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            line_number += 1
+            yield line_number, line
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield line_number + 1, pending
+
+async def iter_ingest_records(lines, format: str):
+    """
+    Yield (line_number, record, error) for each non-blank input line.
+    CSV records must fit on one line.
+    """
+    header = None
+    async for line_number, line in lines:
+        line = line.rstrip("\r")
+        if not line.strip():
+            continue
+        if format == "csv":
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [name.strip() for name in values]
+                continue
+            if len(values) != len(header):
+                yield line_number, None, f"expected {len(header)} columns, got {len(values)}"
+                continue
+            # Empty CSV cells mean 'not given'
+            yield line_number, {name: value for name, value in zip(header, values) if value != ""}, None
+        else:
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, None, f"invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield line_number, None, "expected a JSON object"
+                continue
+            yield line_number, record, None
+
+def describe_error(error: Exception) -> str:
+    # A DBAPIError's own message also lists the statement and parameters
+    cause = getattr(error, "orig", None) or error
+    return f"{cause.__class__.__name__}: {cause}"
+
+def format_validation_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" for item in error.errors()
+    )
+
+async def insert_ingest_chunk(db: AsyncSession, rows: list) -> list:
+    """
+    Insert rows (from history_storage_rows), skipping tokens that
+    already exist or repeat within the chunk. Returns the rows that were
+    actually inserted.
+    """
+    # Keep the first of any token repeated within the chunk, so each
+    # inserted token maps back to exactly one row
+    seen = set()
+    unique_rows = []
+    for row in rows:
+        if row["token_hash"] not in seen:
+            seen.add(row["token_hash"])
+            unique_rows.append(row)
+    table = ShoppingHistory.__table__
+    connection = await db.connection()
+    versions = await connection.run_sync(reserve_sync_versions, [row["user_id"] for row in unique_rows])
+    for row, version in zip(unique_rows, versions):
+        row["sync_version"] = version
+    upsert = dialect_insert(connection.dialect.name)
+    if upsert is not None:
+        result = await connection.execute(
+            upsert(table).on_conflict_do_nothing(index_elements=["token_hash"]).returning(table.c.token_hash),
+            unique_rows
+        )
+        inserted_tokens = set(result.scalars().all())
+        inserted = [row for row in unique_rows if row["token_hash"] in inserted_tokens]
+    else:
+        existing = set((await connection.execute(
+            select(table.c.token_hash).where(table.c.token_hash.in_([row["token_hash"] for row in unique_rows]))
+        )).scalars().all())
+        inserted = [row for row in unique_rows if row["token_hash"] not in existing]
+        if inserted:
+            await connection.execute(table.insert(), inserted)
+    
+    if inserted:
+        def apply_rollups(sync_connection):
+            label_names = rollup_label_names(sync_connection, inserted)
+            deltas = {}
+            for row in inserted:
+                accumulate_rollups(deltas, row, label_names)
+            apply_rollup_deltas(sync_connection, deltas)
+        await connection.run_sync(apply_rollups)
+    return inserted
+
+async def ingest_shopping_history(database: Database, db: AsyncSession, records) -> dict:
+    """
+    Validate and insert records from iter_ingest_records in chunks of
+    INGEST_CHUNK_SIZE, one transaction per chunk. Bad rows are reported
+    individually and don't affect the rest of the batch: rows are
+    converted one by one, and if a chunk's insert still fails its rows
+    are retried one per transaction.
+    """
+    started = time.perf_counter()
+    report = {"accepted": 0, "duplicates": 0, "rejected": 0, "errors": []}
+    
+    def reject(line_number: int, message: str):
+        report["rejected"] += 1
+        if len(report["errors"]) < INGEST_MAX_ERRORS:
+            report["errors"].append({"line": line_number, "error": message})
+    
+    async def flush(chunk: list):
+        # Rows for unknown users would fail the whole statement on the FK
+        user_ids = {row["user_id"] for _, row in chunk}
+        known = set((await db.scalars(select(User.id).where(User.id.in_(user_ids)))).all())
+        rows = []
+        for line_number, row in chunk:
+            if row["user_id"] in known:
+                rows.append((line_number, row))
+            else:
+                reject(line_number, f"user_id: unknown user {row['user_id']}")
+        if not rows:
+            return
+        now = datetime.now()
+        for _, row in rows:
+            row["updated_at"] = now
+        try:
+            # Off the event loop: may commit new labels on the sync engine
+            label_ids = await asyncio.to_thread(history_label_ids, database, [row for _, row in rows])
+        except Exception as e:
+            for line_number, _ in rows:
+                reject(line_number, f"insert failed: {describe_error(e)}")
+            return
+        storage_rows = []
+        for line_number, row in rows:
+            try:
+                storage_rows.append((line_number, history_storage_row(row, label_ids)))
+            except (ArithmeticError, ValueError) as e:
+                reject(line_number, f"conversion failed: {describe_error(e)}")
+        if not storage_rows:
+            return
+        failed = 0
+        try:
+            inserted = len(await insert_ingest_chunk(db, [values for _, values in storage_rows]))
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            # Find the rows at fault; the others still go in
+            inserted = 0
+            for line_number, values in storage_rows:
+                try:
+                    inserted += len(await insert_ingest_chunk(db, [values]))
+                    await db.commit()
+                except Exception as e:
+                    await db.rollback()
+                    reject(line_number, f"insert failed: {describe_error(e)}")
+                    failed += 1
+        report["accepted"] += inserted
+        report["duplicates"] += len(storage_rows) - inserted - failed
+    
+    chunk = []
+    async for line_number, record, error in records:
+        if error:
+            reject(line_number, error)
+            continue
+        try:
+            row = ShoppingHistoryIngestRow(**record)
+        except ValidationError as e:
+            reject(line_number, format_validation_error(e))
+            continue
+        values = row.model_dump()
+        if values["total_price"] is None:
+            values["total_price"] = round(values["quantity"] * values["price_per_unit"], 2)
+            if values["total_price"] > MAX_PRICE:
+                reject(line_number, f"total_price: quantity x price_per_unit is over {MAX_PRICE}")
+                continue
+        values["created_at"] = values["created_at"] or datetime.now()
+        values["is_used"] = False
+        chunk.append((line_number, values))
+        if len(chunk) >= INGEST_CHUNK_SIZE:
+            await flush(chunk)
+            chunk = []
+    if chunk:
+        await flush(chunk)
+    
+    elapsed = time.perf_counter() - started
+    processed = report["accepted"] + report["duplicates"] + report["rejected"]
+    report["seconds"] = round(elapsed, 3)
+    report["rows_per_sec"] = round(processed / elapsed, 1) if elapsed else 0.0
+    return report
+
+# ============= STATUS TRANSITIONS =============
+# (current, new) status code pairs the UPDATE accepts
+ALLOWED_STATUS_CHANGES = [
+    (STATUS_CODES[current], STATUS_CODES[new])
+    for current, targets in STATUS_TRANSITIONS.items()
+    for new in (current, *targets)
+]
+# (name, type, SQL type) of the VALUES columns
+TRANSITION_COLUMNS = (
+    ("id", Integer(), "INTEGER"),
+    ("old_status", SmallInteger(), "SMALLINT"),
+    ("new_status", SmallInteger(), "SMALLINT"),
+    ("delivery_date", DateTime(), "TIMESTAMP"),
+    ("sync_version", BigInteger(), "BIGINT"),
+)
+
+@lru_cache(maxsize=32)
+def status_update_statement(dialect: str, count: int):
+    """
+    UPDATE shopping_history from a VALUES list of `count` (id,
+    old_status, new_status, delivery_date, sync_version) rows, returning the ids
+    changed. Built as text and memoized per chunk size, so it is
+    compiled once rather than per chunk. Parameters: transition_params().
+    """
+    def param(name: str, index: int, sql_type: str) -> str:
+        # PostgreSQL would otherwise type the VALUES columns as text
+        if dialect == "postgresql":
+            return f"CAST(:{name}_{index} AS {sql_type})"
+        return f":{name}_{index}"
+    
+    rows = ", ".join(
+        "(" + ", ".join(param(name, index, sql_type) for name, _, sql_type in TRANSITION_COLUMNS) + ")"
+        for index in range(count)
+    )
+    allowed = ", ".join(f"({old}, {new})" for old, new in ALLOWED_STATUS_CHANGES)
+    statement = text(f"""
+        WITH transitions (id, old_status, new_status, delivery_date, sync_version) AS (VALUES {rows})
+        UPDATE shopping_history
+        SET status_code = transitions.new_status,
+            delivery_date = coalesce(transitions.delivery_date, shopping_history.delivery_date),
+            updated_at = :now,
+            sync_version = transitions.sync_version
+        FROM transitions
+        WHERE shopping_history.id = transitions.id
+            AND shopping_history.status_code = transitions.old_status
+            AND (transitions.old_status, transitions.new_status) IN ({allowed})
+        RETURNING shopping_history.id
+    """)
+    return statement.bindparams(
+        bindparam("now", type_=DateTime()),
+        *[
+            bindparam(f"{name}_{index}", type_=type_)
+            for index in range(count)
+            for name, type_, _ in TRANSITION_COLUMNS
+        ]
+    )
+
+def transition_params(rows: list) -> dict:
+    return {
+        f"{name}_{index}": value
+        for index, row in enumerate(rows)
+        for (name, _, _), value in zip(TRANSITION_COLUMNS, row)
+    }
 
-origins = [
-    "http://localhost:3000",
-    "http://127.0.0.1:3000"
-]
+async def update_statuses(connection, rows: list, now: datetime) -> set:
+    """
+    Apply (id, old_status, new_status, delivery_date, sync_version) rows
+    to orders that still have old_status, where the change is allowed.
+    Returns the ids updated.
+    """
+    table = ShoppingHistory.__table__
+    dialect = connection.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        result = await connection.execute(
+            status_update_statement(dialect, len(rows)),
+            {**transition_params(rows), "now": now}
+        )
+        return set(result.scalars().all())
+    
+    # Other backends: a statement per row, validated the same way
+    updated = set()
+    for row_id, old_status, new_status, delivery_date, sync_version in rows:
+        changes = {"status_code": new_status, "updated_at": now, "sync_version": sync_version}
+        if delivery_date is not None:
+            changes["delivery_date"] = delivery_date
+        result = await connection.execute(
+            table.update()
+            .where(
+                table.c.id == row_id,
+                table.c.status_code == old_status,
+                tuple_(literal(old_status), literal(new_status)).in_(ALLOWED_STATUS_CHANGES)
+            )
+            .values(**changes)
+        )
+        if result.rowcount:
+            updated.add(row_id)
+    return updated
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+async def apply_status_transitions(db: AsyncSession, transitions: list) -> dict:
+    """
+    Move orders to new statuses, and set their delivery dates where
+    given, STATUS_TRANSITION_CHUNK_SIZE orders per transaction. A chunk
+    costs one SELECT of the orders' current state, one statement
+    reserving sync versions and one set-based UPDATE, which only changes
+    orders still in the state read and only along STATUS_TRANSITIONS.
+    Rollups are adjusted in the same transaction. Returns a result for
+    every transition, in order.
+    """
+    started = time.perf_counter()
+    report = {"updated": 0, "rejected": 0, "results": []}
+    seen = set()
+    
+    for start in range(0, len(transitions), STATUS_TRANSITION_CHUNK_SIZE):
+        chunk = transitions[start:start + STATUS_TRANSITION_CHUNK_SIZE]
+        current = {row.id: row for row in (await db.execute(
+            select(
+                ShoppingHistory.id,
+                ShoppingHistory.user_id,
+                ShoppingHistory.status_code,
+                ShoppingHistory.quantity,
+                ShoppingHistory.total_cents
+            ).where(ShoppingHistory.id.in_({transition.id for transition in chunk}))
+        )).all()}
+        
+        outcomes = []
+        rows = []
+        for transition in chunk:
+            if transition.id in seen:
+                outcomes.append("duplicate")
+            elif transition.id not in current:
+                outcomes.append("not_found")
+            else:
+                old_status = current[transition.id].status_code
+                rows.append((transition.id, old_status, STATUS_CODES[transition.status], transition.delivery_date))
+                outcomes.append(None)
+            seen.add(transition.id)
+        
+        updated = set()
+        if rows:
+            try:
+                connection = await db.connection()
+                versions = await connection.run_sync(
+                    reserve_sync_versions, [current[row[0]].user_id for row in rows]
+                )
+                updated = await update_statuses(
+                    connection, [(*row, version) for row, version in zip(rows, versions)], datetime.now()
+                )
+                # Core statements bypass the rollup events: move each
+                # changed order between status buckets here
+                deltas = {}
+                for row_id, old_status, new_status, _ in rows:
+                    order = current[row_id]
+                    if row_id not in updated or old_status == new_status:
+                        continue
+                    for status, sign in ((old_status, -1), (new_status, 1)):
+                        delta = deltas.setdefault((order.user_id, "status", STATUS_NAMES[status]), [0, 0, 0])
+                        delta[0] += sign
+                        delta[1] += sign * (order.quantity or 0)
+                        delta[2] += sign * order.total_cents
+                await connection.run_sync(apply_rollup_deltas, deltas)
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                outcomes = ["error" if outcome is None else outcome for outcome in outcomes]
+        
+        for transition, outcome in zip(chunk, outcomes):
+            status = None
+            if outcome is None:
+                old_status = current[transition.id].status_code
+                if transition.id in updated:
+                    outcome, status = "updated", transition.status
+                elif (old_status, STATUS_CODES[transition.status]) in ALLOWED_STATUS_CHANGES:
+                    # Its status changed between the SELECT and the UPDATE
+                    outcome = "conflict"
+                else:
+                    outcome, status = "invalid_transition", STATUS_NAMES[old_status]
+            report["updated" if outcome == "updated" else "rejected"] += 1
+            report["results"].append({"id": transition.id, "result": outcome, "status": status})
+    
+    elapsed = time.perf_counter() - started
+    report["seconds"] = round(elapsed, 3)
+    report["rows_per_sec"] = round(len(transitions) / elapsed, 1) if elapsed else 0.0
+    return report
 
-# ✅ Load environment variables before using them
-load_dotenv()
+# ============= REORDER SUGGESTIONS =============
+# Two indexes built from shopping history in the background, so the
+# suggestions endpoint only reads:
+#   co_purchases      products bought together: how many baskets (one
+#                     user's orders on one day) held both
+#   repeat_purchases  per user and product: days bought on, the last of
+#                     them and when the next purchase is due
+# Cancelled orders are left out. A full rebuild runs every
+# SUGGESTIONS_REBUILD_HOURS; refreshes in between fold in the rows added
+# since (by id), so later status changes and deletes wait for a rebuild.
+SUGGESTIONS_CHUNK_SIZE = 1000       # users per rebuild read
+SUGGESTIONS_REFRESH_BATCH = 10000   # new rows per refresh transaction
+SUGGESTIONS_MAX_BASKET_SIZE = 50    # bigger baskets (bulk buys) are left out of co_purchases
+SUGGESTIONS_WRITE_BATCH = 5000
+SUGGESTION_STATE_ID = 1
+SECONDS_PER_DAY = 86400
+EPOCH = datetime(1970, 1, 1)
+BASKET_DAYS = 1 << 20  # basket id = user_id * BASKET_DAYS + day
+REPEAT_PURCHASE_VALUES = ("purchase_days", "first_purchased", "last_purchased", "interval_days", "next_due")
 
-# ============= CONFIGURATION =============
-DATABASE_URL = os.getenv("DATABASE_URL")
-GMAIL_USER = os.getenv("GMAIL_USER")
-GMAIL_APP_PASSWORD = os.getenv("GMAIL_APP_PASSWORD")
-SECRET_KEY = os.getenv("SECRET_KEY")
-ALGORITHM = os.getenv("ALGORITHM")
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
-OTP_EXPIRY_MINUTES = 5
-OTP_LENGTH = 6
-RESET_TOKEN_EXPIRE_HOURS = 1
+def load_purchases(connection, products: dict, *conditions, limit: Optional[int] = None) -> dict:
+    """
+    Shopping history rows matching `conditions` as NumPy arrays of user,
+    day (since 1970-01-01) and product, without cancelled orders.
+    Products are numbered through `products` (name -> number), which
+    grows as new names turn up. With `limit`, reads the first `limit`
+    rows by id; "last_id" is the highest id read, cancelled or not.
+    """
+    history = ShoppingHistory
+    query = select(
+        history.id,
+        history.user_id,
+        cast(extract("epoch", history.created_at), BigInteger),
+        history.status_code,
+        history.product_name,
+    ).where(history.created_at.isnot(None), *conditions)
+    if limit is not None:
+        query = query.order_by(history.id).limit(limit)
+    rows = connection.execute(query).all()
+    
+    numbers = np.fromiter(
+        itertools.chain.from_iterable(row[:4] for row in rows), dtype=np.int64, count=len(rows) * 4
+    ).reshape(-1, 4)
+    numbered = np.fromiter(
+        (products.setdefault(row[4], len(products)) for row in rows), dtype=np.int64, count=len(rows)
+    )
+    kept = numbers[:, 3] != STATUS_CODES["cancelled"]
+    return {
+        "rows": len(rows),
+        "last_id": int(numbers[:, 0].max()) if len(rows) else None,
+        "user": numbers[kept, 1],
+        "day": numbers[kept, 2] // SECONDS_PER_DAY,
+        "product": numbered[kept],
+    }
 
-# ============= DATABASE SETUP =============
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
+def basket_ids(purchases: dict):
+    return purchases["user"] * BASKET_DAYS + purchases["day"]
 
-# Database Models
-class User(Base):
-    __tablename__ = "users"
-    id = Column(Integer, primary_key=True, index=True)
-    email = Column(String(255), unique=True, index=True, nullable=False)
-    password = Column(Text, nullable=True)
-    full_name = Column(String(255), nullable=True)
-    is_active = Column(Boolean, default=False)  
-    is_verified = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.now)
-    last_login = Column(DateTime, nullable=True)
+def add_pair_counts(pair_counts: dict, purchases: dict, sign: int = 1):
+    keys, counts = basket_pairs(basket_ids(purchases), purchases["product"], SUGGESTIONS_MAX_BASKET_SIZE)
+    for key, count in zip(keys.tolist(), counts.tolist()):
+        pair_counts[key] = pair_counts.get(key, 0) + sign * count
 
-class OTP(Base):
-    __tablename__ = "otps"
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
-    otp = Column(String(10), nullable=False)
-    expiry_time = Column(DateTime, nullable=False)
-    is_verified = Column(Boolean, default=False)
-    otp_type = Column(String(20), default="login")  # Added: 'signup', 'login', 'reset'
-    created_at = Column(DateTime, default=datetime.now)
+def co_purchase_rows(pair_counts: dict, names: list) -> list:
+    mask = (1 << CODE_BITS) - 1
+    return [
+        {"product": names[key >> CODE_BITS], "related_product": names[key & mask], "basket_count": count}
+        for key, count in pair_counts.items()
+        if count
+    ]
 
-class ResetToken(Base):
-    __tablename__ = "reset_tokens"
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
-    token = Column(Text, nullable=False, unique=True)
-    expiry_time = Column(DateTime, nullable=False)
-    is_used = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.now)
+def purchase_span_tuples(purchases: dict) -> list:
+    """(user_id, product, purchase days, first day, last day) per user and product."""
+    spans = purchase_spans(purchases["user"], purchases["product"], purchases["day"])
+    return list(zip(*(column.tolist() for column in spans)))
 
-from sqlalchemy import (
-    Column, Integer, String, ForeignKey, Text, Boolean, DateTime, Float
-)
-from sqlalchemy.orm import relationship
+def repeat_purchase_row(user_id: int, product: str, purchase_days: int, first_day: int, last_day: int) -> dict:
+    epoch = EPOCH.date()
+    last_purchased = epoch + timedelta(days=last_day)
+    interval = (last_day - first_day) / (purchase_days - 1) if purchase_days > 1 else None
+    return {
+        "user_id": user_id,
+        "product": product,
+        "purchase_days": purchase_days,
+        "first_purchased": epoch + timedelta(days=first_day),
+        "last_purchased": last_purchased,
+        "interval_days": interval,
+        "next_due": last_purchased + timedelta(days=round(interval)) if interval is not None else None,
+    }
 
-class ShoppingHistory(Base):
-    __tablename__ = "shopping_history"
+def merge_repeat_purchases(connection, spans: list, names: list) -> list:
+    """RepeatPurchase rows for newly seen purchase spans, combined with the stored ones."""
+    if not spans:
+        return []
+    table = RepeatPurchase.__table__
+    stored = {
+        (row.user_id, row.product): row
+        for row in connection.execute(
+            select(table.c.user_id, table.c.product, table.c.purchase_days, table.c.first_purchased, table.c.last_purchased)
+            .where(table.c.user_id.in_({span[0] for span in spans}), table.c.product.in_({names[span[1]] for span in spans}))
+        )
+    }
+    epoch = EPOCH.date()
+    rows = []
+    for user_id, product, purchase_days, first_day, last_day in spans:
+        name = names[product]
+        previous = stored.get((user_id, name))
+        if previous is not None:
+            purchase_days += previous.purchase_days
+            first_day = min(first_day, (previous.first_purchased - epoch).days)
+            last_day = max(last_day, (previous.last_purchased - epoch).days)
+        rows.append(repeat_purchase_row(user_id, name, purchase_days, first_day, last_day))
+    return rows
 
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
-    token = Column(Text, nullable=False, unique=True)
-    is_used = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.now)
+def apply_co_purchase_deltas(connection, rows: list):
+    if not rows:
+        return
+    
+    table = CoPurchase.__table__
+    upsert = dialect_insert(connection.dialect.name)
+    if upsert is not None:
+        insert_stmt = upsert(table)
+        stmt = insert_stmt.on_conflict_do_update(
+            index_elements=["product", "related_product"],
+            set_={"basket_count": table.c.basket_count + insert_stmt.excluded.basket_count}
+        )
+        connection.execute(stmt, rows)
+        return
+    
+    for row in rows:
+        result = connection.execute(
+            table.update()
+            .where(table.c.product == row["product"], table.c.related_product == row["related_product"])
+            .values(basket_count=table.c.basket_count + row["basket_count"])
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(**row))
 
-    product_name = Column(String(255), nullable=False)
-    category = Column(String(100), nullable=True)
-    quantity = Column(Integer, default=1)
-    price_per_unit = Column(Float, nullable=False)
-    total_price = Column(Float, nullable=False)
-    payment_method = Column(String(50), nullable=True)  
-    status = Column(String(50), default="completed")    
-    delivery_address = Column(Text, nullable=True)
-    delivery_date = Column(DateTime, nullable=True)
-    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+def store_repeat_purchases(connection, rows: list):
+    if not rows:
+        return
+    
+    table = RepeatPurchase.__table__
+    upsert = dialect_insert(connection.dialect.name)
+    if upsert is not None:
+        insert_stmt = upsert(table)
+        stmt = insert_stmt.on_conflict_do_update(
+            index_elements=["user_id", "product"],
+            set_={column: insert_stmt.excluded[column] for column in REPEAT_PURCHASE_VALUES}
+        )
+        connection.execute(stmt, rows)
+        return
+    
+    for row in rows:
+        result = connection.execute(
+            table.update()
+            .where(table.c.user_id == row["user_id"], table.c.product == row["product"])
+            .values(**{column: row[column] for column in REPEAT_PURCHASE_VALUES})
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(**row))
 
+def insert_in_batches(connection, table, rows: list):
+    for start in range(0, len(rows), SUGGESTIONS_WRITE_BATCH):
+        connection.execute(table.insert(), rows[start:start + SUGGESTIONS_WRITE_BATCH])
 
-Base.metadata.create_all(bind=engine)
+def load_suggestion_state(db):
+    """The suggestion index state row, created on first use."""
+    query = select(SuggestionIndexState.__table__).where(SuggestionIndexState.id == SUGGESTION_STATE_ID)
+    state = db.execute(query).first()
+    if state is None:
+        try:
+            db.execute(SuggestionIndexState.__table__.insert().values(id=SUGGESTION_STATE_ID))
+            db.commit()
+        except IntegrityError:
+            # Another worker created it first
+            db.rollback()
+        state = db.execute(query).one()
+    return state
 
-# ============= UTILITIES =============
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-security = HTTPBearer()
+def advance_suggestion_state(connection, state, last_history_id: int, rebuilt: bool = False) -> bool:
+    """
+    Record progress, unless another worker has written since `state` was
+    read; then the caller rolls back. Run before writing the indexes, so
+    on PostgreSQL the row lock holds a concurrent refresh until this
+    transaction ends, after which its version no longer matches.
+    """
+    now = datetime.now()
+    values = {"version": state.version + 1, "last_history_id": last_history_id, "refreshed_at": now}
+    if rebuilt:
+        values["rebuilt_at"] = now
+    table = SuggestionIndexState.__table__
+    result = connection.execute(
+        table.update().where(table.c.id == state.id, table.c.version == state.version).values(**values)
+    )
+    return result.rowcount == 1
 
-def get_db():
-    db = SessionLocal()
+def rebuild_suggestions(database: Database, chunk_size: int = SUGGESTIONS_CHUNK_SIZE) -> dict:
+    """
+    Rebuild both suggestion indexes from all of shopping_history, reading
+    chunk_size users at a time, and replace them in one transaction.
+    """
+    started = time.perf_counter()
+    db = database.SessionLocal()
+    products = {}
+    pair_counts = {}
+    spans = []
+    rows = 0
+    last_user_id = 0
     try:
-        yield db
+        state = load_suggestion_state(db)
+        connection = db.connection()
+        last_id = db.scalar(select(func.max(ShoppingHistory.id))) or 0
+        while True:
+            user_ids = db.scalars(
+                select(User.id).where(User.id > last_user_id).order_by(User.id).limit(chunk_size)
+            ).all()
+            if not user_ids:
+                break
+            
+            # Baskets and purchase spans never cross users, so each chunk
+            # is complete on its own
+            purchases = load_purchases(
+                connection, products, ShoppingHistory.user_id.in_(user_ids), ShoppingHistory.id <= last_id
+            )
+            add_pair_counts(pair_counts, purchases)
+            spans.extend(purchase_span_tuples(purchases))
+            rows += purchases["rows"]
+            last_user_id = user_ids[-1]
+        
+        if not advance_suggestion_state(connection, state, last_id, rebuilt=True):
+            db.rollback()
+            return {"rebuilt": False, "rows": 0, "seconds": round(time.perf_counter() - started, 3)}
+        names = list(products)
+        db.execute(delete(CoPurchase))
+        db.execute(delete(RepeatPurchase))
+        insert_in_batches(connection, CoPurchase.__table__, co_purchase_rows(pair_counts, names))
+        insert_in_batches(
+            connection, RepeatPurchase.__table__,
+            [repeat_purchase_row(user_id, names[product], *span) for user_id, product, *span in spans]
+        )
+        db.commit()
     finally:
         db.close()
+    
+    elapsed = time.perf_counter() - started
+    return {
+        "rebuilt": True,
+        "rows": rows,
+        "co_purchases": sum(1 for count in pair_counts.values() if count),
+        "repeat_purchases": len(spans),
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(rows / elapsed, 1) if elapsed else 0.0,
+    }
+
+def refresh_suggestions_batch(db, batch_size: int) -> int:
+    """
+    Fold up to batch_size shopping history rows added since the last
+    build into the suggestion indexes. Returns the number of rows read:
+    0 when there were none, or when another worker got there first.
+    """
+    state = load_suggestion_state(db)
+    connection = db.connection()
+    products = {}
+    new = load_purchases(connection, products, ShoppingHistory.id > state.last_history_id, limit=batch_size)
+    if not new["rows"]:
+        return 0
+    
+    pair_deltas = {}
+    spans = []
+    if len(new["user"]):
+        # Earlier orders in the same baskets: the pairs they already
+        # count, and the purchase days already counted
+        old = load_purchases(
+            connection, products,
+            ShoppingHistory.user_id.in_(set(new["user"].tolist())),
+            ShoppingHistory.id <= state.last_history_id,
+            ShoppingHistory.created_at >= EPOCH + timedelta(days=int(new["day"].min())),
+            ShoppingHistory.created_at < EPOCH + timedelta(days=int(new["day"].max()) + 1),
+        )
+        same_baskets = np.isin(basket_ids(old), basket_ids(new))
+        old = {field: old[field][same_baskets] for field in ("user", "day", "product")}
+        combined = {field: np.concatenate([old[field], new[field]]) for field in old}
+        add_pair_counts(pair_deltas, combined)
+        add_pair_counts(pair_deltas, old, sign=-1)
+        
+        seen = set(zip(basket_ids(old).tolist(), old["product"].tolist()))
+        fresh = np.fromiter(
+            (key not in seen for key in zip(basket_ids(new).tolist(), new["product"].tolist())),
+            dtype=bool, count=len(new["user"])
+        )
+        spans = purchase_span_tuples({field: new[field][fresh] for field in ("user", "day", "product")})
+    
+    if not advance_suggestion_state(connection, state, new["last_id"]):
+        db.rollback()
+        return 0
+    names = list(products)
+    apply_co_purchase_deltas(connection, co_purchase_rows(pair_deltas, names))
+    store_repeat_purchases(connection, merge_repeat_purchases(connection, spans, names))
+    db.commit()
+    return new["rows"]
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+def refresh_suggestions(database: Database, rebuild_hours: int, batch_size: int = SUGGESTIONS_REFRESH_BATCH) -> dict:
+    """
+    Bring the suggestion indexes up to date: rebuild them when they have
+    never been built or are older than rebuild_hours
+    (SUGGESTIONS_REBUILD_HOURS), otherwise fold in new shopping history
+    rows batch_size at a time.
+    """
+    with database.SessionLocal() as db:
+        state = load_suggestion_state(db)
+    if state.rebuilt_at is None or datetime.now() - state.rebuilt_at >= timedelta(hours=rebuild_hours):
+        return rebuild_suggestions(database)
+    
+    started = time.perf_counter()
+    rows = 0
+    while True:
+        with database.SessionLocal() as db:
+            read = refresh_suggestions_batch(db, batch_size)
+        rows += read
+        if read < batch_size:
+            break
+    elapsed = time.perf_counter() - started
+    return {
+        "rebuilt": False,
+        "rows": rows,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(rows / elapsed, 1) if elapsed else 0.0,
+    }
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+def run_suggestions_refresh(services: Services, stop: threading.Event):
+    settings = services.settings
+    while True:
+        try:
+            report = refresh_suggestions(services.database, settings.SUGGESTIONS_REBUILD_HOURS)
+            if report["rebuilt"]:
+                print(f"💡 Rebuilt suggestions from {report['rows']} rows in {report['seconds']}s")
+        except Exception as e:
+            print(f"❌ Suggestions refresh failed: {e}")
+        if stop.wait(settings.SUGGESTIONS_REFRESH_SECONDS):
+            return
 
-def create_access_token(data: dict) -> str:
-    to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire, "iat": datetime.utcnow()})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+def start_suggestions_refresh(app: FastAPI):
+    app.state.suggestions_stop = threading.Event()
+    app.state.suggestions_thread = threading.Thread(
+        target=run_suggestions_refresh, args=(app.state.services, app.state.suggestions_stop),
+        name="suggestions-refresh", daemon=True
+    )
+    app.state.suggestions_thread.start()
 
-def verify_token(token: str) -> Optional[dict]:
-    try:
-        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    except JWTError:
-        return None
+def stop_suggestions_refresh(app: FastAPI):
+    thread = getattr(app.state, "suggestions_thread", None)
+    if thread is not None:
+        app.state.suggestions_stop.set()
+        thread.join(timeout=10)
 
-def generate_otp() -> str:
-    return ''.join(random.choices(string.digits, k=OTP_LENGTH))
+# ============= FASTAPI APP =============
 
-def generate_reset_token() -> str:
-    return secrets.token_urlsafe(32)
+@router.get("/", response_model=RootResponse)
+async def root():
+    return {"message": "Authentication API with Email Verification", "docs": "/docs"}
+
+# ============= METRICS =============
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus text exposition of request, SQL and operation timings"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
-def send_email(recipient: str, subject: str, body: str) -> bool:
+# ============= HEALTH CHECKS =============
+@router.get("/healthz", response_model=HealthResponse, include_in_schema=False)
+async def healthz():
+    """Liveness: the process is up and serving; touches nothing else."""
+    return {"status": "ok"}
+
+@router.get("/readyz", response_model=ReadinessResponse, include_in_schema=False)
+async def readyz(request: Request, response: Response):
+    """Readiness: startup has finished and the primary database answers."""
+    state = request.app.state
+    if not getattr(state, "ready", False):
+        response.status_code = 503
+        return {"status": "starting"}
     try:
-        message = MIMEText(body)
-        message["Subject"] = subject
-        message["From"] = GMAIL_USER
-        message["To"] = recipient
-        
-        with smtplib.SMTP("smtp.gmail.com", 587) as server:
-            server.starttls()
-            server.login(GMAIL_USER, GMAIL_APP_PASSWORD)
-            server.sendmail(GMAIL_USER, recipient, message.as_string())
-        return True
-    except Exception as e:
-        print(f"❌ Email sending failed: {e}")
-        return False
+        async with state.services.database.AsyncSessionLocal() as db:
+            await db.execute(text("SELECT 1"))
+    except DBAPIError:
+        response.status_code = 503
+        return {"status": "database unavailable", "startup_seconds": state.startup_seconds}
+    return {"status": "ready", "startup_seconds": state.startup_seconds}
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    payload = verify_token(credentials.credentials)
-    if not payload:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    return payload
+@router.get("/shopping-history", response_model=ShoppingHistoryPage)
+async def get_all_shopping_history(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(SHOPPING_HISTORY_PAGE_SIZE, ge=1, le=SHOPPING_HISTORY_MAX_PAGE_SIZE),
+    status: Optional[str] = None,
+    category: Optional[str] = None,
+    start_date: Union[datetime, date, None] = None,
+    end_date: Union[datetime, date, None] = None,
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Page through the current user's shopping history, newest first.
+    Pass back `next_cursor` to fetch the following page, and keep
+    `sync_cursor` to fetch later changes from /shopping-history/changes.
+    Responds 304 when the client's ETag is still current.
+    """
+    sync_version, modified_at = await get_sync_state(db, current_user["user_id"])
+    sync_cursor = encode_sync_cursor(sync_version)
+    version = f"{current_user['user_id']}|{sync_cursor}|{request.url.query}"
+    etag = '"' + hashlib.sha256(version.encode()).hexdigest()[:32] + '"'
+    headers = conditional_headers(etag, modified_at)
+    if is_not_modified(request, etag, modified_at):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    
+    query = select(*SHOPPING_HISTORY_COLUMNS).where(
+        *shopping_history_filters(current_user["user_id"], status, category, start_date, end_date)
+    )
+    
+    if cursor:
+        cursor_created_at, cursor_id = decode_cursor(cursor)
+        query = query.where(or_(
+            ShoppingHistory.created_at < cursor_created_at,
+            and_(ShoppingHistory.created_at == cursor_created_at, ShoppingHistory.id < cursor_id)
+        ))
+    
+    # Fetch one extra row to know whether another page exists
+    rows = (await db.execute(query.order_by(
+        ShoppingHistory.created_at.desc(),
+        ShoppingHistory.id.desc()
+    ).limit(limit + 1))).all()
+    
+    has_more = len(rows) > limit
+    # Plain dicts validate into the response model much faster than rows
+    items = [row._asdict() for row in rows[:limit]]
+    next_cursor = encode_cursor(items[-1]["created_at"], items[-1]["id"]) if has_more else None
+    
+    return {
+        "items": items,
+        "next_cursor": next_cursor,
+        "has_more": has_more,
+        "sync_cursor": sync_cursor
+    }
 
-# ============= PYDANTIC MODELS =============
-class SignupRequest(BaseModel):
-    email: EmailStr
-    password: str
-    full_name: Optional[str] = None
+# ============= SHOPPING HISTORY CHANGES (DELTA SYNC) =============
+@router.get("/shopping-history/changes", response_model=ShoppingHistoryChanges)
+async def get_shopping_history_changes(
+    since: str,
+    limit: int = Query(SYNC_PAGE_SIZE, ge=1, le=SYNC_PAGE_SIZE),
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Rows created or updated, and ids of rows deleted, after `since` (a
+    sync_cursor). Call again with the returned sync_cursor while
+    `has_more` is true. `reset` means deletes after the cursor are older
+    than TOMBSTONE_RETENTION_DAYS and their tombstones have been purged,
+    so the client must reload the full history instead.
+    """
+    user_id = current_user["user_id"]
+    version = decode_sync_cursor(since)
+    # Tombstones after the cursor have been purged, so deletes may be
+    # missing; cursors from before sync versions can't be resumed either
+    if version is None or version < await get_purged_sync_version(db, user_id):
+        return {"items": [], "deleted": [], "sync_cursor": None, "has_more": False, "reset": True}
+    
+    rows = (await db.execute(
+        select(*SHOPPING_HISTORY_COLUMNS, ShoppingHistory.sync_version)
+        .where(ShoppingHistory.user_id == user_id, ShoppingHistory.sync_version > version)
+        .order_by(ShoppingHistory.sync_version)
+        .limit(limit + 1)
+    )).all()
+    tombstones = (await db.execute(
+        select(ShoppingHistoryTombstone.history_id, ShoppingHistoryTombstone.sync_version)
+        .where(ShoppingHistoryTombstone.user_id == user_id, ShoppingHistoryTombstone.sync_version > version)
+        .order_by(ShoppingHistoryTombstone.sync_version)
+        .limit(limit + 1)
+    )).all()
+    
+    # The first `limit` changes of either kind, in version order
+    changes = sorted(itertools.chain(rows, tombstones), key=lambda change: change.sync_version)
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    if changes:
+        version = changes[-1].sync_version
+    
+    items = []
+    deleted = []
+    for change in changes:
+        if "history_id" in change._fields:
+            deleted.append(change.history_id)
+        else:
+            item = change._asdict()
+            del item["sync_version"]
+            items.append(item)
+    return {
+        "items": items,
+        "deleted": deleted,
+        "sync_cursor": encode_sync_cursor(version),
+        "has_more": has_more
+    }
 
-class VerifySignupRequest(BaseModel):
-    email: EmailStr
-    otp: str
+# ============= SEARCH SHOPPING HISTORY =============
+def search_terms(q: str) -> list:
+    # Only word characters reach the index, so user input can't inject
+    # FTS5 or tsquery operators
+    return re.findall(r"\w+", q.lower())[:10]
 
-class LoginRequest(BaseModel):
-    email: EmailStr
-    password: str
+def search_query(dialect: str, terms: list, user_id: int):
+    """
+    Select the user's rows matching every term as a prefix, best match
+    first. Returns (statement, ordering).
+    """
+    query = select(*SHOPPING_HISTORY_COLUMNS).where(ShoppingHistory.user_id == user_id)
+    if dialect == "sqlite":
+        match = " ".join(f'"{term}"*' for term in terms)
+        query = query.join(shopping_history_fts, shopping_history_fts.c.rowid == ShoppingHistory.id).where(
+            literal_column("shopping_history_fts").op("MATCH")(match)
+        )
+        return query, (shopping_history_fts.c.rank, ShoppingHistory.id.desc())
+    if dialect == "postgresql":
+        tsquery = func.to_tsquery("simple", " & ".join(f"{term}:*" for term in terms))
+        query = query.where(search_document.op("@@")(tsquery))
+        return query, (func.ts_rank(search_document, tsquery).desc(), ShoppingHistory.id.desc())
+    # No index on other backends: substring match, newest first
+    for term in terms:
+        pattern = f"%{term}%"
+        query = query.where(or_(
+            ShoppingHistory.product_name.ilike(pattern),
+            label_name(ShoppingHistory.category_id).ilike(pattern),
+            ShoppingHistory.delivery_address.ilike(pattern)
+        ))
+    return query, (ShoppingHistory.created_at.desc(), ShoppingHistory.id.desc())
 
-class OTPRequest(BaseModel):
-    email: EmailStr
+@router.get("/shopping-history/search", response_model=ShoppingHistorySearchResults)
+async def search_shopping_history(
+    q: str = Query(..., min_length=1, max_length=200),
+    status: Optional[str] = None,
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Search the current user's shopping history by product name, category
+    and delivery address. Each word matches as a prefix; results are
+    ranked by relevance. Pass back `next_offset` for the next page.
+    """
+    terms = search_terms(q)
+    if not terms:
+        raise HTTPException(status_code=400, detail="Search query must contain letters or digits")
+    
+    query, ordering = search_query(db.bind.dialect.name, terms, current_user["user_id"])
+    if status:
+        query = query.where(ShoppingHistory.status_code == status_code(status))
+    rows = (await db.execute(query.order_by(*ordering).offset(offset).limit(limit + 1))).all()
+    
+    has_more = len(rows) > limit
+    return {
+        "items": [row._asdict() for row in rows[:limit]],
+        "next_offset": offset + limit if has_more else None,
+        "has_more": has_more
+    }
 
-class VerifyOTPRequest(BaseModel):
-    email: EmailStr
-    otp: str
+# ============= SHOPPING SUMMARY =============
+@router.get("/shopping-history/summary", response_model=ShoppingSummary)
+async def get_shopping_summary(current_user: dict = Depends(get_current_user), db: AsyncSession = Depends(get_read_db)):
+    """
+    Spending totals for the current user, broken down by category,
+    status, payment method and month. Read from precomputed rollups.
+    """
+    rows = (await db.execute(
+        select(
+            SpendingRollup.dimension,
+            SpendingRollup.bucket,
+            SpendingRollup.order_count,
+            SpendingRollup.item_count,
+            SpendingRollup.total_cents
+        ).where(SpendingRollup.user_id == current_user["user_id"])
+    )).all()
+    return build_summary(rows)
 
-class ForgotPasswordRequest(BaseModel):
-    email: EmailStr
+# ============= SHOPPING SUGGESTIONS =============
+@router.get("/shopping-history/suggestions", response_model=ShoppingSuggestions)
+async def get_shopping_suggestions(
+    product: Optional[str] = Query(None, max_length=255),
+    limit: int = Query(SUGGESTIONS_PAGE_SIZE, ge=1, le=SUGGESTIONS_MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Reorder suggestions for the current user: products they buy again and
+    again, soonest due first (`due` once their usual interval since the
+    last purchase has passed). With `product`, also the products most
+    often bought together with it. Each list is one index range scan
+    over tables kept up to date by the suggestions job.
+    """
+    reorder = (await db.execute(
+        select(
+            RepeatPurchase.product,
+            RepeatPurchase.purchase_days,
+            RepeatPurchase.interval_days,
+            RepeatPurchase.last_purchased,
+            RepeatPurchase.next_due
+        )
+        .where(RepeatPurchase.user_id == current_user["user_id"], RepeatPurchase.next_due.isnot(None))
+        .order_by(RepeatPurchase.next_due, RepeatPurchase.product)
+        .limit(limit)
+    )).all()
+    related = []
+    if product:
+        related = (await db.execute(
+            select(CoPurchase.related_product.label("product"), CoPurchase.basket_count)
+            .where(CoPurchase.product == product, CoPurchase.basket_count > 0)
+            .order_by(CoPurchase.basket_count.desc(), CoPurchase.related_product.desc())
+            .limit(limit)
+        )).all()
+    today = date.today()
+    return {
+        "reorder": [{**row._asdict(), "due": row.next_due <= today} for row in reorder],
+        "related": [row._asdict() for row in related]
+    }
 
-class ResetPasswordRequest(BaseModel):
-    email: EmailStr
-    reset_token: str
-    new_password: str
+# ============= BULK INGEST SHOPPING HISTORY =============
+@router.post("/shopping-history/bulk", response_model=IngestReport, dependencies=[Depends(require_ingest_key)])
+async def bulk_ingest_shopping_history(
+    request: Request,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    services: Services = Depends(get_services),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Load shopping history records from an NDJSON or CSV request body.
+    Records whose token already exists are skipped, so a batch can be
+    safely retried. Requires the X-Ingest-Key header.
+    """
+    records = iter_ingest_records(iter_text_lines(request.stream()), format)
+    return await ingest_shopping_history(services.database, db, records)
 
-# ============= FASTAPI APP =============
+# ============= SHOPPING HISTORY STATUS TRANSITIONS =============
+@router.post(
+    "/shopping-history/status-transitions",
+    response_model=StatusTransitionReport,
+    dependencies=[Depends(require_ingest_key)]
+)
+async def transition_shopping_history_status(batch: StatusTransitionBatch, db: AsyncSession = Depends(get_db)):
+    """
+    Move orders through fulfilment in bulk: set each order's status, and
+    its delivery date when given. Each transition gets a result: updated,
+    not_found, invalid_transition (not allowed from the order's current
+    status), conflict (the order changed during the batch; retry it),
+    duplicate (id repeated in the batch) or error. Requires the
+    X-Ingest-Key header.
+    """
+    return await apply_status_transitions(db, batch.transitions)
 
-@app.get("/")
-def root():
-    return {"message": "Authentication API with Email Verification", "docs": "/docs"}
+# ============= EXPORT SHOPPING HISTORY =============
+@router.get("/shopping-history/export")
+async def export_shopping_history(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    status: Optional[str] = None,
+    category: Optional[str] = None,
+    start_date: Union[datetime, date, None] = None,
+    end_date: Union[datetime, date, None] = None,
+    services: Services = Depends(get_services),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Stream the current user's full shopping history as NDJSON or CSV.
+    Rows are fetched in batches and written out as they arrive, so memory
+    use does not grow with the size of the history.
+    """
+    conditions = shopping_history_filters(current_user["user_id"], status, category, start_date, end_date)
+    stmt = select(*SHOPPING_HISTORY_COLUMNS).where(*conditions).order_by(
+        ShoppingHistory.created_at, ShoppingHistory.id
+    ).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    
+    # Same replica choice and primary fallback as get_read_db
+    db = await open_read_session(services, current_user)
+    if format == "csv":
+        rows = stream_csv(stmt, db)
+        media_type = "text/csv"
+    else:
+        rows = stream_ndjson(stmt, db)
+        media_type = "application/x-ndjson"
+    
+    return StreamingResponse(
+        rows,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="shopping-history.{format}"'}
+    )
 
-@app.get("/shopping-history")
-def get_all_shopping_history(db: Session = Depends(get_db)):
-    shopping_history = db.query(ShoppingHistory).all()
-    return shopping_history
 # ============= SIGNUP (STEP 1: Send OTP) =============
-@app.post("/api/auth/signup")
-def signup(request: SignupRequest, db: Session = Depends(get_db)):
+@router.post("/api/auth/signup", response_model=SignupResponse)
+async def signup(
+    request: SignupRequest,
+    client: Request,
+    services: Services = Depends(get_services),
+    db: AsyncSession = Depends(get_db)
+):
     """
     Step 1: Create user and send verification OTP
     User account remains inactive until OTP is verified
     """
-    # Check if user exists
-    existing_user = db.query(User).filter(User.email == request.email).first()
+    enforce_rate_limit(services, "email", client, request.email)
+    
+    # Check if user exists (fresh: the password is overwritten below)
+    existing_user = await get_user_by_email(services, db, request.email, use_cache=False)
     
     if existing_user:
         if existing_user.is_verified:
             raise HTTPException(status_code=400, detail="Email already registered and verified")
-        else:
-            # User exists but not verified - allow resending OTP
-            user = existing_user
-            user.password = hash_password(request.password)
-            user.full_name = request.full_name
+        # User exists but not verified - allow resending OTP. Guarded, so
+        # an account verified since the read above is never overwritten.
+        user = existing_user
+        updated = await db.execute(
+            update(User)
+            .where(User.id == user.id, User.is_verified == False)
+            .values(password=await hash_password(services, request.password), full_name=request.full_name)
+        )
+        if updated.rowcount == 0:
+            raise HTTPException(status_code=400, detail="Email already registered and verified")
     else:
-        # Create new user (inactive)
+        # Create new user (inactive); flushing assigns the id without
+        # committing, so the user, code and email land in one transaction
         user = User(
             email=request.email,
-            password=hash_password(request.password),
+            password=await hash_password(services, request.password),
             full_name=request.full_name,
             is_active=False,
             is_verified=False,
             created_at=datetime.now()
         )
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.flush()
     
     # Generate OTP
-    otp = generate_otp()
-    expiry = datetime.now() + timedelta(minutes=OTP_EXPIRY_MINUTES)
-    
-    # Save OTP
-    new_otp = OTP(
-        user_id=user.id, 
-        otp=otp, 
-        expiry_time=expiry, 
-        is_verified=False,
-        otp_type="signup",
-        created_at=datetime.now()
-    )
-    db.add(new_otp)
-    db.commit()
+    otp = generate_otp(services.settings.OTP_LENGTH)
+    expiry = datetime.now() + timedelta(minutes=services.settings.OTP_EXPIRY_MINUTES)
+    
+    # Save OTP (replaces any earlier signup code; a new user has none)
+    await services.otp_store.put(db, user.id, "signup", otp, expiry, replace=existing_user is not None)
     
-    # Send verification email
+    # Queue verification email
     body = f"""Welcome to Our Platform!
 
 Your verification code is: {otp}
 
-This code will expire in {OTP_EXPIRY_MINUTES} minutes.
+This code will expire in {services.settings.OTP_EXPIRY_MINUTES} minutes.
 
 Please verify your email to complete registration.
 
 If you didn't create this account, please ignore this email."""
     
-    email_sent = send_email(request.email, "Verify Your Email - OTP Code", body)
-    
-    if not email_sent:
-        raise HTTPException(status_code=500, detail="Failed to send verification email. Please try again.")
+    enqueue_email(services, db, request.email, "Verify Your Email - OTP Code", body)
+    await db.commit()
+    forget_user(services, user)
     
     return {
         "success": True,
@@ -281,46 +3083,48 @@ If you didn't create this account, please ignore this email."""
     }
 
 # ============= VERIFY SIGNUP OTP (STEP 2) =============
-@app.post("/api/auth/verify-signup")
-def verify_signup(request: VerifySignupRequest, db: Session = Depends(get_db)):
+@router.post("/api/auth/verify-signup", response_model=VerifySignupResponse)
+async def verify_signup(
+    request: VerifySignupRequest,
+    services: Services = Depends(get_services),
+    db: AsyncSession = Depends(get_db)
+):
     """
     Step 2: Verify OTP and activate user account
     """
-    # Get user
-    user = db.query(User).filter(User.email == request.email).first()
+    # Get user (fresh: it is activated below)
+    user = await get_user_by_email(services, db, request.email, use_cache=False)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     if user.is_verified:
         raise HTTPException(status_code=400, detail="Email already verified. Please login.")
     
-    # Get latest signup OTP
-    otp = db.query(OTP).filter(
-        OTP.user_id == user.id,
-        OTP.otp_type == "signup"
-    ).order_by(OTP.created_at.desc()).first()
-    
-    if not otp:
-        raise HTTPException(status_code=404, detail="No verification code found. Please request a new one.")
-    
-    if datetime.now() > otp.expiry_time:
-        raise HTTPException(status_code=400, detail="Verification code expired. Please request a new one.")
-    
-    if otp.is_verified:
-        raise HTTPException(status_code=400, detail="Code already used. Please request a new one.")
-    
-    if otp.otp != request.otp:
+    # Check and consume the code in one statement; only a failed
+    # attempt reads it back to explain why
+    if not await services.otp_store.consume(db, user.id, "signup", request.otp):
+        otp = await services.otp_store.get(db, user.id, "signup")
+        
+        if not otp:
+            raise HTTPException(status_code=404, detail="No verification code found. Please request a new one.")
+        
+        if datetime.now() > otp.expiry_time:
+            raise HTTPException(status_code=400, detail="Verification code expired. Please request a new one.")
+        
+        if otp.is_verified:
+            raise HTTPException(status_code=400, detail="Code already used. Please request a new one.")
+        
         raise HTTPException(status_code=400, detail="Invalid verification code")
     
     # Activate user
-    otp.is_verified = True
     user.is_verified = True
     user.is_active = True
     user.last_login = datetime.now()
-    db.commit()
+    await db.commit()
+    forget_user(services, user)
     
     # Generate access token
-    access_token = create_access_token({"user_id": user.id, "email": user.email})
+    access_token = create_access_token(services, {"user_id": user.id, "email": user.email})
     
     return {
         "success": True,
@@ -335,12 +3139,19 @@ def verify_signup(request: VerifySignupRequest, db: Session = Depends(get_db)):
     }
 
 # ============= RESEND VERIFICATION CODE =============
-@app.post("/api/auth/resend-verification")
-def resend_verification(request: OTPRequest, db: Session = Depends(get_db)):
+@router.post("/api/auth/resend-verification", response_model=MessageResponse)
+async def resend_verification(
+    request: OTPRequest,
+    client: Request,
+    services: Services = Depends(get_services),
+    db: AsyncSession = Depends(get_db)
+):
     """
     Resend verification OTP for unverified accounts
     """
-    user = db.query(User).filter(User.email == request.email).first()
+    enforce_rate_limit(services, "email", client, request.email)
+    
+    user = await get_user_by_email(services, db, request.email)
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -349,31 +3160,20 @@ def resend_verification(request: OTPRequest, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Email already verified. Please login.")
     
     # Generate new OTP
-    otp = generate_otp()
-    expiry = datetime.now() + timedelta(minutes=OTP_EXPIRY_MINUTES)
+    otp = generate_otp(services.settings.OTP_LENGTH)
+    expiry = datetime.now() + timedelta(minutes=services.settings.OTP_EXPIRY_MINUTES)
     
-    new_otp = OTP(
-        user_id=user.id,
-        otp=otp,
-        expiry_time=expiry,
-        is_verified=False,
-        otp_type="signup",
-        created_at=datetime.now()
-    )
-    db.add(new_otp)
-    db.commit()
+    await services.otp_store.put(db, user.id, "signup", otp, expiry)
     
-    # Send email
+    # Queue email
     body = f"""Your new verification code is: {otp}
 
-This code will expire in {OTP_EXPIRY_MINUTES} minutes.
+This code will expire in {services.settings.OTP_EXPIRY_MINUTES} minutes.
 
 If you didn't request this, please ignore this email."""
     
-    email_sent = send_email(request.email, "New Verification Code", body)
-    
-    if not email_sent:
-        raise HTTPException(status_code=500, detail="Failed to send email")
+    enqueue_email(services, db, request.email, "New Verification Code", body)
+    await db.commit()
     
     return {
         "success": True,
@@ -381,12 +3181,20 @@ If you didn't request this, please ignore this email."""
     }
 
 # ============= LOGIN =============
-@app.post("/api/auth/login")
-def login(request: LoginRequest, db: Session = Depends(get_db)):
+@router.post("/api/auth/login", response_model=AuthResponse)
+async def login(
+    request: LoginRequest,
+    client: Request,
+    services: Services = Depends(get_services),
+    db: AsyncSession = Depends(get_db)
+):
     """
     Login with email and password (only for verified users)
     """
-    user = db.query(User).filter(User.email == request.email).first()
+    enforce_rate_limit(services, "login", client, request.email)
+    
+    # Read fresh: password and account state must be current
+    user = await db.scalar(select(User).where(User.email == request.email))
     
     if not user or not user.password:
         raise HTTPException(status_code=401, detail="Invalid email or password")
@@ -397,7 +3205,7 @@ def login(request: LoginRequest, db: Session = Depends(get_db)):
             detail="Email not verified. Please verify your email first."
         )
     
-    if not verify_password(request.password, user.password):
+    if not await verify_password(services, request.password, user.password):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
     if not user.is_active:
@@ -405,10 +3213,11 @@ def login(request: LoginRequest, db: Session = Depends(get_db)):
     
     # Update last login
     user.last_login = datetime.now()
-    db.commit()
+    await db.commit()
+    forget_user(services, user)
     
     # Generate token
-    access_token = create_access_token({"user_id": user.id, "email": user.email})
+    access_token = create_access_token(services, {"user_id": user.id, "email": user.email})
     
     return {
         "success": True,
@@ -422,12 +3231,19 @@ def login(request: LoginRequest, db: Session = Depends(get_db)):
     }
 
 # ============= SEND OTP (for OTP-based login) =============
-@app.post("/api/auth/send-otp")
-def send_otp(request: OTPRequest, db: Session = Depends(get_db)):
+@router.post("/api/auth/send-otp", response_model=MessageResponse)
+async def send_otp(
+    request: OTPRequest,
+    client: Request,
+    services: Services = Depends(get_services),
+    db: AsyncSession = Depends(get_db)
+):
     """
     Send OTP for passwordless login (only for verified users)
     """
-    user = db.query(User).filter(User.email == request.email).first()
+    enforce_rate_limit(services, "email", client, request.email)
+    
+    user = await get_user_by_email(services, db, request.email)
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found. Please signup first.")
@@ -439,31 +3255,20 @@ def send_otp(request: OTPRequest, db: Session = Depends(get_db)):
         )
     
     # Generate OTP
-    otp = generate_otp()
-    expiry = datetime.now() + timedelta(minutes=OTP_EXPIRY_MINUTES)
+    otp = generate_otp(services.settings.OTP_LENGTH)
+    expiry = datetime.now() + timedelta(minutes=services.settings.OTP_EXPIRY_MINUTES)
     
-    new_otp = OTP(
-        user_id=user.id,
-        otp=otp,
-        expiry_time=expiry,
-        is_verified=False,
-        otp_type="login",
-        created_at=datetime.now()
-    )
-    db.add(new_otp)
-    db.commit()
+    await services.otp_store.put(db, user.id, "login", otp, expiry)
     
-    # Send email
+    # Queue email
     body = f"""Your login OTP code is: {otp}
 
-This code will expire in {OTP_EXPIRY_MINUTES} minutes.
+This code will expire in {services.settings.OTP_EXPIRY_MINUTES} minutes.
 
 If you didn't request this, please ignore this email."""
     
-    email_sent = send_email(request.email, "Your Login OTP Code", body)
-    
-    if not email_sent:
-        raise HTTPException(status_code=500, detail="Failed to send OTP")
+    enqueue_email(services, db, request.email, "Your Login OTP Code", body)
+    await db.commit()
     
     return {
         "success": True,
@@ -471,12 +3276,17 @@ If you didn't request this, please ignore this email."""
     }
 
 # ============= VERIFY OTP (for OTP-based login) =============
-@app.post("/api/auth/verify-otp")
-def verify_otp(request: VerifyOTPRequest, db: Session = Depends(get_db)):
+@router.post("/api/auth/verify-otp", response_model=AuthResponse)
+async def verify_otp(
+    request: VerifyOTPRequest,
+    services: Services = Depends(get_services),
+    db: AsyncSession = Depends(get_db)
+):
     """
     Verify OTP for passwordless login
     """
-    user = db.query(User).filter(User.email == request.email).first()
+    # Fresh: last_login is written below
+    user = await get_user_by_email(services, db, request.email, use_cache=False)
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -484,31 +3294,28 @@ def verify_otp(request: VerifyOTPRequest, db: Session = Depends(get_db)):
     if not user.is_verified:
         raise HTTPException(status_code=403, detail="Email not verified")
     
-    # Get latest login OTP
-    otp = db.query(OTP).filter(
-        OTP.user_id == user.id,
-        OTP.otp_type == "login"
-    ).order_by(OTP.created_at.desc()).first()
-    
-    if not otp:
-        raise HTTPException(status_code=404, detail="No OTP found. Please request a new OTP")
-    
-    if datetime.now() > otp.expiry_time:
-        raise HTTPException(status_code=400, detail="OTP expired. Please request a new OTP")
-    
-    if otp.is_verified:
-        raise HTTPException(status_code=400, detail="OTP already used. Please request a new OTP")
-    
-    if otp.otp != request.otp:
+    # Check and consume the code in one statement; only a failed
+    # attempt reads it back to explain why
+    if not await services.otp_store.consume(db, user.id, "login", request.otp):
+        otp = await services.otp_store.get(db, user.id, "login")
+        
+        if not otp:
+            raise HTTPException(status_code=404, detail="No OTP found. Please request a new OTP")
+        
+        if datetime.now() > otp.expiry_time:
+            raise HTTPException(status_code=400, detail="OTP expired. Please request a new OTP")
+        
+        if otp.is_verified:
+            raise HTTPException(status_code=400, detail="OTP already used. Please request a new OTP")
+        
         raise HTTPException(status_code=400, detail="Invalid OTP")
     
-    # Mark as verified
-    otp.is_verified = True
     user.last_login = datetime.now()
-    db.commit()
+    await db.commit()
+    forget_user(services, user)
     
     # Generate token
-    access_token = create_access_token({"user_id": user.id, "email": user.email})
+    access_token = create_access_token(services, {"user_id": user.id, "email": user.email})
     
     return {
         "success": True,
@@ -522,9 +3329,16 @@ def verify_otp(request: VerifyOTPRequest, db: Session = Depends(get_db)):
     }
 
 # ============= FORGOT PASSWORD =============
-@app.post("/api/auth/forgot-password")
-def forgot_password(request: ForgotPasswordRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == request.email).first()
+@router.post("/api/auth/forgot-password", response_model=MessageResponse)
+async def forgot_password(
+    request: ForgotPasswordRequest,
+    client: Request,
+    services: Services = Depends(get_services),
+    db: AsyncSession = Depends(get_db)
+):
+    enforce_rate_limit(services, "email", client, request.email)
+    
+    user = await get_user_by_email(services, db, request.email)
     
     if not user:
         return {
@@ -544,9 +3358,8 @@ def forgot_password(request: ForgotPasswordRequest, db: Session = Depends(get_db
         created_at=datetime.now()
     )
     db.add(new_token)
-    db.commit()
     
-    # Send email
+    # Queue email
     body = f"""Password Reset Request
 
 Your password reset token: {reset_token}
@@ -557,7 +3370,8 @@ Use this token with the reset-password API endpoint.
 
 If you didn't request this, please ignore this email."""
     
-    send_email(request.email, "Password Reset Request", body)
+    enqueue_email(services, db, request.email, "Password Reset Request", body)
+    await db.commit()
     
     return {
         "success": True,
@@ -565,20 +3379,24 @@ If you didn't request this, please ignore this email."""
     }
 
 # ============= RESET PASSWORD =============
-@app.post("/api/auth/reset-password")
-def reset_password(request: ResetPasswordRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == request.email).first()
-    
-    if not user:
-        raise HTTPException(status_code=400, detail="Invalid reset token")
-    
-    token = db.query(ResetToken).filter(
-        ResetToken.user_id == user.id,
-        ResetToken.token == request.reset_token
-    ).order_by(ResetToken.created_at.desc()).first()
-    
-    if not token:
+@router.post("/api/auth/reset-password", response_model=MessageResponse)
+async def reset_password(
+    request: ResetPasswordRequest,
+    services: Services = Depends(get_services),
+    db: AsyncSession = Depends(get_db)
+):
+    # Read the user and token fresh, in one query
+    row = (await db.execute(
+        select(User, ResetToken)
+        .join(ResetToken, ResetToken.user_id == User.id)
+        .where(User.email == request.email, ResetToken.token == request.reset_token)
+        .order_by(ResetToken.created_at.desc())
+        .limit(1)
+    )).first()
+    
+    if not row:
         raise HTTPException(status_code=400, detail="Invalid reset token")
+    user, token = row
     
     if datetime.now() > token.expiry_time:
         raise HTTPException(status_code=400, detail="Reset token has expired")
@@ -586,20 +3404,71 @@ def reset_password(request: ResetPasswordRequest, db: Session = Depends(get_db))
     if token.is_used:
         raise HTTPException(status_code=400, detail="Reset token already used")
     
-    # Update password
-    user.password = hash_password(request.new_password)
-    token.is_used = True
-    db.commit()
+    # Update password; the guarded update stops a concurrent reset from
+    # using the same token twice
+    user.password = await hash_password(services, request.new_password)
+    consumed = await db.execute(
+        update(ResetToken).where(ResetToken.id == token.id, ResetToken.is_used == False).values(is_used=True)
+    )
+    if consumed.rowcount == 0:
+        raise HTTPException(status_code=400, detail="Reset token already used")
+    # Sign out every session that used the old password
+    revoked = revoke_tokens(services, db, user.id)
+    await db.commit()
+    forget_user(services, user)
+    services.revocation_list.add_row(revoked)
     
     return {
         "success": True,
         "message": "Password reset successful"
     }
 
+# ============= LOGOUT =============
+@router.post("/api/auth/logout", response_model=MessageResponse)
+async def logout(
+    current_user: dict = Depends(get_current_user),
+    services: Services = Depends(get_services),
+    db: AsyncSession = Depends(get_db)
+):
+    jti = current_user.get("jti")
+    if jti is None:
+        # Issued before tokens carried a jti; only a revoke-all covers it
+        revoked = revoke_tokens(services, db, current_user["user_id"])
+    else:
+        revoked = revoke_tokens(
+            services, db, current_user["user_id"], jti=jti, expires_at=datetime.fromtimestamp(current_user["exp"])
+        )
+    await db.commit()
+    services.revocation_list.add_row(revoked)
+    
+    return {
+        "success": True,
+        "message": "Logged out"
+    }
+
+# ============= LOGOUT EVERYWHERE =============
+@router.post("/api/auth/logout-all", response_model=MessageResponse)
+async def logout_all(
+    current_user: dict = Depends(get_current_user),
+    services: Services = Depends(get_services),
+    db: AsyncSession = Depends(get_db)
+):
+    revoked = revoke_tokens(services, db, current_user["user_id"])
+    await db.commit()
+    services.revocation_list.add_row(revoked)
+    
+    return {
+        "success": True,
+        "message": "Logged out of all sessions"
+    }
+
 # ============= GET PROFILE (PROTECTED) =============
-@app.get("/api/user/profile")
-def get_profile(current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == current_user["user_id"]).first()
+@router.get("/api/user/profile", response_model=ProfileResponse)
+async def get_profile(
+    current_user: dict = Depends(get_current_user),
+    services: Services = Depends(get_services)
+):
+    user = await get_user_for_read(services, current_user)
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -610,13 +3479,13 @@ def get_profile(current_user: dict = Depends(get_current_user), db: Session = De
         "full_name": user.full_name,
         "is_active": user.is_active,
         "is_verified": user.is_verified,
-        "created_at": str(user.created_at),
-        "last_login": str(user.last_login) if user.last_login else None
+        "created_at": user.created_at,
+        "last_login": user.last_login
     }
 
 # ============= VERIFY TOKEN =============
-@app.get("/api/user/verify-token")
-def verify_token_endpoint(current_user: dict = Depends(get_current_user)):
+@router.get("/api/user/verify-token", response_model=TokenInfoResponse)
+async def verify_token_endpoint(current_user: dict = Depends(get_current_user)):
     return {
         "success": True,
         "message": "Token is valid",
@@ -624,6 +3493,74 @@ def verify_token_endpoint(current_user: dict = Depends(get_current_user)):
         "email": current_user["email"]
     }
 
+# ============= APP FACTORY =============
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    settings = app.state.settings
+    # Built here rather than in create_app, so each worker forked by
+    # serve.py gets its own pools and threads
+    services = app.state.services = Services(settings)
+    if settings.DB_MIGRATE:
+        create_schema(services.database)
+    await services.database.prewarm(settings.DB_POOL_PREWARM)
+    start_revocation_refresh(app)
+    # Jobs for the whole database rather than this process: run by one
+    # worker only (see serve.py)
+    if settings.BACKGROUND_JOBS_ENABLED:
+        if settings.EMAIL_DISPATCHER_ENABLED:
+            start_outbox_dispatcher(app)
+        if settings.PURGE_ENABLED:
+            start_maintenance(app)
+        if settings.SUGGESTIONS_ENABLED:
+            start_suggestions_refresh(app)
+    app.state.startup_seconds = round(time.perf_counter() - BOOT_STARTED, 3)
+    app.state.ready = True
+    print(f"🚀 Ready in {app.state.startup_seconds}s")
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        stop_suggestions_refresh(app)
+        stop_maintenance(app)
+        stop_outbox_dispatcher(app)
+        stop_revocation_refresh(app)
+        await services.close()
+
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    """
+    Build the API for `settings` (by default, read from the environment).
+    Its Services are built, and the database connected (and, with
+    DB_MIGRATE, migrated), by the lifespan, before /readyz reports ready.
+    """
+    settings = settings or get_settings()
+    app = FastAPI(
+        title="Authentication API",
+        version="2.0.0",
+        default_response_class=ORJSONResponse,
+        lifespan=lifespan
+    )
+    app.state.settings = settings
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    # Outermost, so its timings cover the CORS middleware too
+    app.add_middleware(MetricsMiddleware, server_timing=settings.SERVER_TIMING_ENABLED)
+    app.include_router(router)
+    return app
+
+def __getattr__(name: str):
+    # `main.app` (e.g. `uvicorn main:app`) is built on first use, so
+    # importing this module reads no settings and does no I/O
+    if name == "app":
+        app = globals()["app"] = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Single-process development server; production runs serve.py
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(create_app(), host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,111 @@
+"""
+Database maintenance commands, for running outside the API process
+(e.g. from cron):
+
+    python maintenance.py migrate
+    python maintenance.py purge
+    python maintenance.py backfill-rollups --chunk-size 500
+    python maintenance.py spend-report --user-id 42
+    python maintenance.py rebuild-suggestions
+    python maintenance.py ingest orders.ndjson
+    python maintenance.py ingest orders.csv --format csv
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+import main
+from config import get_settings
+
+
+def migrate(database, args):
+    main.create_schema(database)
+    print("Schema is up to date")
+
+
+def purge(database, args):
+    report = main.purge_expired_rows(database)
+    print(f"Removed {main.purge_summary(report)}")
+
+
+def backfill_rollups(database, args):
+    report = main.backfill_rollups(database, chunk_size=args.chunk_size)
+    print(f"Rebuilt rollups for {report['users']} users from {report['rows']} rows in {report['seconds']}s")
+
+
+def spend_report(database, args):
+    report = main.spend_report(database, user_id=args.user_id, chunk_size=args.chunk_size)
+    print(json.dumps(report, indent=2))
+
+
+def rebuild_suggestions(database, args):
+    report = main.rebuild_suggestions(database, chunk_size=args.chunk_size)
+    if not report["rebuilt"]:
+        print("Another process rebuilt the suggestions at the same time; left its result in place")
+        return
+    print(
+        f"Rebuilt suggestions from {report['rows']} rows: {report['co_purchases']} product pairs, "
+        f"{report['repeat_purchases']} repeat purchases in {report['seconds']}s"
+    )
+
+
+async def read_lines(stream):
+    for line_number, line in enumerate(stream, start=1):
+        yield line_number, line.rstrip("\n")
+
+
+async def run_ingest(database, stream, format: str) -> dict:
+    records = main.iter_ingest_records(read_lines(stream), format)
+    async with database.AsyncSessionLocal() as db:
+        return await main.ingest_shopping_history(database, db, records)
+
+
+def ingest(database, args):
+    format = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+    if args.path == "-":
+        report = asyncio.run(run_ingest(database, sys.stdin, format))
+    else:
+        with open(args.path, newline="", encoding="utf-8") as stream:
+            report = asyncio.run(run_ingest(database, stream, format))
+    print(json.dumps(report, indent=2))
+
+
+def cli():
+    parser = argparse.ArgumentParser(description="Database maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = commands.add_parser("migrate", help="create missing tables and indexes, converting old shopping history rows")
+    migrate_parser.set_defaults(handler=migrate)
+
+    purge_parser = commands.add_parser("purge", help="delete expired/used OTPs, reset tokens and sent emails")
+    purge_parser.set_defaults(handler=purge)
+
+    backfill_parser = commands.add_parser("backfill-rollups", help="rebuild spending rollups from shopping history")
+    backfill_parser.add_argument("--chunk-size", type=int, default=main.ROLLUP_BACKFILL_CHUNK_SIZE)
+    backfill_parser.set_defaults(handler=backfill_rollups)
+
+    report_parser = commands.add_parser(
+        "spend-report", help="spend breakdown computed from shopping history, for one user or everyone"
+    )
+    report_parser.add_argument("--user-id", type=int)
+    report_parser.add_argument("--chunk-size", type=int, default=main.ANALYTICS_CHUNK_SIZE)
+    report_parser.set_defaults(handler=spend_report)
+
+    suggestions_parser = commands.add_parser(
+        "rebuild-suggestions", help="rebuild the co-purchase and repeat-purchase indexes from shopping history"
+    )
+    suggestions_parser.add_argument("--chunk-size", type=int, default=main.SUGGESTIONS_CHUNK_SIZE)
+    suggestions_parser.set_defaults(handler=rebuild_suggestions)
+
+    ingest_parser = commands.add_parser("ingest", help="bulk load shopping history from NDJSON or CSV")
+    ingest_parser.add_argument("path", help="input file, or - for stdin")
+    ingest_parser.add_argument("--format", choices=["ndjson", "csv"], help="defaults from the file extension")
+    ingest_parser.set_defaults(handler=ingest)
+
+    args = parser.parse_args()
+    args.handler(main.Database(get_settings()), args)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,228 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+_registry = []
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_format_labels(names, key + (bound,))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ============= PER-REQUEST STATS =============
+class RequestStats:
+    """Time spent per operation ('db', 'bcrypt', ...) during one request."""
+
+    def __init__(self):
+        self.durations = {}
+        self.counts = {}
+
+    def add(self, operation: str, seconds: float):
+        self.durations[operation] = self.durations.get(operation, 0.0) + seconds
+        self.counts[operation] = self.counts.get(operation, 0) + 1
+
+
+_current_request = contextvars.ContextVar("request_stats", default=None)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    return _current_request.get()
+
+
+operation_duration = Histogram(
+    "app_operation_duration_seconds",
+    "Time spent in instrumented operations.",
+    ["operation"]
+)
+
+
+def record_operation(operation: str, seconds: float):
+    operation_duration.observe(seconds, operation=operation)
+    stats = _current_request.get()
+    if stats is not None:
+        stats.add(operation, seconds)
+
+
+@contextmanager
+def timed(operation: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_operation(operation, time.perf_counter() - started)
+
+
+# ============= SQL HOOKS =============
+sql_statements = Counter("db_statements_total", "SQL statements executed.")
+
+
+def instrument_engine(engine):
+    """Time every cursor execution on a (sync) SQLAlchemy engine."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        sql_statements.inc()
+        record_operation("db", time.perf_counter() - started)
+
+
+# ============= MIDDLEWARE =============
+request_duration = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route.",
+    ["method", "route", "status"]
+)
+request_db_statements = Histogram(
+    "http_request_db_statements",
+    "SQL statements issued per HTTP request.",
+    ["route"],
+    buckets=COUNT_BUCKETS
+)
+request_db_duration = Histogram(
+    "http_request_db_duration_seconds",
+    "Time spent in SQL per HTTP request.",
+    ["route"]
+)
+
+
+class MetricsMiddleware:
+    """
+    Records latency and SQL usage per route. With server_timing=True,
+    responses also get a Server-Timing header (covering work done
+    before the response headers were sent).
+    """
+
+    def __init__(self, app, server_timing: bool = False):
+        self.app = app
+        self.server_timing = server_timing
+        self._route_paths = None
+
+    def _route_label(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._route_paths is None:
+            self._route_paths = {
+                getattr(route, "endpoint", None): route.path for route in scope["app"].routes
+            }
+        return self._route_paths.get(endpoint, endpoint.__name__)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    entries = [f"app;dur={(time.perf_counter() - started) * 1000:.1f}"]
+                    for operation, seconds in stats.durations.items():
+                        entries.append(
+                            f'{operation};dur={seconds * 1000:.1f};desc="{stats.counts[operation]} calls"'
+                        )
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", ", ".join(entries).encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_request.reset(token)
+            route = self._route_label(scope)
+            request_duration.observe(
+                time.perf_counter() - started, method=scope["method"], route=route, status=str(status)
+            )
+            request_db_statements.observe(stats.counts.get("db", 0), route=route)
+            request_db_duration.observe(stats.durations.get("db", 0.0), route=route)
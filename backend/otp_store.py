@@ -0,0 +1,151 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select, update
+
+
+@dataclass
+class OTPRecord:
+    code: str
+    expiry_time: datetime
+    is_verified: bool = False
+
+
+class OTPStore:
+    """
+    Holds at most one live OTP per (user, otp_type).
+    `db` is the request's AsyncSession; stores that keep codes in the
+    database write through it so the caller's commit covers them.
+    """
+
+    async def put(self, db, user_id: int, otp_type: str, code: str, expiry_time: datetime, replace: bool = True):
+        """
+        Issue a code. Pass replace=False when the user can't have one yet
+        (e.g. was created in this transaction) to skip looking for it.
+        """
+        raise NotImplementedError
+
+    async def get(self, db, user_id: int, otp_type: str) -> Optional[OTPRecord]:
+        raise NotImplementedError
+
+    async def consume(self, db, user_id: int, otp_type: str, code: str) -> bool:
+        """
+        Mark the live OTP used if it equals `code` and is neither expired
+        nor used. Returns False otherwise; callers can then get() it to
+        find out why.
+        """
+        raise NotImplementedError
+
+
+class SQLOTPStore(OTPStore):
+    """
+    OTPs in the `otps` table, which has a unique (user_id, otp_type)
+    index. Issuing a code upserts the user's row for that type in one
+    statement. dialect_insert(dialect name) returns the dialect's
+    insert() supporting ON CONFLICT, or None; other dialects update,
+    then insert if there was no row.
+    """
+
+    CODE_FIELDS = ("otp", "expiry_time", "is_verified", "created_at")
+
+    def __init__(self, model, dialect_insert):
+        self.model = model
+        self.dialect_insert = dialect_insert
+
+    async def put(self, db, user_id: int, otp_type: str, code: str, expiry_time: datetime, replace: bool = True):
+        model = self.model
+        values = {"otp": code, "expiry_time": expiry_time, "is_verified": False, "created_at": datetime.now()}
+        connection = await db.connection()
+        upsert = self.dialect_insert(connection.dialect.name)
+        if upsert is not None:
+            insert_stmt = upsert(model.__table__).values(user_id=user_id, otp_type=otp_type, **values)
+            await db.execute(insert_stmt.on_conflict_do_update(
+                index_elements=["user_id", "otp_type"],
+                set_={field: insert_stmt.excluded[field] for field in self.CODE_FIELDS}
+            ))
+            return
+        if replace:
+            result = await db.execute(
+                update(model).where(model.user_id == user_id, model.otp_type == otp_type).values(**values)
+            )
+            if result.rowcount:
+                return
+        await db.execute(model.__table__.insert().values(user_id=user_id, otp_type=otp_type, **values))
+
+    async def get(self, db, user_id: int, otp_type: str) -> Optional[OTPRecord]:
+        model = self.model
+        row = (await db.execute(
+            select(model.otp, model.expiry_time, model.is_verified)
+            .where(model.user_id == user_id, model.otp_type == otp_type)
+        )).first()
+        if row is None:
+            return None
+        return OTPRecord(code=row.otp, expiry_time=row.expiry_time, is_verified=bool(row.is_verified))
+
+    async def consume(self, db, user_id: int, otp_type: str, code: str) -> bool:
+        model = self.model
+        # Check and mark in one statement; concurrent attempts can't both win
+        result = await db.execute(
+            update(model)
+            .where(
+                model.user_id == user_id,
+                model.otp_type == otp_type,
+                model.otp == code,
+                model.is_verified == False,
+                model.expiry_time >= datetime.now()
+            )
+            .values(is_verified=True)
+        )
+        return result.rowcount > 0
+
+
+class MemoryOTPStore(OTPStore):
+    """
+    Process-local OTPs with automatic expiry, bounded to max_entries
+    (oldest codes are evicted first). Only suitable for a single worker.
+    """
+
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, now: datetime):
+        # Entries are kept in insertion order and all share the same
+        # lifetime, so expired ones are at the front
+        while self._entries:
+            record = next(iter(self._entries.values()))
+            if record.expiry_time > now and len(self._entries) <= self.max_entries:
+                break
+            self._entries.popitem(last=False)
+
+    async def put(self, db, user_id: int, otp_type: str, code: str, expiry_time: datetime, replace: bool = True):
+        key = (user_id, otp_type)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = OTPRecord(code=code, expiry_time=expiry_time)
+            self._evict(datetime.now())
+
+    async def get(self, db, user_id: int, otp_type: str) -> Optional[OTPRecord]:
+        with self._lock:
+            record = self._entries.get((user_id, otp_type))
+            if record is None:
+                return None
+            if record.expiry_time <= datetime.now():
+                del self._entries[(user_id, otp_type)]
+                return None
+            return OTPRecord(record.code, record.expiry_time, record.is_verified)
+
+    async def consume(self, db, user_id: int, otp_type: str, code: str) -> bool:
+        with self._lock:
+            record = self._entries.get((user_id, otp_type))
+            if record is None or record.is_verified or record.code != code or record.expiry_time < datetime.now():
+                return False
+            record.is_verified = True
+            return True
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,120 @@
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from passlib.context import CryptContext
+
+# Per-process context, built by the pool initializer (or inline when the
+# pool is disabled). Kept at module level so worker tasks stay picklable.
+_context = None
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many hashing jobs are already queued."""
+
+
+def _init_context(rounds: int):
+    global _context
+    _context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+
+
+def _hash(password: str) -> str:
+    return _context.hash(password)
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return _context.verify(plain_password, hashed_password)
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a dedicated process pool so hashing doesn't hold the
+    GIL of the serving process. With workers=0 hashing runs inline.
+    At most max_pending jobs may be queued or running at once; beyond
+    that PasswordHasherBusy is raised immediately.
+    """
+
+    def __init__(self, rounds: int = 12, workers: int = 2, max_pending: int = 64):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        if not workers:
+            _init_context(rounds)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Created on first use so importing the app doesn't spawn processes.
+        # By then the server runs background threads, so its workers come
+        # from a fork server (or are spawned), never forked from it.
+        with self._lock:
+            if self._executor is None:
+                start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    initializer=_init_context,
+                    initargs=(self.rounds,),
+                    mp_context=multiprocessing.get_context(start_method)
+                )
+            return self._executor
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+
+    def _admit(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise PasswordHasherBusy()
+            self._pending += 1
+
+    def _submit(self, fn, *args):
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _run(self, fn, *args):
+        self._admit()
+        if not self.workers:
+            try:
+                return fn(*args)
+            finally:
+                self._release()
+        return self._submit(fn, *args).result()
+
+    async def _run_async(self, fn, *args):
+        self._admit()
+        if not self.workers:
+            # Still keep bcrypt off the event loop
+            try:
+                return await asyncio.to_thread(fn, *args)
+            finally:
+                self._release()
+        return await asyncio.wrap_future(self._submit(fn, *args))
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def hash(self, password: str) -> str:
+        return self._run(_hash, password)
+
+    def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return self._run(_verify, plain_password, hashed_password)
+
+    async def hash_async(self, password: str) -> str:
+        return await self._run_async(_hash, password)
+
+    async def verify_async(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run_async(_verify, plain_password, hashed_password)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Rate:
+    """Allow `limit` requests per `period_seconds`, in bursts of up to `limit`."""
+    limit: int
+    period_seconds: float
+
+    @property
+    def per_second(self) -> float:
+        return self.limit / self.period_seconds
+
+
+class RateLimiter:
+    """
+    Checks and consumes request budgets. `limits` is a list of
+    (key, Rate) pairs, e.g. one per client IP and one per email; a
+    request is admitted only if every key has budget left, and only
+    then is it charged to all of them.
+    """
+
+    def hit(self, limits: list) -> float:
+        """Returns 0 if admitted, else the seconds to wait before retrying."""
+        raise NotImplementedError
+
+
+class MemoryRateLimiter(RateLimiter):
+    """
+    Process-local token buckets, one (tokens, updated, rate) tuple per
+    key. A bucket that has refilled completely holds no information,
+    so idle buckets are dropped by a sweep every sweep_seconds; beyond
+    max_keys the least recently used buckets are dropped as well.
+    Each worker process keeps its own buckets.
+    """
+
+    def __init__(self, max_keys: int = 100_000, sweep_seconds: float = 60):
+        self.max_keys = max_keys
+        self.sweep_seconds = sweep_seconds
+        self._buckets = OrderedDict()  # key -> (tokens, updated, rate), least recently used first
+        self._next_sweep = time.monotonic() + sweep_seconds
+        self._lock = threading.Lock()
+
+    def _tokens(self, key, rate: Rate, now: float) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return float(rate.limit)
+        tokens, updated, _ = bucket
+        return min(float(rate.limit), tokens + (now - updated) * rate.per_second)
+
+    def _sweep(self, now: float):
+        # Buckets are ordered by last use, so refilled ones sit at the
+        # front; stop at the first that isn't, rather than scan them all
+        while self._buckets:
+            key, (tokens, updated, rate) = next(iter(self._buckets.items()))
+            if tokens + (now - updated) * rate.per_second < rate.limit:
+                break
+            del self._buckets[key]
+        self._next_sweep = now + self.sweep_seconds
+
+    def hit(self, limits: list) -> float:
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            available = [(key, rate, self._tokens(key, rate, now)) for key, rate in limits]
+            wait = max(
+                ((1 - tokens) / rate.per_second for _, rate, tokens in available if tokens < 1),
+                default=0.0
+            )
+            if wait:
+                return wait
+            for key, rate, tokens in available:
+                self._buckets[key] = (tokens - 1, now, rate)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return 0.0
+
+    def __len__(self):
+        return len(self._buckets)
@@ -0,0 +1,60 @@
+import itertools
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+
+class ReplicaSet:
+    """
+    Round-robin over read replicas. A replica whose connection fails or
+    drops is skipped for retry_after_seconds, then tried again.
+    Sessions are tagged with info["replica"] = True.
+    """
+
+    def __init__(self, engines, retry_after_seconds: int = 30, **session_options):
+        self.retry_after_seconds = retry_after_seconds
+        self.engines = list(engines)
+        self._sessionmakers = [
+            async_sessionmaker(engine, info={"replica": True}, **session_options) for engine in self.engines
+        ]
+        self._down_until = [0.0] * len(self.engines)
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        for index, engine in enumerate(self.engines):
+            event.listen(engine.sync_engine, "handle_error", self._error_listener(index))
+
+    def _error_listener(self, index: int):
+        def handle_error(context):
+            # Failed connects have no connection; query errors don't count
+            if context.is_disconnect or context.connection is None:
+                self.mark_down(index)
+        return handle_error
+
+    def mark_down(self, index: int):
+        with self._lock:
+            self._down_until[index] = time.monotonic() + self.retry_after_seconds
+
+    def __len__(self):
+        return len(self.engines)
+
+    def candidates(self) -> list:
+        """Healthy replicas' sessionmakers, starting from the next in turn."""
+        if not self.engines:
+            return []
+        start = next(self._counter) % len(self.engines)
+        now = time.monotonic()
+        order = [(start + offset) % len(self.engines) for offset in range(len(self.engines))]
+        return [self._sessionmakers[index] for index in order if self._down_until[index] <= now]
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "replicas": len(self.engines),
+            "healthy": sum(1 for until in self._down_until if until <= now),
+        }
+
+    async def dispose(self):
+        for engine in self.engines:
+            await engine.dispose()
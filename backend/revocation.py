@@ -0,0 +1,69 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+
+class RevocationList:
+    """
+    In-process mirror of the revoked-token table, so checking a token
+    costs two dict lookups rather than a query. A row revokes either
+    one token (by jti) or, with jti NULL, every token the user was
+    issued before revoked_at. refresh() pulls only rows created since
+    the previous refresh; entries are dropped once the tokens they
+    cover would have expired anyway.
+    """
+
+    def __init__(self, model, overlap_seconds: float = 60):
+        self.model = model
+        # Rows from other workers may commit a little after their
+        # created_at, so each refresh re-reads this far back
+        self.overlap_seconds = overlap_seconds
+        self._jtis = {}   # jti -> expires_at (epoch seconds)
+        self._users = {}  # user_id -> (revoked_before, expires_at)
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+
+    def is_revoked(self, claims: dict) -> bool:
+        jti = claims.get("jti")
+        if jti is not None and jti in self._jtis:
+            return True
+        entry = self._users.get(claims.get("user_id"))
+        return entry is not None and (claims.get("iat") or 0) < entry[0]
+
+    def add(self, user_id: int, jti, revoked_at: datetime, expires_at: datetime):
+        expires = expires_at.timestamp()
+        with self._lock:
+            if jti is not None:
+                self._jtis[jti] = expires
+                return
+            revoked_before, previous_expires = self._users.get(user_id, (0.0, 0.0))
+            self._users[user_id] = (max(revoked_before, revoked_at.timestamp()), max(previous_expires, expires))
+
+    def add_row(self, row):
+        """Apply a row this worker just committed, without waiting for refresh()."""
+        self.add(row.user_id, row.jti, row.revoked_at, row.expires_at)
+
+    def refresh(self, db) -> int:
+        """Load rows added since the last refresh (all live rows the first time)."""
+        model = self.model
+        started = datetime.now()
+        stmt = select(model.user_id, model.jti, model.revoked_at, model.expires_at).where(model.expires_at > started)
+        if self._refreshed_at is not None:
+            stmt = stmt.where(model.created_at >= self._refreshed_at - timedelta(seconds=self.overlap_seconds))
+        rows = db.execute(stmt).all()
+        for row in rows:
+            self.add_row(row)
+        self._refreshed_at = started
+        self.prune()
+        return len(rows)
+
+    def prune(self):
+        now = time.time()
+        with self._lock:
+            self._jtis = {jti: expires for jti, expires in self._jtis.items() if expires > now}
+            self._users = {user_id: entry for user_id, entry in self._users.items() if entry[1] > now}
+
+    def __len__(self):
+        return len(self._jtis) + len(self._users)
@@ -0,0 +1,246 @@
+"""
+Production launcher: pre-forks uvicorn workers sharing one listening
+socket.
+
+    python serve.py --workers 4 --port 8000
+
+The app is built once in the master and the workers are forked from
+it, so they share its memory pages. Building it does no I/O; each
+worker builds its own services (pools, caches, background threads) and
+connects to the database in its lifespan. Each worker's pool is sized
+so that all of them together stay within DB_MAX_CONNECTIONS.
+
+Signals sent to the master:
+    TERM, INT   graceful shutdown: workers finish in-flight requests
+    HUP         graceful restart: workers are replaced one at a time,
+                each old one stopped before its replacement starts, so
+                there are never more than --workers processes (and
+                pools) within DB_MAX_CONNECTIONS. Code is not reloaded;
+                restart the master to deploy.
+
+Worker processes that die are replaced. In-process state (caches, rate
+limits, /metrics counters) is per worker; OTP_STORE=memory needs a
+single worker. The background jobs (email outbox, purge, suggestions
+refresh) run in one worker of the current generation; if it dies, its
+replacement takes them over.
+"""
+import argparse
+import os
+import select
+import signal
+import socket
+import time
+import traceback
+
+import uvicorn
+
+import main
+from config import get_settings
+
+RESPAWN_INTERVAL_SECONDS = 1
+
+
+def size_pools(settings, workers: int):
+    """
+    Settings for one of `workers` processes, with the request pool
+    shrunk so that workers x (request pool + background pool) fits in
+    DB_MAX_CONNECTIONS. Replicas get the same request pool each.
+    """
+    per_worker = settings.DB_MAX_CONNECTIONS // workers
+    request_connections = per_worker - settings.DB_BACKGROUND_POOL_SIZE
+    if request_connections < 1:
+        raise SystemExit(
+            f"❌ DB_MAX_CONNECTIONS={settings.DB_MAX_CONNECTIONS} is too low for {workers} workers "
+            f"with DB_BACKGROUND_POOL_SIZE={settings.DB_BACKGROUND_POOL_SIZE}"
+        )
+    if settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW <= request_connections:
+        return settings
+    pool_size = min(settings.DB_POOL_SIZE, request_connections)
+    return settings.model_copy(update={
+        "DB_POOL_SIZE": pool_size,
+        "DB_MAX_OVERFLOW": request_connections - pool_size,
+        "DB_POOL_PREWARM": min(settings.DB_POOL_PREWARM, pool_size),
+    })
+
+
+class WorkerServer(uvicorn.Server):
+    """uvicorn server that tells the master once its lifespan has started."""
+
+    def __init__(self, config, ready_fd: int):
+        super().__init__(config)
+        self.ready_fd = ready_fd
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets=sockets)
+        if self.started:
+            os.write(self.ready_fd, f"{os.getpid()}\n".encode())
+
+
+class Master:
+    def __init__(self, app, sock: socket.socket, workers: int, graceful_timeout: int, log_level: str):
+        self.app = app
+        self.sock = sock
+        self.worker_count = workers
+        self.graceful_timeout = graceful_timeout
+        self.log_level = log_level
+        self.workers = {}  # pid -> generation
+        self.jobs_worker = None  # pid running the background jobs
+        self.ready = set()
+        self.retiring = set()
+        self.generation = 0
+        self.last_spawn = 0.0
+        self.stopping = False
+        self.restarting = False
+        self.ready_read, self.ready_write = os.pipe()
+
+    def spawn(self) -> int:
+        runs_jobs = self.jobs_worker not in self.workers
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = self.generation
+            self.last_spawn = time.monotonic()
+            if runs_jobs:
+                self.jobs_worker = pid
+            return pid
+        try:
+            self.run_worker(runs_jobs)
+        except BaseException:
+            traceback.print_exc()
+            os._exit(1)
+        os._exit(0)
+
+    def run_worker(self, runs_jobs: bool):
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_DFL)
+        os.close(self.ready_read)
+        if not runs_jobs:
+            # Read by the lifespan, which runs after the fork
+            self.app.state.settings = self.app.state.settings.model_copy(update={"BACKGROUND_JOBS_ENABLED": False})
+        # Startup time as seen by /readyz: from fork, not master boot
+        main.BOOT_STARTED = time.perf_counter()
+        config = uvicorn.Config(
+            self.app,
+            lifespan="on",
+            log_level=self.log_level,
+            timeout_graceful_shutdown=self.graceful_timeout
+        )
+        WorkerServer(config, self.ready_write).run(sockets=[self.sock])
+
+    def current_workers(self) -> list:
+        return [pid for pid, generation in self.workers.items() if generation == self.generation]
+
+    def reap(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            if self.workers.pop(pid, None) is not None and pid not in self.retiring:
+                print(f"❌ Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}")
+            self.ready.discard(pid)
+            self.retiring.discard(pid)
+
+    def read_ready(self, timeout: float):
+        readable, _, _ = select.select([self.ready_read], [], [], timeout)
+        if readable:
+            for line in os.read(self.ready_read, 4096).decode().split():
+                self.ready.add(int(line))
+
+    def terminate(self, pids: list):
+        self.retiring.update(pids)
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while any(pid in self.workers for pid in pids) and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in pids:
+            if pid in self.workers:
+                os.kill(pid, signal.SIGKILL)
+        self.reap()
+
+    def restart(self):
+        """
+        Replace the workers one at a time: stop an old one, then start a
+        new one and wait until it's ready. The others keep serving
+        meanwhile, and the connection budget holds throughout.
+        """
+        self.restarting = False
+        # The jobs worker goes first, so its replacement takes them over
+        old = sorted(self.workers, key=lambda pid: pid != self.jobs_worker)
+        self.generation += 1
+        for pid in old:
+            if self.stopping:
+                break
+            self.terminate([pid])
+            new_pid = self.spawn()
+            deadline = time.monotonic() + self.graceful_timeout
+            while time.monotonic() < deadline and not self.stopping:
+                self.read_ready(0.1)
+                self.reap()
+                if new_pid in self.ready or new_pid not in self.workers:
+                    break
+        print(f"🔁 Restarted {len(old)} workers")
+
+    def handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def handle_restart(self, signum, frame):
+        self.restarting = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_restart)
+        for _ in range(self.worker_count):
+            self.spawn()
+        print(f"🚀 Serving on {self.sock.getsockname()} with {self.worker_count} workers (master {os.getpid()})")
+        while not self.stopping:
+            self.read_ready(0.5)
+            self.reap()
+            if self.restarting:
+                self.restart()
+            elif (len(self.current_workers()) < self.worker_count
+                    and time.monotonic() - self.last_spawn >= RESPAWN_INTERVAL_SECONDS):
+                self.spawn()
+        print("🛑 Shutting down workers")
+        self.terminate(list(self.workers))
+
+
+def cli():
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=settings.WEB_WORKERS or os.cpu_count() or 1)
+    parser.add_argument("--graceful-timeout", type=int, default=settings.GRACEFUL_TIMEOUT_SECONDS)
+    parser.add_argument("--log-level", default="warning")
+    args = parser.parse_args()
+
+    if settings.OTP_STORE == "memory" and args.workers > 1:
+        raise SystemExit("❌ OTP_STORE=memory keeps codes in one process; use OTP_STORE=sql with several workers")
+    worker_settings = size_pools(settings, args.workers)
+    if worker_settings.DB_MIGRATE:
+        # Once, here, rather than racing in every worker. Nothing stays
+        # connected across the fork.
+        database = main.Database(worker_settings)
+        main.create_schema(database)
+        database.engine.dispose()
+        worker_settings = worker_settings.model_copy(update={"DB_MIGRATE": False})
+    app = main.create_app(worker_settings)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    Master(app, sock, args.workers, args.graceful_timeout, args.log_level).run()
+
+
+if __name__ == "__main__":
+    cli()
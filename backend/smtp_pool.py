@@ -0,0 +1,94 @@
+import queue
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+
+class SMTPConnectionPool:
+    """
+    Small pool of persistent SMTP connections.
+    Connections are opened (STARTTLS + login) once and reused across
+    messages; idle ones are checked with NOOP before being handed out.
+    """
+
+    def __init__(self, host: str, port: int, username: Optional[str] = None,
+                 password: Optional[str] = None, starttls: bool = True,
+                 size: int = 2, timeout: float = 30, max_idle_seconds: float = 60):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.size = size
+        self.timeout = timeout
+        self.max_idle_seconds = max_idle_seconds
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                server.starttls()
+            if self.username and self.password:
+                server.login(self.username, self.password)
+        except Exception:
+            self._discard(server)
+            raise
+        return server
+
+    def _discard(self, server: smtplib.SMTP):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def _checkout(self) -> smtplib.SMTP:
+        while True:
+            try:
+                server, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+
+            if time.monotonic() - last_used < self.max_idle_seconds:
+                return server
+
+            # Idle for a while: the server may have dropped us
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except Exception:
+                pass
+            self._discard(server)
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        server = None
+        try:
+            server = self._checkout()
+            yield server
+        except Exception:
+            # Connection state is unknown after a failure, don't reuse it
+            if server is not None:
+                self._discard(server)
+                server = None
+            raise
+        finally:
+            if server is not None:
+                self._idle.put((server, time.monotonic()))
+            self._slots.release()
+
+    def send(self, sender: str, recipient: str, message: str):
+        with self.connection() as server:
+            server.sendmail(sender, recipient, message)
+
+    def close(self):
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(server)
@@ -0,0 +1,59 @@
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+# Appended: benchmark scripts share some module names with the app
+sys.path.append(os.path.join(BACKEND_DIR, "benchmarks"))
+
+@pytest.fixture
+def settings(tmp_path, monkeypatch):
+    """Settings for an app on a fresh SQLite database, with background jobs off."""
+    environment = {
+        "DATABASE_URL": f"sqlite:///{tmp_path / 'test.db'}",
+        "DB_MIGRATE": "true",
+        "DATABASE_REPLICA_URLS": "",
+        "INGEST_API_KEY": "test-ingest-key",
+        "BACKGROUND_JOBS_ENABLED": "false",
+        "BCRYPT_ROUNDS": "4",
+        "PASSWORD_HASH_WORKERS": "0",
+        "RATE_LIMIT_ENABLED": "false",
+    }
+    for name, value in environment.items():
+        monkeypatch.setenv(name, value)
+    from config import Settings
+    return Settings()
+
+
+@pytest.fixture
+def client(settings):
+    from fastapi.testclient import TestClient
+
+    import main
+    with TestClient(main.create_app(settings)) as client:
+        yield client
+
+
+@pytest.fixture
+def services(client):
+    return client.app.state.services
+
+
+@pytest.fixture
+def ingest_headers(settings):
+    return {"X-Ingest-Key": settings.INGEST_API_KEY}
+
+
+@pytest.fixture
+def user(services):
+    """A verified user: (user_id, request headers carrying their token)."""
+    import main
+    with services.database.SessionLocal() as db:
+        account = main.User(email="user@example.com", is_active=True, is_verified=True)
+        db.add(account)
+        db.commit()
+        user_id = account.id
+    token = main.create_access_token(services, {"user_id": user_id, "email": "user@example.com"})
+    return user_id, {"Authorization": f"Bearer {token}"}
@@ -0,0 +1,77 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select
+
+import main
+from otp_store import MemoryOTPStore, SQLOTPStore
+
+
+@pytest.fixture(params=["memory", "sql", "sql (no upsert)"])
+def store(request, client, services, user):
+    """(store, call) where call(method, *args) runs a store method in one committed session."""
+    if request.param == "memory":
+        otp_store = MemoryOTPStore()
+    elif request.param == "sql":
+        otp_store = SQLOTPStore(main.OTP, main.dialect_insert)
+    else:
+        otp_store = SQLOTPStore(main.OTP, lambda dialect: None)
+
+    async def run(method, *args):
+        async with services.database.AsyncSessionLocal() as db:
+            result = await getattr(otp_store, method)(db, user[0], *args)
+            await db.commit()
+            return result
+
+    return otp_store, lambda method, *args: client.portal.call(run, method, *args)
+
+
+def expires_in(minutes: float) -> datetime:
+    return datetime.now() + timedelta(minutes=minutes)
+
+
+def test_get_returns_the_code_put(store):
+    _, call = store
+    assert call("get", "login") is None
+    call("put", "login", "123456", expires_in(10))
+    record = call("get", "login")
+    assert (record.code, record.is_verified) == ("123456", False)
+
+
+def test_consume_only_matches_once(store):
+    _, call = store
+    call("put", "login", "123456", expires_in(10))
+    assert call("consume", "login", "654321") is False
+    assert call("consume", "login", "123456") is True
+    assert call("consume", "login", "123456") is False
+    assert call("get", "login").is_verified is True
+
+
+def test_expired_code_is_not_consumed(store):
+    _, call = store
+    call("put", "login", "123456", expires_in(-1))
+    assert call("consume", "login", "123456") is False
+
+
+def test_put_replaces_the_live_code(store, services):
+    otp_store, call = store
+    call("put", "login", "111111", expires_in(10))
+    assert call("consume", "login", "111111") is True
+    call("put", "login", "222222", expires_in(10))
+    call("put", "signup", "333333", expires_in(10))
+    assert call("consume", "login", "111111") is False
+    assert call("get", "login").is_verified is False
+    assert call("consume", "login", "222222") is True
+    assert call("get", "signup").code == "333333"
+    if isinstance(otp_store, SQLOTPStore):
+        with services.database.SessionLocal() as db:
+            assert db.scalar(select(func.count()).select_from(main.OTP)) == 2
+
+
+def test_memory_store_evicts_oldest_beyond_max_entries():
+    otp_store = MemoryOTPStore(max_entries=2)
+    for user_id in (1, 2, 3):
+        asyncio.run(otp_store.put(None, user_id, "login", "123456", expires_in(10)))
+    assert len(otp_store) == 2
+    assert asyncio.run(otp_store.get(None, 1, "login")) is None
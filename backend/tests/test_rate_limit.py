@@ -0,0 +1,68 @@
+import pytest
+
+import rate_limit
+from rate_limit import MemoryRateLimiter, Rate
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A settable time.monotonic() for the limiter."""
+    now = [1000.0]
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_admits_a_burst_then_reports_the_wait(clock):
+    limiter = MemoryRateLimiter()
+    rate = Rate(limit=3, period_seconds=30)
+    assert [limiter.hit([("ip", rate)]) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.hit([("ip", rate)]) == pytest.approx(10.0)
+
+
+def test_refills_over_time(clock):
+    limiter = MemoryRateLimiter()
+    rate = Rate(limit=2, period_seconds=10)
+    limiter.hit([("ip", rate)])
+    limiter.hit([("ip", rate)])
+    clock[0] += 4
+    assert limiter.hit([("ip", rate)]) == pytest.approx(1.0)
+    clock[0] += 1
+    assert limiter.hit([("ip", rate)]) == 0.0
+
+
+def test_rejected_request_charges_no_key(clock):
+    limiter = MemoryRateLimiter()
+    generous, strict = Rate(limit=10, period_seconds=10), Rate(limit=1, period_seconds=10)
+    assert limiter.hit([("ip", generous), ("email", strict)]) == 0.0
+    assert limiter.hit([("ip", generous), ("email", strict)]) > 0
+    # Only the admitted request was charged to the IP
+    assert [limiter.hit([("ip", generous)]) for _ in range(9)] == [0.0] * 9
+    assert limiter.hit([("ip", generous)]) > 0
+
+
+def test_keys_are_independent(clock):
+    limiter = MemoryRateLimiter()
+    rate = Rate(limit=1, period_seconds=60)
+    assert limiter.hit([("a", rate)]) == 0.0
+    assert limiter.hit([("b", rate)]) == 0.0
+    assert limiter.hit([("a", rate)]) > 0
+
+
+def test_drops_least_recently_used_keys_beyond_max_keys(clock):
+    limiter = MemoryRateLimiter(max_keys=2)
+    rate = Rate(limit=1, period_seconds=60)
+    for key in ("a", "b", "c"):
+        limiter.hit([(key, rate)])
+    assert len(limiter) == 2
+    # "a" was forgotten, so it has its full budget again
+    assert limiter.hit([("a", rate)]) == 0.0
+
+
+def test_sweep_drops_refilled_buckets(clock):
+    limiter = MemoryRateLimiter(sweep_seconds=60)
+    limiter.hit([("idle", Rate(limit=1, period_seconds=10))])
+    limiter.hit([("busy", Rate(limit=1, period_seconds=600))])
+    clock[0] += 60
+    limiter.hit([("new", Rate(limit=5, period_seconds=10))])
+    assert len(limiter) == 2
+    assert limiter.hit([("busy", Rate(limit=1, period_seconds=600))]) > 0
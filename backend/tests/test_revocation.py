@@ -0,0 +1,73 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+from revocation import RevocationList
+
+
+@pytest.fixture
+def revoke(services, user):
+    """A function inserting a revoked_tokens row for the user."""
+    def insert(jti=None, revoked_at=None, expires_in=timedelta(hours=1)):
+        now = datetime.now()
+        with services.database.SessionLocal() as db:
+            db.add(main.RevokedToken(
+                user_id=user[0], jti=jti, revoked_at=revoked_at or now, expires_at=now + expires_in
+            ))
+            db.commit()
+    return insert
+
+
+def refresh(services, revocation_list: RevocationList) -> int:
+    with services.database.SessionLocal() as db:
+        return revocation_list.refresh(db)
+
+
+def test_revokes_one_token_by_jti(services, user, revoke):
+    revoke(jti="revoked")
+    revocation_list = RevocationList(main.RevokedToken)
+    assert refresh(services, revocation_list) == 1
+    assert revocation_list.is_revoked({"user_id": user[0], "jti": "revoked", "iat": time.time()})
+    assert not revocation_list.is_revoked({"user_id": user[0], "jti": "other", "iat": time.time()})
+
+
+def test_revoke_all_covers_tokens_issued_before_it(services, user, revoke):
+    revoked_at = datetime.now() - timedelta(minutes=5)
+    revoke(revoked_at=revoked_at)
+    revocation_list = RevocationList(main.RevokedToken)
+    refresh(services, revocation_list)
+    issued_before = revoked_at.timestamp() - 60
+    issued_after = revoked_at.timestamp() + 60
+    assert revocation_list.is_revoked({"user_id": user[0], "jti": "a", "iat": issued_before})
+    assert not revocation_list.is_revoked({"user_id": user[0], "jti": "b", "iat": issued_after})
+    assert not revocation_list.is_revoked({"user_id": user[0] + 1, "jti": "c", "iat": issued_before})
+
+
+def test_refresh_picks_up_new_rows_and_skips_expired_ones(services, user, revoke):
+    revocation_list = RevocationList(main.RevokedToken)
+    revoke(jti="expired", expires_in=timedelta(seconds=-1))
+    assert refresh(services, revocation_list) == 0
+    revoke(jti="later")
+    refresh(services, revocation_list)
+    assert revocation_list.is_revoked({"user_id": user[0], "jti": "later"})
+    assert not revocation_list.is_revoked({"user_id": user[0], "jti": "expired"})
+
+
+def test_prune_drops_entries_once_their_tokens_expire(user):
+    revocation_list = RevocationList(main.RevokedToken)
+    now = datetime.now()
+    revocation_list.add(user[0], "old", now, now - timedelta(seconds=1))
+    revocation_list.add(user[0], None, now, now - timedelta(seconds=1))
+    revocation_list.add(user[0], "live", now, now + timedelta(hours=1))
+    revocation_list.prune()
+    assert len(revocation_list) == 1
+    assert revocation_list.is_revoked({"user_id": user[0], "jti": "live"})
+
+
+def test_logout_revokes_the_token(client, user):
+    _, headers = user
+    assert client.get("/api/user/profile", headers=headers).status_code == 200
+    assert client.post("/api/auth/logout", headers=headers).status_code == 200
+    assert client.get("/api/user/profile", headers=headers).status_code == 401
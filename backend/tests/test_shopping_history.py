@@ -0,0 +1,178 @@
+"""
+Bulk ingest error reporting, status transitions and delta sync
+(/shopping-history/changes) for the shopping history endpoints.
+"""
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+import main
+
+
+@pytest.fixture
+def ingest(client, ingest_headers):
+    def post(*records):
+        body = "\n".join(record if isinstance(record, str) else json.dumps(record) for record in records)
+        response = client.post(
+            "/shopping-history/bulk",
+            content=body,
+            headers={**ingest_headers, "Content-Type": "application/x-ndjson"}
+        )
+        assert response.status_code == 200, response.text
+        return response.json()
+    return post
+
+
+@pytest.fixture
+def transition(client, ingest_headers):
+    def post(*transitions):
+        response = client.post(
+            "/shopping-history/status-transitions",
+            json={"transitions": [{"id": row_id, "status": status} for row_id, status in transitions]},
+            headers=ingest_headers
+        )
+        assert response.status_code == 200, response.text
+        return response.json()
+    return post
+
+
+def order(user_id: int, token: str, **fields) -> dict:
+    return {"user_id": user_id, "token": token, "product_name": token.upper(), "price_per_unit": 1.0, **fields}
+
+
+def history(client, headers) -> dict:
+    """{product_name: item} for the user's whole history."""
+    return {item["product_name"]: item for item in client.get("/shopping-history", headers=headers).json()["items"]}
+
+
+def changes(client, headers, since: str, limit: int = 100) -> dict:
+    response = client.get("/shopping-history/changes", params={"since": since, "limit": limit}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+# ============= BULK INGEST =============
+def test_ingest_reports_bad_rows_by_line_and_keeps_the_rest(client, user, ingest):
+    user_id, headers = user
+    report = ingest(
+        order(user_id, "a", quantity=2, price_per_unit=2.5),
+        "not json",
+        order(user_id, "b", price_per_unit=1e12),
+        order(user_id, "c", price_per_unit=30000, quantity=1000),
+        order(user_id + 1, "d"),
+        order(user_id, "e", status="pending"),
+    )
+    assert (report["accepted"], report["duplicates"], report["rejected"]) == (2, 0, 4)
+    errors = {error["line"]: error["error"] for error in report["errors"]}
+    assert sorted(errors) == [2, 3, 4, 5]
+    assert errors[2].startswith("invalid JSON")
+    assert errors[3].startswith("price_per_unit:")
+    assert errors[4].startswith("total_price:")
+    assert "unknown user" in errors[5]
+    
+    rows = history(client, headers)
+    assert sorted(rows) == ["A", "E"]
+    assert (rows["A"]["total_price"], rows["E"]["status"]) == (5.0, "pending")
+
+
+def test_ingest_skips_tokens_already_loaded(user, ingest):
+    user_id, _ = user
+    assert ingest(order(user_id, "a"), order(user_id, "b"))["accepted"] == 2
+    report = ingest(order(user_id, "a"), order(user_id, "b"), order(user_id, "c"))
+    assert (report["accepted"], report["duplicates"], report["rejected"]) == (1, 2, 0)
+
+
+def test_ingest_requires_the_key(client):
+    assert client.post("/shopping-history/bulk", content="", headers={"X-Ingest-Key": "wrong"}).status_code == 403
+
+
+# ============= STATUS TRANSITIONS =============
+def test_status_transitions_follow_the_allowed_changes(client, user, ingest, transition):
+    user_id, headers = user
+    ingest(order(user_id, "a", status="pending"), order(user_id, "b"))
+    ids = {name: item["id"] for name, item in history(client, headers).items()}
+    
+    report = transition(
+        (ids["A"], "processing"),
+        (ids["B"], "pending"),
+        (ids["A"], "completed"),
+        (ids["A"] + ids["B"], "cancelled"),
+    )
+    assert [(result["result"], result["status"]) for result in report["results"]] == [
+        ("updated", "processing"),
+        ("invalid_transition", "completed"),
+        ("duplicate", None),
+        ("not_found", None),
+    ]
+    assert (report["updated"], report["rejected"]) == (1, 3)
+    rows = history(client, headers)
+    assert (rows["A"]["status"], rows["B"]["status"]) == ("processing", "completed")
+
+
+# ============= DELTA SYNC =============
+def test_changes_pages_through_updates_and_deletes_in_order(client, services, user, ingest, transition):
+    user_id, headers = user
+    ingest(order(user_id, "a", status="pending"), order(user_id, "b"), order(user_id, "c"))
+    page = client.get("/shopping-history", headers=headers).json()
+    ids = {item["product_name"]: item["id"] for item in page["items"]}
+    since = page["sync_cursor"]
+    assert changes(client, headers, since)["items"] == []
+    
+    with services.database.SessionLocal() as db:
+        # An app-set updated_at older than the cursor must not hide a change
+        db.execute(update(main.ShoppingHistory).values(updated_at=datetime(2000, 1, 1)))
+        db.commit()
+    ingest(order(user_id, "d"))
+    transition((ids["A"], "completed"))
+    with services.database.SessionLocal() as db:
+        db.delete(db.get(main.ShoppingHistory, ids["B"]))
+        db.commit()
+    
+    seen, deleted = [], []
+    while True:
+        result = changes(client, headers, since, limit=1)
+        seen += [(item["product_name"], item["status"]) for item in result["items"]]
+        deleted += result["deleted"]
+        since = result["sync_cursor"]
+        if not result["has_more"]:
+            break
+    assert seen == [("D", "completed"), ("A", "completed")]
+    assert deleted == [ids["B"]]
+    assert changes(client, headers, since) == {
+        "items": [], "deleted": [], "sync_cursor": since, "has_more": False, "reset": False
+    }
+
+
+def test_changes_resets_once_deletes_after_the_cursor_are_purged(client, services, user, ingest):
+    user_id, headers = user
+    ingest(order(user_id, "a"))
+    since = client.get("/shopping-history", headers=headers).json()["sync_cursor"]
+    with services.database.SessionLocal() as db:
+        row = db.scalars(select(main.ShoppingHistory)).one()
+        row_id = row.id
+        db.delete(row)
+        db.commit()
+        db.execute(update(main.ShoppingHistoryTombstone).values(
+            deleted_at=datetime.now() - timedelta(days=main.TOMBSTONE_RETENTION_DAYS + 1)
+        ))
+        db.commit()
+    assert changes(client, headers, since)["deleted"] == [row_id]
+    
+    assert main.purge_expired_rows(services.database)["shopping_history_tombstones"] == 1
+    assert changes(client, headers, since) == {
+        "items": [], "deleted": [], "sync_cursor": None, "has_more": False, "reset": True
+    }
+    # A cursor from after the purge resumes normally
+    since = client.get("/shopping-history", headers=headers).json()["sync_cursor"]
+    assert changes(client, headers, since)["reset"] is False
+
+
+def test_changes_resets_cursors_from_before_sync_versions(client, user):
+    _, headers = user
+    legacy = base64.urlsafe_b64encode(b"2024-01-01T00:00:00|1|2024-01-01T00:00:00|0").decode()
+    assert changes(client, headers, legacy)["reset"] is True
+    response = client.get("/shopping-history/changes", params={"since": "not a cursor"}, headers=headers)
+    assert response.status_code == 400
@@ -0,0 +1,30 @@
+"""
+Per-endpoint SQL statement budgets for the auth flows, from
+benchmarks/statement_counts.py. Run from backend/:
+
+    pip install -r tests/requirements.txt
+    python -m pytest tests
+"""
+import pytest
+
+from statement_counts import STATEMENT_BUDGETS, environment, measure
+
+
+@pytest.fixture(scope="module")
+def results(tmp_path_factory):
+    database_path = tmp_path_factory.mktemp("statements") / "statements.db"
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        for name, value in environment(str(database_path)).items():
+            monkeypatch.setenv(name, value)
+        return {name: (status_code, statements) for name, status_code, statements in measure()}
+
+
+def test_every_budgeted_endpoint_is_measured(results):
+    assert list(results) == list(STATEMENT_BUDGETS)
+
+
+@pytest.mark.parametrize("name", list(STATEMENT_BUDGETS))
+def test_statement_budget(results, name):
+    status_code, statements = results[name]
+    assert status_code == 200
+    assert len(statements) <= STATEMENT_BUDGETS[name], "\n".join(statements)
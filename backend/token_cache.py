@@ -0,0 +1,28 @@
+import hashlib
+import time
+from typing import Optional
+
+from ttl_cache import TTLCache
+
+
+class TokenCache(TTLCache):
+    """
+    Bounded LRU of verified JWT claims, keyed by the token's SHA-256
+    digest. An entry is only served until the token's own `exp`.
+    """
+
+    def __init__(self, max_entries: int = 10_000):
+        # `exp` is a Unix timestamp, so entries expire by the wall clock
+        super().__init__(max_entries, clock=time.time)
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        return super().get(self._key(token))
+
+    def put(self, token: str, claims: dict):
+        expires_at = claims.get("exp")
+        if isinstance(expires_at, (int, float)):
+            self.set(self._key(token), claims, expires_at)
@@ -1,13 +1,13 @@
 // C:\Users\PranavShelake\Desktop\project\frontend\smart-cart\src\components\layout\Navbar.jsx
 import { useSelector, useDispatch } from 'react-redux';
-import { logout } from '../../store/slices/authSlice';
+import { logoutAsync } from '../../store/slices/authSlice';
 
 const Navbar = ({ onAuthClick }) => {
   const { isAuthenticated, user } = useSelector((state) => state.auth);
   const dispatch = useDispatch();
 
   const handleLogout = () => {
-    dispatch(logout());
+    dispatch(logoutAsync());
   };
 
   return (
@@ -1,16 +1,43 @@
 // src/pages/ShoppingHistory.jsx
 import { useEffect, useState } from 'react';
 import { useDispatch, useSelector } from 'react-redux';
-import { fetchShoppingHistory, clearError } from '../store/slices/shoppingHistorySlice';
+import {
+  fetchShoppingHistory,
+  fetchShoppingSummary,
+  syncShoppingHistory,
+  searchShoppingHistory,
+  clearSearch,
+  clearError,
+} from '../store/slices/shoppingHistorySlice';
 
 const ShoppingHistory = () => {
   const dispatch = useDispatch();
-  const { items, loading, error } = useSelector((state) => state.shoppingHistory);
+  const { items, nextCursor, hasMore, search, summary, loading, error } = useSelector(
+    (state) => state.shoppingHistory
+  );
   const [searchTerm, setSearchTerm] = useState('');
   const [filterStatus, setFilterStatus] = useState('all');
 
+  // Status filtering happens on the server; reload from the first page
+  useEffect(() => {
+    dispatch(fetchShoppingHistory({ status: filterStatus }));
+  }, [dispatch, filterStatus]);
+
+  // Search runs on the server; wait for typing to pause before querying
+  const query = searchTerm.trim();
   useEffect(() => {
-    dispatch(fetchShoppingHistory());
+    if (!query) {
+      dispatch(clearSearch());
+      return;
+    }
+    const timer = setTimeout(() => {
+      dispatch(searchShoppingHistory({ query, status: filterStatus }));
+    }, 300);
+    return () => clearTimeout(timer);
+  }, [dispatch, query, filterStatus]);
+
+  useEffect(() => {
+    dispatch(fetchShoppingSummary());
   }, [dispatch]);
 
   useEffect(() => {
@@ -49,19 +76,18 @@ const ShoppingHistory = () => {
     return colors[status?.toLowerCase()] || 'bg-gray-100 text-gray-800';
   };
 
-  const filteredItems = items.filter((item) => {
-    const matchesSearch = item.product_name
-      ?.toLowerCase()
-      .includes(searchTerm.toLowerCase());
-    const matchesStatus =
-      filterStatus === 'all' || item.status?.toLowerCase() === filterStatus;
-    return matchesSearch && matchesStatus;
-  });
+  const filteredItems = query ? search.items : items;
+  const canLoadMore = query ? search.hasMore : hasMore;
 
-  const totalSpent = filteredItems.reduce(
-    (sum, item) => sum + (item.total_price || 0),
-    0
-  );
+  // Totals cover the whole history (not just loaded pages) and come
+  // from the summary endpoint
+  const statusTotals =
+    filterStatus === 'all'
+      ? summary
+      : summary?.by_status.find((entry) => entry.key === filterStatus);
+  const totalOrders = statusTotals?.order_count || 0;
+  const totalSpent = statusTotals?.total_spent || 0;
+  const totalItems = statusTotals?.item_count || 0;
 
   return (
     <div className="min-h-screen bg-gradient-to-br from-gray-50 to-gray-100 py-12 mt-5 px-4 sm:px-6 lg:px-8">
@@ -81,7 +107,10 @@ const ShoppingHistory = () => {
               </p>
             </div>
             <button
-              onClick={() => dispatch(fetchShoppingHistory())}
+              onClick={() => {
+                dispatch(syncShoppingHistory({ status: filterStatus }));
+                dispatch(fetchShoppingSummary());
+              }}
               className="px-4 py-2 bg-gradient-to-r from-blue-600 to-purple-600 text-white rounded-lg hover:scale-105 transition-transform duration-200 font-semibold shadow-md"
             >
               🔄 Refresh
@@ -97,7 +126,7 @@ const ShoppingHistory = () => {
                     Total Orders
                   </p>
                   <p className="text-3xl font-bold text-gray-900 mt-1">
-                    {filteredItems.length}
+                    {totalOrders}
                   </p>
                 </div>
                 <div className="p-3 bg-blue-100 rounded-lg">
@@ -153,10 +182,7 @@ const ShoppingHistory = () => {
                     Total Items
                   </p>
                   <p className="text-3xl font-bold text-gray-900 mt-1">
-                    {filteredItems.reduce(
-                      (sum, item) => sum + (item.quantity || 0),
-                      0
-                    )}
+                    {totalItems}
                   </p>
                 </div>
                 <div className="p-3 bg-purple-100 rounded-lg">
@@ -187,7 +213,7 @@ const ShoppingHistory = () => {
                 </label>
                 <input
                   type="text"
-                  placeholder="Search by product name..."
+                  placeholder="Search by product, category or address..."
                   value={searchTerm}
                   onChange={(e) => setSearchTerm(e.target.value)}
                   className="w-full px-4 py-2 border border-gray-300 rounded-lg focus:ring-2 focus:ring-blue-500 focus:border-transparent outline-none transition"
@@ -372,6 +398,21 @@ const ShoppingHistory = () => {
             </div>
           </div>
         )}
+
+        {!loading && canLoadMore && (
+          <div className="mt-6 text-center">
+            <button
+              onClick={() =>
+                query
+                  ? dispatch(searchShoppingHistory({ query, status: filterStatus, offset: search.nextOffset }))
+                  : dispatch(fetchShoppingHistory({ cursor: nextCursor, status: filterStatus }))
+              }
+              className="px-6 py-2 bg-white border border-gray-300 text-gray-700 rounded-lg hover:bg-gray-50 transition font-semibold shadow-sm"
+            >
+              Load more
+            </button>
+          </div>
+        )}
       </div>
     </div>
   );
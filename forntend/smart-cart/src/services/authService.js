@@ -106,6 +106,18 @@ const authService = {
     return res.json();
   },
 
+  logout: async (token) => {
+    const res = await fetch(`${API_BASE_URL}/api/auth/logout`, {
+      method: 'POST',
+      headers: { 'Authorization': `Bearer ${token}` }
+    });
+    if (!res.ok) {
+      const err = await res.json();
+      throw new Error(err.detail || 'Logout failed');
+    }
+    return res.json();
+  },
+
   getProfile: async (token) => {
     const res = await fetch(`${API_BASE_URL}/api/user/profile`, {
       headers: { 'Authorization': `Bearer ${token}` }
@@ -35,6 +35,18 @@ export const getProfileAsync = createAsyncThunk('auth/getProfile', async (token)
   return await authService.getProfile(token);
 });
 
+// Revokes the token server-side; the local session is cleared either way
+export const logoutAsync = createAsyncThunk('auth/logoutAsync', async (_, { getState, dispatch }) => {
+  const { token } = getState().auth;
+  try {
+    if (token) {
+      await authService.logout(token);
+    }
+  } finally {
+    dispatch(logout());
+  }
+});
+
 // Slice
 const authSlice = createSlice({
   name: 'auth',
@@ -3,13 +3,22 @@ import { createSlice, createAsyncThunk } from '@reduxjs/toolkit';
 import axios from 'axios';
 import { API_BASE_URL } from '../../utils/constants';
 
-// Async thunk to fetch shopping history
+// Async thunk to fetch a page of shopping history.
+// Pass `cursor` (from the previous page) to append, omit it to reload.
 export const fetchShoppingHistory = createAsyncThunk(
   'shoppingHistory/fetchAll',
-  async (_, { rejectWithValue }) => {
+  async ({ cursor, status } = {}, { getState, rejectWithValue }) => {
     try {
-      const response = await axios.get(`${API_BASE_URL}/shopping-history`);
-      return response.data;
+      const { token } = getState().auth;
+      const params = {};
+      if (cursor) params.cursor = cursor;
+      if (status && status !== 'all') params.status = status;
+
+      const response = await axios.get(`${API_BASE_URL}/shopping-history`, {
+        params,
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      return { ...response.data, append: !!cursor, status };
     } catch (error) {
       return rejectWithValue(
         error.response?.data?.detail || 'Failed to fetch shopping history'
@@ -18,10 +27,101 @@ export const fetchShoppingHistory = createAsyncThunk(
   }
 );
 
+// Async thunk to pull only what changed since the last load.
+// Follows `has_more` until caught up; falls back to a full reload when
+// there is nothing to sync from or the server asks for a reset.
+export const syncShoppingHistory = createAsyncThunk(
+  'shoppingHistory/sync',
+  async ({ status } = {}, { getState, dispatch, rejectWithValue }) => {
+    const { auth, shoppingHistory } = getState();
+    if (!shoppingHistory.syncCursor) {
+      await dispatch(fetchShoppingHistory({ status }));
+      return { reset: true };
+    }
+    try {
+      let since = shoppingHistory.syncCursor;
+      const items = [];
+      const deleted = [];
+      for (;;) {
+        const response = await axios.get(`${API_BASE_URL}/shopping-history/changes`, {
+          params: { since },
+          headers: { Authorization: `Bearer ${auth.token}` },
+        });
+        const page = response.data;
+        if (page.reset) {
+          await dispatch(fetchShoppingHistory({ status }));
+          return { reset: true };
+        }
+        items.push(...page.items);
+        deleted.push(...page.deleted);
+        since = page.sync_cursor;
+        if (!page.has_more) break;
+      }
+      return { items, deleted, syncCursor: since, status, reset: false };
+    } catch (error) {
+      return rejectWithValue(
+        error.response?.data?.detail || 'Failed to sync shopping history'
+      );
+    }
+  }
+);
+
+// Async thunk for server-side product search (ranked, prefix-matching).
+// Pass `offset` (from the previous page) to append.
+export const searchShoppingHistory = createAsyncThunk(
+  'shoppingHistory/search',
+  async ({ query, status, offset } = {}, { getState, rejectWithValue }) => {
+    try {
+      const { token } = getState().auth;
+      const params = { q: query };
+      if (offset) params.offset = offset;
+      if (status && status !== 'all') params.status = status;
+
+      const response = await axios.get(`${API_BASE_URL}/shopping-history/search`, {
+        params,
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      return { ...response.data, append: !!offset };
+    } catch (error) {
+      return rejectWithValue(
+        error.response?.data?.detail || 'Failed to search shopping history'
+      );
+    }
+  }
+);
+
+const emptySearch = { query: '', items: [], nextOffset: null, hasMore: false };
+
+const newestFirst = (a, b) =>
+  (b.created_at || '').localeCompare(a.created_at || '') || b.id - a.id;
+
+// Async thunk to fetch spending totals (computed server-side)
+export const fetchShoppingSummary = createAsyncThunk(
+  'shoppingHistory/fetchSummary',
+  async (_, { getState, rejectWithValue }) => {
+    try {
+      const { token } = getState().auth;
+      const response = await axios.get(`${API_BASE_URL}/shopping-history/summary`, {
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      return response.data;
+    } catch (error) {
+      return rejectWithValue(
+        error.response?.data?.detail || 'Failed to fetch shopping summary'
+      );
+    }
+  }
+);
+
 const shoppingHistorySlice = createSlice({
   name: 'shoppingHistory',
   initialState: {
     items: [],
+    nextCursor: null,
+    hasMore: false,
+    syncCursor: null,
+    search: emptySearch,
+    summary: null,
     loading: false,
     error: null,
     lastFetched: null,
@@ -30,8 +130,16 @@ const shoppingHistorySlice = createSlice({
     clearError: (state) => {
       state.error = null;
     },
+    clearSearch: (state) => {
+      state.search = emptySearch;
+    },
     clearShoppingHistory: (state) => {
       state.items = [];
+      state.nextCursor = null;
+      state.hasMore = false;
+      state.syncCursor = null;
+      state.search = emptySearch;
+      state.summary = null;
       state.error = null;
       state.lastFetched = null;
     },
@@ -44,16 +152,59 @@ const shoppingHistorySlice = createSlice({
       })
       .addCase(fetchShoppingHistory.fulfilled, (state, action) => {
         state.loading = false;
-        state.items = action.payload;
+        const { items, next_cursor, has_more, sync_cursor, append } = action.payload;
+        state.items = append ? [...state.items, ...items] : items;
+        state.nextCursor = next_cursor;
+        state.hasMore = has_more;
+        if (!append) state.syncCursor = sync_cursor;
         state.lastFetched = new Date().toISOString();
         state.error = null;
       })
       .addCase(fetchShoppingHistory.rejected, (state, action) => {
         state.loading = false;
         state.error = action.payload;
+      })
+      .addCase(syncShoppingHistory.fulfilled, (state, action) => {
+        const { items, deleted, syncCursor, status, reset } = action.payload;
+        if (reset) return;
+        // Rows older than the last loaded one belong to pages not fetched yet
+        const oldest = state.items[state.items.length - 1];
+        const changedIds = new Set([...deleted, ...items.map((item) => item.id)]);
+        const merged = state.items.filter((item) => !changedIds.has(item.id));
+        for (const item of items) {
+          const matchesFilter = !status || status === 'all' || item.status === status;
+          const loaded = !state.hasMore || !oldest || newestFirst(item, oldest) <= 0;
+          if (matchesFilter && loaded) merged.push(item);
+        }
+        state.items = merged.sort(newestFirst);
+        state.syncCursor = syncCursor;
+        state.lastFetched = new Date().toISOString();
+      })
+      .addCase(syncShoppingHistory.rejected, (state, action) => {
+        state.error = action.payload;
+      })
+      .addCase(searchShoppingHistory.pending, (state, action) => {
+        state.search.query = action.meta.arg.query;
+      })
+      .addCase(searchShoppingHistory.fulfilled, (state, action) => {
+        // Ignore responses for a query the user has since changed
+        if (action.meta.arg.query !== state.search.query) return;
+        const { items, next_offset, has_more, append } = action.payload;
+        state.search.items = append ? [...state.search.items, ...items] : items;
+        state.search.nextOffset = next_offset;
+        state.search.hasMore = has_more;
+      })
+      .addCase(searchShoppingHistory.rejected, (state, action) => {
+        state.error = action.payload;
+      })
+      .addCase(fetchShoppingSummary.fulfilled, (state, action) => {
+        state.summary = action.payload;
+      })
+      .addCase(fetchShoppingSummary.rejected, (state, action) => {
+        state.error = action.payload;
       });
   },
 });
 
-export const { clearError, clearShoppingHistory } = shoppingHistorySlice.actions;
+export const { clearError, clearSearch, clearShoppingHistory } = shoppingHistorySlice.actions;
 export default shoppingHistorySlice.reducer;
\ No newline at end of file